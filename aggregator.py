@@ -0,0 +1,110 @@
+from tinkoff.invest import CandleInterval
+
+# Старшие таймфреймы, которые собираются из минуток, и их длина в секундах
+AGGREGATE_SECONDS = {
+    CandleInterval.CANDLE_INTERVAL_5_MIN: 5 * 60,
+    CandleInterval.CANDLE_INTERVAL_15_MIN: 15 * 60,
+    CandleInterval.CANDLE_INTERVAL_HOUR: 60 * 60,
+    CandleInterval.CANDLE_INTERVAL_DAY: 24 * 60 * 60,
+}
+
+# Дневная свеча — торговый день по Москве (UTC+3 без перехода на летнее время)
+MOSCOW_OFFSET = 3 * 60 * 60
+
+
+def bucket(ts, interval, session_start=None):
+    # Начало бара, в который попадает минута ts (epoch, секунды)
+    seconds = AGGREGATE_SECONDS[interval]
+    if interval == CandleInterval.CANDLE_INTERVAL_DAY:
+        # Основная и вечерняя сессии одного дня — одна дневная свеча
+        return (ts + MOSCOW_OFFSET) // seconds * seconds - MOSCOW_OFFSET
+    start = ts - ts % seconds
+    # Сессия открылась посреди бара — бар начинается с открытия, а не склеивается
+    # с хвостом прошлой сессии, попавшим в тот же интервал
+    if session_start is not None and start < session_start <= ts:
+        start = int(session_start) - int(session_start) % 60
+    return start
+
+
+class Bar:
+    __slots__ = ("ts", "open", "high", "low", "close", "_volume", "_minute", "_minute_volume")
+
+    def __init__(self, ts, minute, open_, high, low, close, volume):
+        self.ts = ts
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self._volume = 0            # объём завершённых минут
+        self._minute = minute
+        self._minute_volume = volume
+
+    def merge(self, minute, high, low, close, volume):
+        # Минутная свеча приходит много раз, пока формируется: её объём — нарастающий,
+        # поэтому в сумму бара он попадает только когда началась следующая минута
+        if minute != self._minute:
+            self._volume += self._minute_volume
+            self._minute = minute
+        self._minute_volume = volume
+        self.high = max(self.high, high)
+        self.low = min(self.low, low)
+        self.close = close
+
+    @property
+    def volume(self):
+        return self._volume + self._minute_volume
+
+
+class CandleAggregator:
+    # Собирает 5м/15м/1ч/1д бары из одного потока минуток по каждому FIGI.
+    # calendar (MarketCalendar) нужен только чтобы бары не переходили через перерыв между сессиями.
+    def __init__(self, intervals=tuple(AGGREGATE_SECONDS), calendar=None):
+        self.intervals = [i for i in intervals if i in AGGREGATE_SECONDS]
+        self.calendar = calendar
+        self.bars = {}  # {(figi, interval): текущий Bar}
+
+    def _session_start(self, figi, ts):
+        if self.calendar is None:
+            return None
+        session = self.calendar.session(self.calendar.exchange_for(figi), ts)
+        return session[0] if session is not None and session[0] <= ts else None
+
+    def update(self, figi, ts, open_, high, low, close, volume=0):
+        # Минутка ts → список (interval, bar, closed), где closed — бар, который
+        # завершился с приходом этой минуты (или None)
+        session_start = self._session_start(figi, ts)
+        updated = []
+        for interval in self.intervals:
+            key = (figi, interval)
+            start = bucket(ts, interval, session_start)
+            bar = self.bars.get(key)
+            if bar is None or start > bar.ts:
+                self.bars[key] = new = Bar(start, ts, open_, high, low, close, volume)
+                updated.append((interval, new, bar))
+            elif start == bar.ts and ts >= bar._minute:
+                bar.merge(ts, high, low, close, volume)
+                updated.append((interval, bar, None))
+            # Минутки старше текущего бара (догрузка истории внахлёст) пропускаем
+        return updated
+
+    def current(self, figi, interval):
+        return self.bars.get((figi, interval))
+
+
+def aggregate(candles, interval, calendar=None, figi=""):
+    # Минутки {time, open, high, low, close, volume} → свечи interval в том же виде
+    # (для бэктестов и оптимизатора по минутному архиву). Последний бар может быть незакрытым
+    aggregator = CandleAggregator([interval], calendar)
+    bars = []
+    columns = ("time", "open", "high", "low", "close", "volume")
+    for row in zip(*(candles[name].tolist() for name in columns)):
+        for _, bar, closed in aggregator.update(figi, *row):
+            if closed is not None:
+                bars.append(closed)
+    last = aggregator.current(figi, interval)
+    if last is not None:
+        bars.append(last)
+    return {
+        "time": [b.ts for b in bars], "open": [b.open for b in bars], "high": [b.high for b in bars],
+        "low": [b.low for b in bars], "close": [b.close for b in bars], "volume": [b.volume for b in bars],
+    }
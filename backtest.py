@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import csv
+import datetime
+import logging
+
+import numpy as np
+
+from tinkoff.invest import CandleInterval
+
+from aggregator import AGGREGATE_SECONDS, aggregate
+from candle_store import CandleStore
+from indicators import RSI, rsi_series
+from state_store import StateStore
+from strategy import TradingStrategy
+
+# Комиссия брокера за сделку (доля от оборота)
+COMMISSION = 0.0005
+
+# Пороговые значения по умолчанию — как в strategy.py
+RSI_PERIOD = 14
+RSI_BUY = 45
+RSI_SELL = 60
+
+
+# ---------- Загрузка свечей ----------
+
+def load_candles(path, interval=None):
+    # .npz с массивами time/open/high/low/close/volume или .csv с такими же колонками.
+    # time — unix-время в секундах или ISO-строка. Если задан interval, path — FIGI
+    # в локальном архиве candle_store (колонки отдаются через memmap, без копирования).
+    # Архив хранит минутки, старшие интервалы собираются из них так же, как в MarketDataEngine.
+    if interval is not None:
+        store = CandleStore()
+        data = store.read(path, interval)
+        if not len(data["time"]) and interval in AGGREGATE_SECONDS:
+            minutes = store.read(path, CandleInterval.CANDLE_INTERVAL_1_MIN)
+            data = {k: np.asarray(v, dtype=minutes[k].dtype) for k, v in aggregate(minutes, interval, figi=path).items()}
+        if not len(data["time"]):
+            raise ValueError(f"В архиве нет свечей {path} ({interval.name}) — сначала загрузите их в candle_store")
+        return data
+    if path.endswith(".npz"):
+        data = np.load(path)
+        out = {k: data[k] for k in data.files}
+        if not len(out.get("time", ())):
+            raise ValueError(f"В {path} нет свечей")
+        return out
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError(f"В {path} нет свечей")
+    out = {}
+    for key in rows[0]:
+        if key == "time":
+            out[key] = np.array([_parse_time(r[key]) for r in rows], dtype=np.int64)
+        else:
+            out[key] = np.array([float(r[key]) for r in rows], dtype=np.float64)
+    return out
+
+
+def _parse_time(value):
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+# ---------- Векторный бэктест ----------
+
+def rsi_positions(rsi, buy=RSI_BUY, sell=RSI_SELL):
+    # Позиция (0/1) по правилу «купить при RSI < buy, продать при RSI > sell»
+    # без цикла: протягиваем вперёд последний сработавший сигнал.
+    signal = np.where(rsi < buy, 1, np.where(rsi > sell, -1, 0))
+    idx = np.where(signal != 0, np.arange(signal.shape[-1]), 0)
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    last = np.take_along_axis(signal, idx, axis=-1)
+    return (last > 0).astype(np.int8)
+
+
+def backtest_rsi(closes, period=RSI_PERIOD, buy=RSI_BUY, sell=RSI_SELL,
+                 commission=COMMISSION, rsi=None):
+    # closes — (свечи,) или (инструменты × свечи). Сделка исполняется по закрытию
+    # свечи с сигналом, доход идёт со следующей. Возвращает кривую капитала по строкам.
+    closes = np.asarray(closes, dtype=np.float64)
+    if closes.ndim == 1:
+        closes = closes[None, :]
+    if rsi is None:
+        rsi = rsi_series(closes, period)
+    pos = rsi_positions(rsi, buy, sell)
+    held = np.zeros_like(pos)
+    held[:, 1:] = pos[:, :-1]
+
+    returns = np.zeros_like(closes)
+    returns[:, 1:] = closes[:, 1:] / closes[:, :-1] - 1
+    turnover = np.abs(np.diff(held, axis=1, prepend=0))
+    equity = np.cumprod(1 + held * returns - turnover * commission, axis=1)
+    return {"equity": equity, "position": held}
+
+
+def max_drawdown(equity):
+    peak = np.maximum.accumulate(equity, axis=-1)
+    return (1 - equity / peak).max(axis=-1)
+
+
+def trade_log(times, closes, held, commission=COMMISSION):
+    # Список сделок одной строки по точкам смены позиции; held[i] — позиция,
+    # удерживаемая на свече i, значит сделка прошла по закрытию свечи i - 1
+    changes = np.flatnonzero(np.diff(held, prepend=0)) - 1
+    trades = []
+    for entry, exit_ in zip(changes[::2], list(changes[1::2]) + [None]):
+        exit_idx = exit_ if exit_ is not None else len(closes) - 1
+        buy_price, sell_price = closes[entry], closes[exit_idx]
+        trades.append({
+            "entry_time": int(times[entry]),
+            "exit_time": int(times[exit_idx]),
+            "buy": float(buy_price),
+            "sell": float(sell_price),
+            "pnl": float(sell_price / buy_price - 1 - 2 * commission),
+            "open": exit_ is None,
+        })
+    return trades
+
+
+def summary(equity, trades):
+    return {
+        "return": float(equity[-1] - 1),
+        "max_drawdown": float(max_drawdown(equity)),
+        "trades": len(trades),
+        "win_rate": float(np.mean([t["pnl"] > 0 for t in trades])) if trades else 0.0,
+    }
+
+
+# ---------- Прогон TradingStrategy на истории ----------
+
+class FakeTinkoffAPI:
+    # Подмена TinkoffAPI: цены идут из файла свечей, сделки — в виртуальный счёт
+    def __init__(self, candles, balance=100_000.0, period=RSI_PERIOD, commission=COMMISSION):
+        self.times = candles["time"]
+        self.closes = candles["close"]
+        self.i = 0
+        self.cash = balance
+        self.qty = 0
+        self.commission = commission
+        self.rsi = RSI(period)
+        self.trades = []
+
+    def step(self):
+        # Закрываем текущую свечу и переходим к следующей
+        self.rsi.update(float(self.closes[self.i]))
+        self.i += 1
+
+    def is_market_open(self, figi=None):
+        return True
+
+    async def get_last_price(self, figi):
+        return float(self.closes[self.i])
+
+    async def get_rsi(self, figi, *args, **kwargs):
+        value = self.rsi.peek(float(self.closes[self.i]))
+        return 50 if value is None else round(value, 2)
+
+    async def get_quantity(self, figi):
+        return self.qty
+
+    async def get_balance(self):
+        return self.cash
+
+    def get_orderbook(self, figi):
+        # Стакана в истории нет — стратегия решает только по RSI
+        return None
+
+    async def get_lot(self, figi):
+        return 1
+
+    async def get_lot_price_and_max_quantity(self, figi, balance):
+        price = await self.get_last_price(figi)
+        return price, int(balance // (price * (1 + self.commission)))
+
+    async def buy(self, figi, quantity=1):
+        price = await self.get_last_price(figi)
+        self.cash -= price * quantity * (1 + self.commission)
+        self.qty += quantity
+        self.trades.append(("buy", int(self.times[self.i]), price, quantity))
+        return price
+
+    async def sell(self, figi, quantity=1):
+        price = await self.get_last_price(figi)
+        self.cash += price * quantity * (1 - self.commission)
+        self.qty -= quantity
+        self.trades.append(("sell", int(self.times[self.i]), price, quantity))
+        return price
+
+    def equity(self):
+        return self.cash + self.qty * float(self.closes[min(self.i, len(self.closes) - 1)])
+
+
+class FakeBot:
+    # Подмена TelegramInterface: на всё соглашается и покупает максимум
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+
+    def send_status(self, key, message):
+        pass
+
+    async def ask_permission(self, message):
+        return True
+
+    async def recheck_price(self, figi, quoted, get_price):
+        return await get_price(figi)
+
+    async def ask_quantity(self, message, options):
+        return options[-1] if options else None
+
+
+async def replay(candles, balance=100_000.0, period=RSI_PERIOD):
+    api = FakeTinkoffAPI(candles, balance, period)
+    bot = FakeBot()
+    strategy = TradingStrategy(bot, api=api, state=StateStore(":memory:"))
+    equity = np.empty(len(api.closes))
+    for i in range(len(api.closes)):
+        await strategy.run()
+        await strategy.wait_pending()
+        equity[i] = api.equity() / balance
+        if i < len(api.closes) - 1:
+            api.step()
+    return equity, api.trades
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест RSI-стратегии на сохранённых свечах")
+    parser.add_argument("files", nargs="+", help=".npz или .csv со свечами (или FIGI с --store)")
+    parser.add_argument("--store", metavar="INTERVAL",
+                        help="брать свечи из локального архива, например 1_MIN или 5_MIN (собирается из минуток)")
+    parser.add_argument("--period", type=int, default=RSI_PERIOD)
+    parser.add_argument("--buy", type=float, default=RSI_BUY)
+    parser.add_argument("--sell", type=float, default=RSI_SELL)
+    parser.add_argument("--commission", type=float, default=COMMISSION)
+    parser.add_argument("--replay", action="store_true",
+                        help="прогнать сам TradingStrategy (медленно, пороги 45/60 из strategy.py)")
+    parser.add_argument("--trades", help="куда сохранить журнал сделок (.csv)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    rows = []
+    for path in args.files:
+        interval = CandleInterval["CANDLE_INTERVAL_" + args.store] if args.store else None
+        candles = load_candles(path, interval)
+        if args.replay:
+            equity, trades = asyncio.run(replay(candles, period=args.period))
+            result = {"return": float(equity[-1] - 1), "max_drawdown": float(max_drawdown(equity)),
+                      "trades": len(trades)}
+            trades = [{"side": side, "time": t, "price": p, "qty": q} for side, t, p, q in trades]
+        else:
+            res = backtest_rsi(candles["close"], args.period, args.buy, args.sell, args.commission)
+            trades = trade_log(candles["time"], candles["close"], res["position"][0], args.commission)
+            result = summary(res["equity"][0], trades)
+        print(f"{path}: доходность {result['return']:.2%}, просадка {result['max_drawdown']:.2%}, "
+              f"сделок {result['trades']}")
+        rows.extend(dict(file=path, **t) for t in trades)
+
+    if args.trades and rows:
+        with open(args.trades, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
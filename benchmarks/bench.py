@@ -0,0 +1,203 @@
+# Бенчмарки горячих путей бота на фейковом Tinkoff в том же процессе:
+#
+#   python benchmarks/bench.py --sizes 5 100 1000 --latency 0.005 --output bench.json
+#   python benchmarks/bench.py --compare bench.json --threshold 0.25
+#
+# Результат — JSON со средним/медианой/p95 по каждому замеру. С --compare сравниваем
+# с прошлым прогоном и выходим с кодом 1, если медиана выросла больше порога.
+# Нужен тот же config.py, что и для main.ru; токен не используется — канал подменён.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from tinkoff.invest import CandleInterval
+
+import candle_store
+import client_pool
+import execution
+import instruments
+import ledger
+import portfolio_cache
+import risk
+import state_store
+from fake_tinkoff import FakeServices
+
+SIZES = (5, 100, 1000)
+REPEAT = 20
+ORDER_REPEAT = 50
+
+
+def _stats(name, size, samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "name": name,
+        "instruments": size,
+        "runs": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "median_ms": round(statistics.median(ms), 4),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 4),
+        "min_ms": round(ms[0], 4),
+        "max_ms": round(ms[-1], 4),
+    }
+
+
+async def _measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _install(size, latency, jitter, workdir):
+    # Свежий фейковый сервер и чистые синглтоны на каждый размер
+    tickers = {f"B{i:04d}": f"BENCH{i:08d}" for i in range(size)}
+    held = list(tickers.values())[::2]
+    services = FakeServices(tickers, account_id=os.environ["TINKOFF_ACCOUNT_ID"],
+                            latency=latency, jitter=jitter, held=held)
+    pool = client_pool.ClientPool(None)
+    pool.use(services)
+    client_pool._pool = pool
+    instruments._registry = instruments.InstrumentRegistry(
+        path=os.path.join(workdir, f"instruments-{size}.json.gz"), pool=pool
+    )
+    candle_store._store = candle_store.CandleStore(os.path.join(workdir, f"candles-{size}"), pool=pool)
+    state_store._store = state_store.StateStore(":memory:")
+    for singletons in (portfolio_cache._caches, ledger._ledgers, execution._engines, risk._managers):
+        singletons.clear()
+    return services, list(tickers), list(tickers.values())
+
+
+async def bench_size(size, args, workdir):
+    from indicators import rsi_batch
+    from market_data import MarketDataEngine
+    import rsi_strategy
+    from tinkoff_api import TinkoffAPI
+
+    services, tickers, figis = _install(size, args.latency, args.jitter, workdir)
+    results = []
+    await instruments.get_registry().load()
+
+    # --- Индикаторы без сети ---
+    engine = MarketDataEngine(figis)
+    await engine.start()
+    closes = [engine.closes(figi, n=rsi_strategy.LOOKBACK).tolist() for figi in figis]
+
+    async def calculate_all():
+        for c in closes:
+            rsi_strategy.calculate_rsi(c)
+    results.append(_stats("calculate_rsi", size, await _measure(calculate_all, args.repeat)))
+
+    async def batch():
+        rsi_batch(engine.matrix(figis, n=rsi_strategy.LOOKBACK), rsi_strategy.RSI_PERIOD)
+    results.append(_stats("rsi_batch", size, await _measure(batch, args.repeat)))
+
+    # --- Скан rsi_strategy: один проход по всем инструментам ---
+    state = state_store.get_state_store()
+
+    async def scan():
+        await rsi_strategy.scan_once(engine, tickers, figis, state)
+    results.append(_stats("scan_once", size, await _measure(scan, args.repeat)))
+
+    # --- get_rsi: из буферов движка и через RPC ---
+    api = TinkoffAPI()
+    api.risk.max_orders_per_minute = float("inf")
+    engine_5m = MarketDataEngine(figis, intervals=[CandleInterval.CANDLE_INTERVAL_5_MIN])
+    await engine_5m.start()
+
+    async def get_rsi_all():
+        await asyncio.gather(*(api.get_rsi(figi) for figi in figis))
+
+    api.market_data = engine_5m
+    results.append(_stats("get_rsi_engine", size, await _measure(get_rsi_all, args.repeat)))
+    api.market_data = None
+    results.append(_stats("get_rsi_rpc", size, await _measure(get_rsi_all, args.repeat)))
+    api.market_data = engine_5m
+
+    # --- Заявки: путь buy/sell через риск-проверки и ExecutionEngine ---
+    held = [figi for figi in figis if figi in services.securities]
+    order_figis = (held * (args.order_repeat // len(held) + 1))[:args.order_repeat]
+    for side in ("buy", "sell"):
+        samples = []
+        for figi in order_figis:
+            started = time.perf_counter()
+            await getattr(api, side)(figi, 1)
+            samples.append(time.perf_counter() - started)
+        results.append(_stats(side, size, samples))
+
+    await engine.stop()
+    await engine_5m.stop()
+    state_store.get_state_store().close()
+    for r in results:
+        r["rpc_calls"] = services.calls
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["instruments"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        old = baseline.get((r["name"], r["instruments"]))
+        if old is None or not old["median_ms"]:
+            continue
+        change = r["median_ms"] / old["median_ms"] - 1
+        r["change"] = round(change, 4)
+        if change > threshold:
+            regressions.append(f"{r['name']}@{r['instruments']}: {old['median_ms']} → {r['median_ms']} мс "
+                               f"(+{change:.0%})")
+    return regressions
+
+
+async def main(args):
+    os.environ.setdefault("TINKOFF_ACCOUNT_ID", "bench")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results.extend(await bench_size(size, args, workdir))
+            print(f"готово: {size} инструментов", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки на фейковом Tinkoff API")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="сколько инструментов")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка каждого RPC, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, доля")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="повторов каждого замера")
+    parser.add_argument("--order-repeat", type=int, default=ORDER_REPEAT, help="заявок на buy и на sell")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление медианы")
+    sys.exit(asyncio.run(main(parser.parse_args())))
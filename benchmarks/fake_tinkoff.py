@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import math
+import random
+import uuid
+from types import SimpleNamespace as NS
+
+from tinkoff.invest import CandleInterval, OrderDirection, OrderExecutionReportStatus
+
+# Фейковые сервисы Tinkoff в том же процессе: тот же интерфейс, что у AsyncServices
+# (client.market_data.get_candles(...), client.orders.post_order(...) и т.д.), ответы —
+# объекты с теми же полями. Подставляется в ClientPool через pool.use(services).
+
+INTERVAL_MINUTES = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: 1,
+    CandleInterval.CANDLE_INTERVAL_5_MIN: 5,
+    CandleInterval.CANDLE_INTERVAL_15_MIN: 15,
+    CandleInterval.CANDLE_INTERVAL_HOUR: 60,
+    CandleInterval.CANDLE_INTERVAL_DAY: 24 * 60,
+}
+
+
+def quotation(value):
+    units = int(value)
+    return NS(units=units, nano=int(round((value - units) * 1e9)), currency="rub")
+
+
+def _utc(dt):
+    return dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+
+
+class FakeMarket:
+    # Детерминированные цены: сумма синусоид со своей фазой у каждого FIGI,
+    # так что RSI гуляет по всему диапазону и сигналы иногда срабатывают
+    def __init__(self, figis, base_price=100.0):
+        rnd = random.Random(42)
+        self.params = {
+            figi: (base_price * (0.5 + rnd.random()), rnd.random() * 6.28, rnd.random() * 6.28)
+            for figi in figis
+        }
+
+    def price(self, figi, minute):
+        base, p1, p2 = self.params.get(figi, (100.0, 0.0, 0.0))
+        return round(base * (1 + 0.02 * math.sin(minute / 37 + p1) + 0.01 * math.sin(minute / 11 + p2)), 2)
+
+    def candles(self, figi, from_, to, interval):
+        step = INTERVAL_MINUTES[interval]
+        first = int(_utc(from_).timestamp() // 60 // step + 1) * step
+        last = int(_utc(to).timestamp() // 60 // step) * step
+        result = []
+        for minute in range(first, last + 1, step):
+            close = self.price(figi, minute)
+            result.append(NS(
+                time=datetime.datetime.fromtimestamp(minute * 60, datetime.timezone.utc),
+                open=quotation(close), high=quotation(close), low=quotation(close),
+                close=quotation(close), volume=100, is_complete=minute < last,
+            ))
+        return result
+
+    def last_price(self, figi):
+        return self.price(figi, int(datetime.datetime.now(datetime.timezone.utc).timestamp() // 60))
+
+
+class _Service:
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def _wait(self):
+        await self.owner.delay()
+
+
+class FakeMarketData(_Service):
+    async def get_candles(self, figi, from_, to, interval, **kwargs):
+        await self._wait()
+        return NS(candles=self.owner.market.candles(figi, from_, to, interval))
+
+    async def get_last_prices(self, figi, **kwargs):
+        await self._wait()
+        return NS(last_prices=[
+            NS(figi=f, price=quotation(self.owner.market.last_price(f)),
+               time=datetime.datetime.now(datetime.timezone.utc))
+            for f in figi
+        ])
+
+
+class FakeOperations(_Service):
+    async def get_portfolio(self, account_id, **kwargs):
+        await self._wait()
+        owner = self.owner
+        positions = [
+            NS(figi=figi, quantity=quotation(qty),
+               average_position_price=quotation(owner.market.last_price(figi)),
+               current_price=quotation(owner.market.last_price(figi)))
+            for figi, qty in owner.securities.items()
+        ]
+        positions.append(NS(figi="RUB000UTSTOM", quantity=quotation(owner.cash),
+                            average_position_price=quotation(1.0), current_price=quotation(1.0)))
+        return NS(positions=positions)
+
+    async def get_positions(self, account_id, **kwargs):
+        await self._wait()
+        owner = self.owner
+        return NS(
+            money=[quotation(owner.cash)],
+            blocked=[],
+            securities=[NS(figi=f, balance=q, blocked=0) for f, q in owner.securities.items()],
+        )
+
+    async def get_withdraw_limits(self, account_id, **kwargs):
+        await self._wait()
+        return NS(money=[quotation(self.owner.cash)], blocked=[], blocked_guarantee=[])
+
+    async def get_operations(self, account_id, from_=None, to=None, state=None, **kwargs):
+        await self._wait()
+        return NS(operations=[])
+
+
+class FakeOrders(_Service):
+    async def post_order(self, figi, quantity, direction, account_id, order_type, order_id, price=None, **kwargs):
+        await self._wait()
+        owner = self.owner
+        executed = owner.market.last_price(figi)
+        units = quantity * owner.lot
+        if direction == OrderDirection.ORDER_DIRECTION_BUY:
+            owner.cash -= executed * units
+            owner.securities[figi] = owner.securities.get(figi, 0) + units
+        else:
+            owner.cash += executed * units
+            owner.securities[figi] = owner.securities.get(figi, 0) - units
+        return NS(
+            order_id=f"fake-{order_id or uuid.uuid4()}",
+            execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+            lots_requested=quantity,
+            lots_executed=quantity,
+            executed_order_price=quotation(executed),
+        )
+
+    async def get_order_state(self, account_id, order_id, **kwargs):
+        await self._wait()
+        return NS(
+            execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+            lots_executed=0,
+            average_position_price=None,
+        )
+
+    async def cancel_order(self, account_id, order_id, **kwargs):
+        await self._wait()
+        return NS()
+
+
+class FakeInstruments(_Service):
+    async def shares(self, **kwargs):
+        await self._wait()
+        return NS(instruments=[
+            NS(figi=figi, ticker=ticker, class_code="TQBR", lot=self.owner.lot,
+               name=f"Bench {ticker}", currency="rub", exchange="MOEX")
+            for ticker, figi in self.owner.tickers.items()
+        ])
+
+    async def trading_schedules(self, from_=None, to=None, exchange="", **kwargs):
+        # Круглосуточные торги каждый день — бенчмарк не должен упираться в расписание
+        await self._wait()
+        first = _utc(from_).date()
+        days = [
+            NS(date=day, is_trading_day=True,
+               start_time=datetime.datetime.combine(day, datetime.time(0), datetime.timezone.utc),
+               end_time=datetime.datetime.combine(day, datetime.time(23, 59, 59), datetime.timezone.utc))
+            for day in (first + datetime.timedelta(days=i) for i in range((_utc(to).date() - first).days + 1))
+        ]
+        return NS(exchanges=[NS(exchange="MOEX", days=days)])
+
+    async def etfs(self, **kwargs):
+        await self._wait()
+        return NS(instruments=[])
+
+    bonds = etfs
+    currencies = etfs
+
+
+class FakeUsers(_Service):
+    async def get_accounts(self, **kwargs):
+        await self._wait()
+        return NS(accounts=[NS(id=self.owner.account_id, type="ACCOUNT_TYPE_TINKOFF")])
+
+    async def get_info(self, **kwargs):
+        await self._wait()
+        return NS(prem_status=False, qual_status=False)
+
+
+class _SilentStream(_Service):
+    # Стримы подключаются и молчат: в бенчмарке данные идут только через опрос
+    async def _forever(self, *args, **kwargs):
+        await asyncio.Event().wait()
+        yield  # без yield это была бы обычная корутина, а нужен асинхронный генератор
+
+    market_data_stream = _forever
+    trades_stream = _forever
+    positions_stream = _forever
+
+
+class FakeServices:
+    def __init__(self, tickers, account_id="bench", latency=0.0, jitter=0.0, cash=1e9, held=(), lot=1):
+        self.tickers = dict(tickers)        # {тикер: figi}
+        self.account_id = account_id
+        self.latency = latency              # задержка каждого вызова, секунды
+        self.jitter = jitter                # случайная добавка к задержке, доля от latency
+        self.cash = cash
+        self.lot = lot
+        self.securities = {figi: 1000 for figi in held}
+        self.market = FakeMarket(self.tickers.values())
+        self.calls = 0
+        self.market_data = FakeMarketData(self)
+        self.operations = FakeOperations(self)
+        self.orders = FakeOrders(self)
+        self.instruments = FakeInstruments(self)
+        self.users = FakeUsers(self)
+        self.market_data_stream = _SilentStream(self)
+        self.orders_stream = _SilentStream(self)
+        self.operations_stream = _SilentStream(self)
+
+    async def delay(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self.jitter * random.random()))
+        else:
+            await asyncio.sleep(0)
+
+    async def get_all_candles(self, figi, from_, to, interval, **kwargs):
+        await self.delay()
+        for candle in self.market.candles(figi, from_, to, interval):
+            yield candle
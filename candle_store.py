@@ -0,0 +1,169 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+import numpy as np
+
+from client_pool import get_pool
+from utils import quotation_to_float
+
+# Где лежит локальный архив свечей: candles/<FIGI>/<интервал>/<колонка>.bin
+CANDLES_DIR = "candles"
+
+COLUMNS = {
+    "time": np.int64,      # начало свечи, unix-время в секундах
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.int64,
+}
+
+
+def _ts(dt):
+    return int(dt.timestamp())
+
+
+def _dt(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+
+
+class CandleStore:
+    # Колоночный архив свечей: каждая колонка — плоский бинарный файл, читается
+    # через np.memmap без копирования. meta.json хранит уже скачанный диапазон
+    # (он шире, чем время свечей: выходные и ночи тоже считаются покрытыми).
+    def __init__(self, root=CANDLES_DIR, pool=None):
+        self.root = root
+        self.pool = pool or get_pool()
+        self._locks = {}
+
+    def _dir(self, figi, interval):
+        return os.path.join(self.root, figi, interval.name.replace("CANDLE_INTERVAL_", ""))
+
+    def _meta(self, figi, interval):
+        try:
+            with open(os.path.join(self._dir(figi, interval), "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, figi, interval, meta):
+        path = os.path.join(self._dir(figi, interval), "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def _count(self, directory):
+        # Если запись колонок оборвалась посередине — доверяем самой короткой
+        counts = []
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(directory, name + ".bin")
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            counts.append(size // np.dtype(dtype).itemsize)
+        return min(counts)
+
+    def read(self, figi, interval, start=None, end=None):
+        # {колонка: массив}; массивы — представления memmap, данные не копируются
+        directory = self._dir(figi, interval)
+        count = self._count(directory) if os.path.isdir(directory) else 0
+        if count == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        data = {
+            name: np.memmap(os.path.join(directory, name + ".bin"), dtype=dtype, mode="r", shape=(count,))
+            for name, dtype in COLUMNS.items()
+        }
+        lo = 0 if start is None else int(np.searchsorted(data["time"], _ts(start), "left"))
+        hi = count if end is None else int(np.searchsorted(data["time"], _ts(end), "right"))
+        return {name: column[lo:hi] for name, column in data.items()}
+
+    def closes(self, figi, interval, n=None):
+        close = self.read(figi, interval)["close"]
+        return close if n is None else close[-n:]
+
+    def _append(self, figi, interval, columns):
+        directory = self._dir(figi, interval)
+        os.makedirs(directory, exist_ok=True)
+        count = self._count(directory)
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(directory, name + ".bin")
+            with open(path, "ab") as f:
+                f.truncate(count * np.dtype(dtype).itemsize)
+                f.write(np.asarray(columns[name], dtype=dtype).tobytes())
+
+    def _prepend(self, figi, interval, columns):
+        # Редкий случай — догрузили историю раньше уже сохранённой: переписываем колонки
+        directory = self._dir(figi, interval)
+        old = {name: np.array(col) for name, col in self.read(figi, interval).items()}
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(directory, name + ".bin")
+            merged = np.concatenate([np.asarray(columns[name], dtype=dtype), old[name]])
+            merged.tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+
+    async def _download(self, figi, interval, from_, to):
+        rows = {name: [] for name in COLUMNS}
+        complete_to = to
+        async with self.pool.session() as client:
+            async for c in client.get_all_candles(figi=figi, from_=from_, to=to, interval=interval):
+                if not c.is_complete:
+                    # Незакрытую свечу не сохраняем — докачаем в следующий раз
+                    complete_to = min(complete_to, c.time)
+                    continue
+                rows["time"].append(_ts(c.time))
+                rows["open"].append(quotation_to_float(c.open))
+                rows["high"].append(quotation_to_float(c.high))
+                rows["low"].append(quotation_to_float(c.low))
+                rows["close"].append(quotation_to_float(c.close))
+                rows["volume"].append(c.volume)
+        return rows, complete_to
+
+    def _lock(self, figi, interval):
+        return self._locks.setdefault((figi, interval), asyncio.Lock())
+
+    async def sync(self, figi, interval, from_, to=None):
+        # Скачиваем только то, чего ещё нет: кусок до начала архива и кусок после конца
+        to = to or datetime.datetime.now(datetime.timezone.utc)
+        async with self._lock(figi, interval):
+            meta = self._meta(figi, interval)
+            if meta is None:
+                rows, covered_to = await self._download(figi, interval, from_, to)
+                self._append(figi, interval, rows)
+                meta = {"from": _ts(from_), "to": _ts(covered_to)}
+                self._write_meta(figi, interval, meta)
+                return len(rows["time"])
+
+            added = 0
+            if _ts(from_) < meta["from"]:
+                rows, _ = await self._download(figi, interval, from_, _dt(meta["from"]))
+                stored_from = self.read(figi, interval)["time"][:1]
+                if len(stored_from):
+                    keep = [i for i, t in enumerate(rows["time"]) if t < stored_from[0]]
+                    rows = {name: [col[i] for i in keep] for name, col in rows.items()}
+                self._prepend(figi, interval, rows)
+                meta["from"] = _ts(from_)
+                added += len(rows["time"])
+            if _ts(to) > meta["to"]:
+                rows, covered_to = await self._download(figi, interval, _dt(meta["to"]), to)
+                last = self.read(figi, interval)["time"][-1:]
+                if len(last):
+                    keep = [i for i, t in enumerate(rows["time"]) if t > last[0]]
+                    rows = {name: [col[i] for i in keep] for name, col in rows.items()}
+                self._append(figi, interval, rows)
+                meta["to"] = _ts(covered_to)
+                added += len(rows["time"])
+            self._write_meta(figi, interval, meta)
+            if added:
+                logging.info(f"Архив свечей {figi} {interval.name}: +{added}")
+            return added
+
+
+_store = None
+
+
+def get_candle_store():
+    global _store
+    if _store is None:
+        _store = CandleStore()
+    return _store
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+import grpc
+from tinkoff.invest import AsyncClient
+from tinkoff.invest.exceptions import AioRequestError
+
+# Коды ошибок, после которых проверяем канал: пересоздаём, только если проверка не прошла
+RECONNECT_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN,
+}
+
+# Как часто проверять живость канала, если он простаивал (секунды)
+HEALTH_CHECK_INTERVAL = 60
+
+# Сколько запросов пачкой (догрузка истории по всем FIGI) держать в полёте одновременно —
+# чтобы не упереться в лимиты API на число запросов
+MAX_PARALLEL_REQUESTS = 8
+
+# Экспоненциальная задержка между попытками подключения
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+
+
+class ClientPool:
+    # Один долгоживущий AsyncClient на процесс: канал открывается один раз,
+    # при обрыве пересоздаётся с экспоненциальной задержкой.
+    def __init__(self, token, health_check_interval=HEALTH_CHECK_INTERVAL, max_parallel=MAX_PARALLEL_REQUESTS):
+        self.token = token
+        self.health_check_interval = health_check_interval
+        # Общий на процесс лимит параллельных запросов для массовых загрузок: async with pool.limit
+        self.limit = asyncio.Semaphore(max_parallel)
+        self._client = None
+        self._services = None
+        self._lock = asyncio.Lock()
+        self._last_ok = 0.0
+        self._backoff = BACKOFF_INITIAL
+
+    async def _connect(self):
+        while True:
+            try:
+                client = AsyncClient(self.token)
+                services = await client.__aenter__()
+                self._client = client
+                self._services = services
+                self._last_ok = time.monotonic()
+                self._backoff = BACKOFF_INITIAL
+                logging.info("🔌 gRPC-канал Tinkoff открыт")
+                return services
+            except Exception as e:
+                delay = self._backoff * (1 + random.random() / 2)
+                logging.warning(f"Не удалось подключиться к Tinkoff API: {e}. Повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                self._backoff = min(self._backoff * 2, BACKOFF_MAX)
+
+    async def _is_healthy(self):
+        try:
+            await self._services.users.get_info()
+            return True
+        except Exception as e:
+            logging.warning(f"Проверка канала не прошла: {e}")
+            return False
+
+    async def get(self):
+        async with self._lock:
+            if self._services is None:
+                return await self._connect()
+            if time.monotonic() - self._last_ok > self.health_check_interval:
+                if not await self._is_healthy():
+                    await self._close()
+                    return await self._connect()
+                self._last_ok = time.monotonic()
+            return self._services
+
+    async def _close(self):
+        client, self._client, self._services = self._client, None, None
+        if client is not None:
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception:
+                pass
+
+    def use(self, services):
+        # Подставить готовый объект сервисов вместо настоящего канала (фейковый сервер в бенчмарках)
+        self._services = services
+        self._last_ok = time.monotonic()
+        self.health_check_interval = float("inf")
+
+    async def reset(self):
+        async with self._lock:
+            await self._close()
+
+    async def _recheck(self, services):
+        # Отдельный запрос или стрим упал с сетевой ошибкой — это ещё не значит, что канал мёртв.
+        # Закрываем его (вместе со всеми стримами на нём), только если не прошла проверка;
+        # иначе упавший вызов повторяет сам
+        async with self._lock:
+            if self._services is not services:
+                return
+            if await self._is_healthy():
+                self._last_ok = time.monotonic()
+                return
+            logging.warning("Канал сломан, переподключаемся при следующем запросе")
+            await self._close()
+
+    async def close(self):
+        await self.reset()
+
+    @asynccontextmanager
+    async def session(self):
+        services = await self.get()
+        try:
+            yield services
+            self._last_ok = time.monotonic()
+        except AioRequestError as e:
+            if e.code in RECONNECT_CODES:
+                logging.warning(f"Ошибка запроса ({e.code}), проверяем канал")
+                await self._recheck(services)
+            raise
+
+
+_pool = None
+
+
+def get_pool(token=None):
+    global _pool
+    if _pool is None:
+        _pool = ClientPool(token or os.getenv("TINKOFF_API_TOKEN"))
+    return _pool
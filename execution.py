@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from decimal import Decimal
+
+import grpc
+from tinkoff.invest import OrderDirection, OrderExecutionReportStatus, OrderType
+from tinkoff.invest.exceptions import AioRequestError
+from tinkoff.invest.utils import decimal_to_quotation
+
+from client_pool import get_pool
+from instruments import get_registry
+from metrics import RPC_LATENCY, RPC_ERRORS, ORDERS, FILL_LATENCY
+from portfolio_cache import get_portfolio_cache
+from risk import get_risk_manager
+from state_store import get_state_store
+from utils import quotation_to_float
+
+# Ошибки, после которых заявку можно безопасно отправить ещё раз с тем же order_id:
+# биржа не примет дубль, а потерянный ответ мы получим повторно
+RETRY_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+}
+RETRY_ATTEMPTS = 4
+RETRY_DELAY = 0.5
+
+# Сколько ждать исполнения, прежде чем спросить статус заявки напрямую
+FILL_TIMEOUT = 10
+
+STATUS_NAMES = {
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL: "filled",
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL: "partial",
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW: "submitted",
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED: "rejected",
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED: "cancelled",
+}
+FINAL_STATUSES = ("filled", "rejected", "cancelled")
+
+
+class OrderTicket:
+    def __init__(self, order_id, figi, direction, quantity, lot, order_type, limit_price, reference_price):
+        self.order_id = order_id            # наш ключ идемпотентности
+        self.exchange_order_id = None       # ID заявки у брокера, приходит в ответе и в стриме сделок
+        self.figi = figi
+        self.direction = direction
+        self.quantity = quantity            # в лотах
+        self.lot = lot
+        self.order_type = order_type
+        self.limit_price = limit_price
+        self.reference_price = reference_price
+        self.status = "new"
+        # Исполнение приходит двумя путями: сделками из стрима и статусом заявки.
+        # Считаем их раздельно и берём более полный, чтобы не сложить одно и то же дважды
+        self.stream_fill = [0, 0.0]         # [штук, сумма]
+        self.state_fill = [0, 0.0]
+        self.submitted_at = None
+        self.filled_at = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def _fill(self):
+        return max(self.stream_fill, self.state_fill, key=lambda f: f[0])
+
+    @property
+    def filled_units(self):
+        return self._fill[0]
+
+    @property
+    def avg_price(self):
+        units, value = self._fill
+        return value / units if units else None
+
+    @property
+    def latency(self):
+        if self.submitted_at is None or self.filled_at is None:
+            return None
+        return self.filled_at - self.submitted_at
+
+    @property
+    def slippage(self):
+        # Доля, на которую исполнение хуже цены сигнала (отрицательная — лучше)
+        if not self.reference_price or self.avg_price is None:
+            return None
+        diff = (self.avg_price - self.reference_price) / self.reference_price
+        return diff if self.direction == OrderDirection.ORDER_DIRECTION_BUY else -diff
+
+    def add_fill(self, price, units):
+        self.stream_fill[0] += units
+        self.stream_fill[1] += price * units
+        if self.filled_units >= self.quantity * self.lot:
+            self.finish("filled")
+        else:
+            self.status = "partial"
+
+    def finish(self, status):
+        self.status = status
+        if status == "filled" and self.filled_at is None:
+            self.filled_at = time.perf_counter()
+            if self.submitted_at is not None:
+                side = "buy" if self.direction == OrderDirection.ORDER_DIRECTION_BUY else "sell"
+                FILL_LATENCY.observe(self.latency, side=side)
+        if not self.done.done():
+            self.done.set_result(self)
+
+    async def wait(self, timeout=None):
+        return await asyncio.wait_for(asyncio.shield(self.done), timeout)
+
+
+class ExecutionEngine:
+    # Выставление заявок (рыночных и лимитных) со стабильным order_id и повторами,
+    # отслеживание исполнения по стриму сделок, проскальзывание и задержка по каждой заявке
+    def __init__(self, account_id, pool=None, state=None):
+        self.account_id = account_id
+        self.pool = pool or get_pool()
+        self.state = state or get_state_store()
+        self.portfolio = get_portfolio_cache(account_id)
+        self.risk = get_risk_manager(account_id)
+        self.tickets = {}           # {order_id: OrderTicket}
+        self._by_exchange_id = {}   # {exchange_order_id: OrderTicket}
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_trades_stream())
+            asyncio.create_task(self.recover())
+
+    async def recover(self):
+        # Заявки, которые остались незавершёнными в базе с прошлого запуска: узнаём их статус
+        # по order_id и снимаем те, что ещё висят, — ждать их исполнения после рестарта некому
+        for row in self.state.pending_orders():
+            direction = (OrderDirection.ORDER_DIRECTION_BUY if row["direction"] == "buy"
+                         else OrderDirection.ORDER_DIRECTION_SELL)
+            order_type = OrderType.ORDER_TYPE_LIMIT if row["price"] else OrderType.ORDER_TYPE_MARKET
+            ticket = OrderTicket(row["order_id"], row["figi"], direction, row["quantity"],
+                                 get_registry().lot(row["figi"]), order_type, row["price"], None)
+            ticket.status = row["status"]
+            self.tickets[ticket.order_id] = ticket
+            try:
+                await self.refresh(ticket)
+                if ticket.status not in FINAL_STATUSES:
+                    await self.cancel(ticket)
+                    logging.info(f"Заявка {ticket.order_id} {ticket.figi} с прошлого запуска снята")
+            except AioRequestError as e:
+                if e.code != grpc.StatusCode.NOT_FOUND:
+                    logging.warning(f"Не удалось проверить заявку {ticket.order_id}: {e}")
+                    continue
+                # До биржи заявка так и не дошла
+                ticket.finish("rejected")
+                self._record(ticket)
+
+    async def submit(self, figi, direction, quantity, order_type=OrderType.ORDER_TYPE_MARKET,
+                     limit_price=None, reference_price=None, order_id=None):
+        # Справочник загружен при старте и обновляется в фоне (run_refresh) — здесь только память
+        await self.risk.account.ensure_loaded()
+        # Бросает RiskRejected/NotEnoughMoney до того, как заявка куда-либо уйдёт
+        self.risk.check(figi, direction, quantity, limit_price or reference_price)
+        order_id = order_id or str(uuid.uuid4())
+        ticket = OrderTicket(order_id, figi, direction, quantity, get_registry().lot(figi),
+                             order_type, limit_price, reference_price)
+        self.tickets[order_id] = ticket
+        side = "buy" if direction == OrderDirection.ORDER_DIRECTION_BUY else "sell"
+        self.state.add_order(order_id, figi, side, quantity, limit_price)
+
+        kwargs = dict(
+            order_id=order_id,
+            figi=figi,
+            quantity=quantity,
+            account_id=self.account_id,
+            direction=direction,
+            order_type=order_type,
+        )
+        if order_type == OrderType.ORDER_TYPE_LIMIT:
+            kwargs["price"] = decimal_to_quotation(Decimal(str(limit_price)))
+
+        ticket.submitted_at = time.perf_counter()
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                started = time.perf_counter()
+                async with self.pool.session() as client:
+                    response = await client.orders.post_order(**kwargs)
+                RPC_LATENCY.observe(time.perf_counter() - started, method="post_order")
+                break
+            except AioRequestError as e:
+                RPC_ERRORS.inc(method="post_order")
+                if e.code not in RETRY_CODES or attempt == RETRY_ATTEMPTS - 1:
+                    ticket.finish("rejected")
+                    self.state.update_order(order_id, "rejected")
+                    raise
+                logging.warning(f"Повтор заявки {order_id} ({e.code}), попытка {attempt + 2}")
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+        ORDERS.inc(side=side)
+        self.portfolio.invalidate()
+        ticket.exchange_order_id = response.order_id
+        self._by_exchange_id[response.order_id] = ticket
+        self._apply_state(ticket, response.execution_report_status, response.lots_executed,
+                          response.executed_order_price)
+        return ticket
+
+    def _apply_state(self, ticket, report_status, lots_executed, executed_price):
+        status = STATUS_NAMES.get(report_status, ticket.status)
+        units = lots_executed * ticket.lot
+        if units and executed_price is not None:
+            # Ответ/статус заявки дают среднюю цену по всей исполненной части
+            ticket.state_fill = [units, quotation_to_float(executed_price) * units]
+        if status in FINAL_STATUSES:
+            ticket.finish(status)
+        elif status != ticket.status:
+            ticket.status = status
+        self._record(ticket)
+
+    def _record(self, ticket):
+        self.state.update_order(ticket.order_id, ticket.status, ticket.avg_price)
+        if ticket.status == "filled":
+            self.portfolio.invalidate()
+            slippage = f"{ticket.slippage:.3%}" if ticket.slippage is not None else "—"
+            latency = f"{ticket.latency * 1000:.0f} мс" if ticket.latency is not None else "—"
+            logging.info(
+                f"Заявка {ticket.order_id} {ticket.figi} исполнена: {ticket.filled_units} шт. "
+                f"по {ticket.avg_price:.4f}, проскальзывание {slippage}, задержка {latency}"
+            )
+
+    async def wait_filled(self, ticket, timeout=FILL_TIMEOUT):
+        # Ждём стрим; если молчит — спрашиваем статус заявки напрямую
+        try:
+            return await ticket.wait(timeout)
+        except asyncio.TimeoutError:
+            await self.refresh(ticket)
+            return ticket
+
+    async def refresh(self, ticket):
+        async with self.pool.session() as client:
+            state = await client.orders.get_order_state(
+                account_id=self.account_id, order_id=ticket.exchange_order_id or ticket.order_id
+            )
+        self._apply_state(ticket, state.execution_report_status, state.lots_executed,
+                          state.average_position_price)
+
+    async def cancel(self, ticket):
+        async with self.pool.session() as client:
+            await client.orders.cancel_order(
+                account_id=self.account_id, order_id=ticket.exchange_order_id or ticket.order_id
+            )
+        ticket.finish("cancelled")
+        self._record(ticket)
+
+    async def _run_trades_stream(self):
+        delay = 1
+        while True:
+            try:
+                async with self.pool.session() as client:
+                    async for resp in client.orders_stream.trades_stream(accounts=[self.account_id]):
+                        delay = 1
+                        if resp.order_trades:
+                            self._on_trades(resp.order_trades)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Стрим сделок оборвался: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def _on_trades(self, order_trades):
+        ticket = self._by_exchange_id.get(order_trades.order_id) or self.tickets.get(order_trades.order_id)
+        if ticket is None or ticket.status in FINAL_STATUSES:
+            return
+        for trade in order_trades.trades:
+            ticket.add_fill(quotation_to_float(trade.price), trade.quantity)
+        self._record(ticket)
+
+
+_engines = {}
+
+
+def get_execution_engine(account_id=None):
+    account_id = account_id or os.getenv("TINKOFF_ACCOUNT_ID")
+    if account_id not in _engines:
+        _engines[account_id] = ExecutionEngine(account_id)
+    return _engines[account_id]
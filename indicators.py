@@ -0,0 +1,144 @@
+import numpy as np
+
+RSI_PERIOD = 14
+
+
+def rsi_value(avg_gain, avg_loss):
+    if avg_loss == 0:
+        return 100.0 if avg_gain > 0 else 50.0
+    rs = avg_gain / avg_loss
+    return 100 - (100 / (1 + rs))
+
+
+class RSI:
+    # RSI Уайлдера с накопленным состоянием: каждое новое закрытие — O(1).
+    # avg = (avg * (period - 1) + x) / period, первое среднее — простое по period изменениям.
+    def __init__(self, period=RSI_PERIOD):
+        self.period = period
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.prev_close = None
+        self.count = 0  # сколько изменений цены уже учтено
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def seed(self, closes):
+        for close in closes:
+            self.update(close)
+        return self
+
+    def _next(self, close):
+        diff = close - self.prev_close
+        gain = diff if diff > 0 else 0.0
+        loss = -diff if diff < 0 else 0.0
+        n = self.count + 1
+        if n <= self.period:
+            # Разгон: накапливаем простое среднее
+            avg_gain = self.avg_gain + (gain - self.avg_gain) / n
+            avg_loss = self.avg_loss + (loss - self.avg_loss) / n
+        else:
+            avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        return avg_gain, avg_loss
+
+    def update(self, close):
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+        self.avg_gain, self.avg_loss = self._next(close)
+        self.prev_close = close
+        self.count += 1
+        return self.value
+
+    def peek(self, close):
+        # RSI с учётом ещё не закрытой свечи, состояние не меняется
+        if self.prev_close is None or self.count + 1 < self.period:
+            return None
+        return rsi_value(*self._next(close))
+
+    @property
+    def value(self):
+        if not self.ready:
+            return None
+        return rsi_value(self.avg_gain, self.avg_loss)
+
+
+def wilder_rsi(closes, period=RSI_PERIOD):
+    # Разовый расчёт по всей истории — то же самое, что RSI().seed(closes)
+    if len(closes) < period + 1:
+        return None
+    return RSI(period).seed(closes).value
+
+
+# ---- Пакетный расчёт: матрица (инструменты × свечи), одна строка на инструмент ----
+
+def _rsi_from_avgs(avg_gain, avg_loss):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    rsi = np.where(avg_loss == 0, np.where(avg_gain > 0, 100.0, 50.0), rsi)
+    return np.where(np.isnan(avg_gain) | np.isnan(avg_loss), np.nan, rsi)
+
+
+def rsi_batch(prices, period=RSI_PERIOD):
+    # Последнее значение RSI Уайлдера для каждой строки одним матричным умножением:
+    # avg_T = (1-a)^k * avg_seed + sum(a * (1-a)^(T-t) * x_t), a = 1/period.
+    # Строки с NaN в окне (короткая история) дают NaN.
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.ndim == 1:
+        prices = prices[None, :]
+    n_rows, n_cols = prices.shape
+    if n_cols < period + 1:
+        return np.full(n_rows, np.nan)
+
+    diff = np.diff(prices, axis=1)
+    gains = np.clip(diff, 0, None)
+    losses = np.clip(-diff, 0, None)
+
+    alpha = 1.0 / period
+    tail = diff.shape[1] - period
+    weights = alpha * (1 - alpha) ** np.arange(tail - 1, -1, -1)
+    decay = (1 - alpha) ** tail
+
+    avg_gain = decay * gains[:, :period].mean(axis=1) + gains[:, period:] @ weights
+    avg_loss = decay * losses[:, :period].mean(axis=1) + losses[:, period:] @ weights
+    return _rsi_from_avgs(avg_gain, avg_loss)
+
+
+def rsi_series(prices, period=RSI_PERIOD):
+    # Полный ряд RSI для каждой строки (для бэктестов): цикл по времени,
+    # векторизованный по инструментам. Первые period столбцов — NaN.
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.ndim == 1:
+        prices = prices[None, :]
+    n_rows, n_cols = prices.shape
+    out = np.full((n_rows, n_cols), np.nan)
+    if n_cols < period + 1:
+        return out
+
+    diff = np.diff(prices, axis=1)
+    gains = np.clip(diff, 0, None)
+    losses = np.clip(-diff, 0, None)
+    avg_gain = gains[:, :period].mean(axis=1)
+    avg_loss = losses[:, :period].mean(axis=1)
+    out[:, period] = _rsi_from_avgs(avg_gain, avg_loss)
+    for t in range(period, diff.shape[1]):
+        avg_gain = (avg_gain * (period - 1) + gains[:, t]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[:, t]) / period
+        out[:, t + 1] = _rsi_from_avgs(avg_gain, avg_loss)
+    return out
+
+
+def sma_batch(prices, period):
+    prices = np.asarray(prices, dtype=np.float64)
+    return prices[..., -period:].mean(axis=-1)
+
+
+def ema_batch(prices, period):
+    # Последнее значение EMA по каждой строке, тем же приёмом, что и rsi_batch
+    prices = np.asarray(prices, dtype=np.float64)
+    alpha = 2.0 / (period + 1)
+    n = prices.shape[-1]
+    weights = alpha * (1 - alpha) ** np.arange(n - 2, -1, -1)
+    return (1 - alpha) ** (n - 1) * prices[..., 0] + prices[..., 1:] @ weights
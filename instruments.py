@@ -0,0 +1,173 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+from client_pool import get_pool
+
+# Справочник инструментов на диске и как часто его обновлять
+INSTRUMENTS_FILE = "instruments.json.gz"
+REFRESH_INTERVAL = 24 * 60 * 60
+
+# Для тикеров, которые торгуются в нескольких режимах, предпочитаем основной режим МосБиржи
+PREFERRED_CLASS_CODES = ("TQBR", "TQTF", "TQCB", "TQOB", "CETS")
+
+# Поля одной записи в файле (храним списками, а не словарями — файл в разы меньше)
+FIELDS = ("figi", "ticker", "class_code", "lot", "name", "currency", "kind", "exchange")
+
+
+class Instrument:
+    __slots__ = FIELDS
+
+    def __init__(self, figi, ticker, class_code, lot, name, currency, kind, exchange=""):
+        self.figi = figi
+        self.ticker = ticker
+        self.class_code = class_code
+        self.lot = lot
+        self.name = name
+        self.currency = currency
+        self.kind = kind
+        self.exchange = exchange    # площадка расписания торгов; в старых файлах справочника её нет
+
+    def as_row(self):
+        return [getattr(self, f) for f in FIELDS]
+
+
+class InstrumentRegistry:
+    # FIGI ↔ тикер, лотность и название из памяти; в API ходим раз в REFRESH_INTERVAL
+    def __init__(self, path=INSTRUMENTS_FILE, pool=None, refresh_interval=REFRESH_INTERVAL):
+        self.path = path
+        self.pool = pool or get_pool()
+        self.refresh_interval = refresh_interval
+        self.by_figi = {}
+        self.by_ticker = {}
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _index(self, instruments, loaded_at):
+        self.by_figi = {i.figi: i for i in instruments}
+        by_ticker = {}
+        for i in instruments:
+            current = by_ticker.get(i.ticker)
+            if current is None or self._rank(i) < self._rank(current):
+                by_ticker[i.ticker] = i
+        self.by_ticker = by_ticker
+        self.loaded_at = loaded_at
+
+    @staticmethod
+    def _rank(instrument):
+        if instrument.class_code in PREFERRED_CLASS_CODES:
+            return PREFERRED_CLASS_CODES.index(instrument.class_code)
+        return len(PREFERRED_CLASS_CODES)
+
+    def is_fresh(self):
+        return time.time() - self.loaded_at < self.refresh_interval
+
+    def _read_file(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return [Instrument(*row) for row in data["instruments"]], data["loaded_at"]
+
+    def _write_file(self, instruments, loaded_at):
+        tmp = self.path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"loaded_at": loaded_at, "instruments": [i.as_row() for i in instruments]},
+                f, ensure_ascii=False, separators=(",", ":"),
+            )
+        os.replace(tmp, self.path)
+
+    async def _download(self):
+        instruments = []
+        async with self.pool.session() as client:
+            for kind, method in (
+                ("share", client.instruments.shares),
+                ("etf", client.instruments.etfs),
+                ("bond", client.instruments.bonds),
+                ("currency", client.instruments.currencies),
+            ):
+                resp = await method()
+                for i in resp.instruments:
+                    instruments.append(
+                        Instrument(i.figi, i.ticker, i.class_code, i.lot, i.name, i.currency, kind, i.exchange)
+                    )
+        return instruments
+
+    async def load(self):
+        async with self._lock:
+            if self.by_figi and self.is_fresh():
+                return self
+            if os.path.exists(self.path):
+                try:
+                    instruments, loaded_at = await asyncio.to_thread(self._read_file)
+                    self._index(instruments, loaded_at)
+                except Exception as e:
+                    logging.warning(f"Не удалось прочитать {self.path}: {e}")
+            if not self.is_fresh():
+                await self._refresh()
+            return self
+
+    async def _refresh(self):
+        try:
+            instruments = await self._download()
+        except Exception as e:
+            # Лучше работать со вчерашним справочником, чем без него
+            logging.warning(f"Не удалось обновить справочник инструментов: {e}")
+            return
+        loaded_at = time.time()
+        self._index(instruments, loaded_at)
+        await asyncio.to_thread(self._write_file, instruments, loaded_at)
+        logging.info(f"Справочник инструментов обновлён: {len(instruments)} шт.")
+
+    async def run_refresh(self):
+        # Фоновое обновление по расписанию
+        while True:
+            await asyncio.sleep(max(self.refresh_interval - (time.time() - self.loaded_at), 60))
+            async with self._lock:
+                await self._refresh()
+
+    def get(self, figi):
+        return self.by_figi.get(figi)
+
+    def find(self, ticker):
+        return self.by_ticker.get(ticker)
+
+    def figi(self, ticker):
+        instrument = self.by_ticker.get(ticker)
+        return instrument.figi if instrument else None
+
+    def ticker(self, figi):
+        instrument = self.by_figi.get(figi)
+        return instrument.ticker if instrument else None
+
+    def lot(self, figi):
+        instrument = self.by_figi.get(figi)
+        return instrument.lot if instrument else 1
+
+    def exchange(self, figi):
+        instrument = self.by_figi.get(figi)
+        return instrument.exchange if instrument else None
+
+    def figi_map(self, tickers, fallback=None):
+        # {тикер: FIGI}; если справочник не знает тикер — берём из fallback (utils.FIGI_MAP)
+        fallback = fallback or {}
+        result = {}
+        for ticker in tickers:
+            figi = self.figi(ticker) or fallback.get(ticker)
+            if figi:
+                result[ticker] = figi
+            else:
+                logging.warning(f"Тикер {ticker} не найден в справочнике инструментов")
+        return result
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = InstrumentRegistry()
+    return _registry
@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+
+import pytz
+from tinkoff.invest import OperationState
+
+from client_pool import get_pool
+from state_store import get_state_store
+from utils import quotation_to_float
+
+MOSCOW = pytz.timezone("Europe/Moscow")
+
+# При первом запуске забираем историю за столько дней — нужна себестоимость позиций
+LEDGER_HISTORY_DAYS = 365
+
+# Как часто подтягивать новые операции в фоне, секунды
+LEDGER_SYNC_INTERVAL = 60
+
+# Перекрытие при запросе от курсора: операции иногда появляются с задержкой
+CURSOR_OVERLAP = datetime.timedelta(minutes=10)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    id TEXT PRIMARY KEY,
+    account_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    figi TEXT NOT NULL,
+    type TEXT NOT NULL,
+    payment REAL NOT NULL,
+    quantity INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS operations_ts ON operations(account_id, ts);
+"""
+
+
+class OperationsLedger:
+    # Журнал операций счёта: с сервера забираем только новое (от курсора), храним в
+    # SQLite рядом с состоянием бота, а прибыль и число операций по дням/FIGI считаем
+    # на лету при добавлении. Отчёты читают только память.
+    def __init__(self, account_id, pool=None, state=None):
+        self.account_id = account_id
+        self.pool = pool or get_pool()
+        self.conn = (state or get_state_store()).conn
+        self.conn.executescript(SCHEMA)
+        self.cursor = None          # время последней учтённой операции (UTC)
+        self.seen = set()
+        self.books = {}             # {figi: [кол-во, себестоимость]} — средняя цена
+        self.daily = {}             # {дата МСК: {figi: [операций, реализованная прибыль]}}
+        self.synced_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._replay()
+
+    def _replay(self):
+        rows = self.conn.execute(
+            "SELECT id, ts, figi, type, payment, quantity FROM operations WHERE account_id = ? ORDER BY ts",
+            (self.account_id,),
+        )
+        for row in rows:
+            self._apply(*row)
+
+    def _apply(self, op_id, ts, figi, op_type, payment, quantity):
+        self.seen.add(op_id)
+        day = datetime.datetime.fromtimestamp(ts, MOSCOW).date()
+        stats = self.daily.setdefault(day, {}).setdefault(figi, [0, 0.0])
+        stats[0] += 1
+
+        book = self.books.setdefault(figi, [0, 0.0])
+        if op_type.startswith("OPERATION_TYPE_BUY"):
+            book[0] += quantity
+            book[1] += -payment
+        elif op_type.startswith("OPERATION_TYPE_SELL"):
+            if book[0] > 0:
+                avg = book[1] / book[0]
+                sold = min(quantity, book[0])
+                stats[1] += payment - avg * sold
+                book[0] -= sold
+                book[1] -= avg * sold
+            else:
+                # Себестоимость неизвестна (покупка была до начала журнала)
+                stats[1] += payment
+        else:
+            # Комиссии, дивиденды, купоны, налоги — прямо в результат дня
+            stats[1] += payment
+
+        cursor = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+        if self.cursor is None or cursor > self.cursor:
+            self.cursor = cursor
+
+    async def sync(self):
+        async with self._lock:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if self.cursor is None:
+                from_ = now - datetime.timedelta(days=LEDGER_HISTORY_DAYS)
+            else:
+                from_ = self.cursor - CURSOR_OVERLAP
+            async with self.pool.session() as client:
+                resp = await client.operations.get_operations(
+                    account_id=self.account_id,
+                    from_=from_,
+                    to=now,
+                    state=OperationState.OPERATION_STATE_EXECUTED,
+                )
+            new = [op for op in resp.operations if op.id and op.id not in self.seen]
+            new.sort(key=lambda op: op.date)
+            rows = [
+                (op.id, self.account_id, op.date.timestamp(), op.figi or "",
+                 op.operation_type.name, quotation_to_float(op.payment), op.quantity)
+                for op in new
+            ]
+            if rows:
+                self.conn.executemany("INSERT OR IGNORE INTO operations VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                for row in rows:
+                    self._apply(row[0], *row[2:])
+            self.synced_at = time.monotonic()
+            return len(rows)
+
+    async def run_sync(self):
+        while True:
+            try:
+                added = await self.sync()
+                if added:
+                    logging.info(f"Журнал операций: +{added}")
+            except Exception as e:
+                logging.warning(f"Не удалось обновить журнал операций: {e}")
+            await asyncio.sleep(LEDGER_SYNC_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_sync())
+
+    async def ensure_synced(self):
+        # Фоновая синхронизация ещё не запускалась — один раз подтягиваем сами
+        if not self.synced_at:
+            await self.sync()
+
+    @staticmethod
+    def today():
+        return datetime.datetime.now(MOSCOW).date()
+
+    def _day(self, day, figi):
+        stats = self.daily.get(day or self.today(), {})
+        if figi is not None:
+            return [stats[figi]] if figi in stats else []
+        return stats.values()
+
+    def daily_profit(self, day=None, figi=None):
+        return sum(pnl for _, pnl in self._day(day, figi))
+
+    def transaction_count(self, day=None, figi=None):
+        return sum(count for count, _ in self._day(day, figi))
+
+
+_ledgers = {}
+
+
+def get_ledger(account_id=None):
+    account_id = account_id or os.getenv("TINKOFF_ACCOUNT_ID")
+    if account_id not in _ledgers:
+        _ledgers[account_id] = OperationsLedger(account_id)
+    return _ledgers[account_id]
@@ -0,0 +1,129 @@
+import asyncio
+import bisect
+import datetime
+import logging
+
+import pytz
+
+from client_pool import get_pool
+from instruments import get_registry
+
+MOSCOW = pytz.timezone("Europe/Moscow")
+
+# Площадка по умолчанию — для инструментов, чьей площадки нет в расписании
+DEFAULT_EXCHANGE = "MOEX"
+
+# На сколько дней вперёд забираем расписание; раз в час проверяем, не сменились ли сутки
+SCHEDULE_DAYS = 7
+REFRESH_CHECK_INTERVAL = 60 * 60
+
+# Пока расписание не загружено — старое правило: Пн–Пт 10:00–18:45 МСК
+FALLBACK_OPEN = datetime.time(10, 0)
+FALLBACK_CLOSE = datetime.time(18, 45)
+
+
+def _ts(dt):
+    # Незаполненные времена в ответе приходят как 1970-01-01
+    if dt is None or dt.year < 2000:
+        return None
+    return dt.timestamp()
+
+
+class MarketCalendar:
+    # Торговые сессии по площадкам из trading_schedules: грузим раз в день на неделю вперёд,
+    # дальше «открыт ли рынок» и «когда откроется» считаются по памяти
+    def __init__(self, pool=None, days=SCHEDULE_DAYS):
+        self.pool = pool or get_pool()
+        self.days = days
+        self.sessions = {}      # {площадка: [(начало, конец), ...]} — epoch, по возрастанию
+        self._starts = {}       # {площадка: [начало, ...]} для bisect
+        self.loaded_for = None  # дата МСК, на которую загружено расписание
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def load(self):
+        today = datetime.datetime.now(MOSCOW).date()
+        from_ = MOSCOW.localize(datetime.datetime.combine(today, datetime.time(0)))
+        async with self.pool.session() as client:
+            resp = await client.instruments.trading_schedules(
+                from_=from_, to=from_ + datetime.timedelta(days=self.days)
+            )
+        sessions = {}
+        for schedule in resp.exchanges:
+            days = sessions.setdefault(schedule.exchange, [])
+            for day in schedule.days:
+                if not day.is_trading_day:
+                    continue
+                for start, end in (
+                    (day.start_time, day.end_time),
+                    (getattr(day, "evening_start_time", None), getattr(day, "evening_end_time", None)),
+                ):
+                    start, end = _ts(start), _ts(end)
+                    if start is not None and end is not None and end > start:
+                        days.append((start, end))
+        for days in sessions.values():
+            days.sort()
+        self.sessions = sessions
+        self._starts = {exchange: [s for s, _ in days] for exchange, days in sessions.items()}
+        self.loaded_for = today
+        logging.info(f"Расписание торгов загружено: {len(sessions)} площадок на {self.days} дн.")
+        return self
+
+    async def ensure_loaded(self):
+        async with self._lock:
+            if self.loaded_for != datetime.datetime.now(MOSCOW).date():
+                try:
+                    await self.load()
+                except Exception as e:
+                    logging.warning(f"Не удалось загрузить расписание торгов: {e}")
+        return self
+
+    async def run_refresh(self):
+        while True:
+            await asyncio.sleep(REFRESH_CHECK_INTERVAL)
+            await self.ensure_loaded()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_refresh())
+
+    def exchange_for(self, figi=None):
+        exchange = get_registry().exchange(figi) if figi else None
+        return exchange if exchange in self.sessions else DEFAULT_EXCHANGE
+
+    def session(self, exchange, ts):
+        # Сессия, внутри которой ts (конец включительно — последняя свеча закрывается
+        # ровно в конце сессии), или следующая за ним; None — расписание кончилось
+        days = self.sessions.get(exchange)
+        if not days:
+            return None
+        i = bisect.bisect_right(self._starts[exchange], ts) - 1
+        if i >= 0 and ts <= days[i][1]:
+            return days[i]
+        return days[i + 1] if i + 1 < len(days) else None
+
+    def is_open(self, exchange=DEFAULT_EXCHANGE, now=None):
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp() if now is None else now
+        if exchange not in self.sessions:
+            moscow = datetime.datetime.fromtimestamp(now, MOSCOW)
+            return moscow.weekday() < 5 and FALLBACK_OPEN <= moscow.time() <= FALLBACK_CLOSE
+        session = self.session(exchange, now)
+        return session is not None and session[0] <= now <= session[1]
+
+    def next_open(self, exchange=DEFAULT_EXCHANGE, now=None):
+        # Время (epoch) начала ближайшей сессии; now, если рынок открыт; None — неизвестно
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp() if now is None else now
+        session = self.session(exchange, now)
+        if session is None:
+            return None
+        return max(session[0], now)
+
+
+_calendar = None
+
+
+def get_market_calendar():
+    global _calendar
+    if _calendar is None:
+        _calendar = MarketCalendar()
+    return _calendar
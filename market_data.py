@@ -0,0 +1,402 @@
+import asyncio
+import datetime
+import logging
+
+import numpy as np
+from tinkoff.invest import (
+    CandleInstrument,
+    CandleInterval,
+    LastPriceInstrument,
+    MarketDataRequest,
+    SubscribeCandlesRequest,
+    SubscribeLastPriceRequest,
+    SubscribeOrderBookRequest,
+    SubscriptionAction,
+    SubscriptionInterval,
+    SubscriptionStatus,
+)
+from aggregator import CandleAggregator, bucket
+from client_pool import get_pool
+from indicators import RSI, RSI_PERIOD
+from utils import quotation_to_float
+
+# Сколько последних свечей держать в памяти на каждый FIGI/интервал
+BUFFER_SIZE = 500
+
+# Если из стрима ничего не приходит (даже ping) дольше этого — переподключаемся
+STREAM_STALL_TIMEOUT = 180
+
+# Опрос get_candles, пока стрим лежит
+POLL_INTERVAL = 60
+RECONNECT_DELAY_MAX = 60
+
+INTERVAL_MINUTES = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: 1,
+    CandleInterval.CANDLE_INTERVAL_5_MIN: 5,
+    CandleInterval.CANDLE_INTERVAL_15_MIN: 15,
+    CandleInterval.CANDLE_INTERVAL_HOUR: 60,
+    CandleInterval.CANDLE_INTERVAL_DAY: 24 * 60,
+}
+
+# Из API и стрима берём только минутки; остальные таймфреймы собирает CandleAggregator
+SOURCE_INTERVAL = CandleInterval.CANDLE_INTERVAL_1_MIN
+
+# Максимальный период одного запроса get_candles по интервалам
+HISTORY_LIMITS = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: datetime.timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_5_MIN: datetime.timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_15_MIN: datetime.timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_HOUR: datetime.timedelta(days=7),
+    CandleInterval.CANDLE_INTERVAL_DAY: datetime.timedelta(days=365),
+}
+
+# Сколько минуток поднимать из архива при старте — потолок для часовых/дневных буферов
+STORE_HISTORY_MINUTES = 30 * 24 * 60
+
+SUBSCRIPTION_INTERVALS = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+    CandleInterval.CANDLE_INTERVAL_5_MIN: SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIVE_MINUTES,
+}
+CANDLE_INTERVALS = {v: k for k, v in SUBSCRIPTION_INTERVALS.items()}
+
+
+class RingBuffer:
+    # Кольцевой буфер цен закрытия на NumPy-массивах, без объектов на каждую свечу
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.times = np.zeros(size, dtype=np.int64)
+        self.closes = np.zeros(size, dtype=np.float64)
+        self.count = 0
+        self.pos = 0
+
+    def last_time(self):
+        if not self.count:
+            return None
+        return int(self.times[(self.pos - 1) % self.size])
+
+    def push(self, ts, close):
+        last = self.last_time()
+        if last is not None and ts < last:
+            return False
+        if last == ts:
+            # Незакрытая свеча обновилась — перезаписываем последнее значение
+            self.closes[(self.pos - 1) % self.size] = close
+            return False
+        self.times[self.pos] = ts
+        self.closes[self.pos] = close
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        return True
+
+    def window(self, n=None):
+        n = self.count if n is None else min(n, self.count)
+        idx = (np.arange(self.pos - n, self.pos)) % self.size
+        return self.closes[idx]
+
+
+class MarketDataEngine:
+    def __init__(self, figis, intervals=(CandleInterval.CANDLE_INTERVAL_1_MIN,), pool=None,
+                 buffer_size=BUFFER_SIZE, store=None, calendar=None, orderbooks=None):
+        self.figis = list(figis)
+        self.intervals = list(intervals)
+        self.pool = pool or get_pool()
+        # CandleStore: если задан, история для буферов берётся из локального архива
+        self.store = store
+        self.buffer_size = buffer_size
+        # Старшие таймфреймы из одного минутного потока; calendar — границы торговых сессий
+        self.aggregator = CandleAggregator(self.intervals, calendar)
+        self._last_minute = {}  # {figi: время последней минутки}
+        self.buffers = {
+            (figi, interval): RingBuffer(buffer_size)
+            for figi in self.figis for interval in self.intervals
+        }
+        self.last_prices = {}
+        # Кому сообщать о каждой новой цене: (figi, price) — например, бумажному брокеру
+        self.price_listeners = []
+        # OrderBooks: если задан, стаканы его FIGI приходят в том же стриме
+        self.orderbooks = orderbooks
+        self.indicators = {}  # {(figi, interval): RSI}
+        self.stream_alive = False
+        # FIGI, которым стрим отказал в подписке на свечи или цены: их опрашиваем, пока стрим жив
+        self.polled = set()
+        self._task = None
+        self._sync_task = None
+        self._stop = asyncio.Event()
+
+    def closes(self, figi, interval=CandleInterval.CANDLE_INTERVAL_1_MIN, n=None):
+        buf = self.buffers.get((figi, interval))
+        if buf is None:
+            return np.empty(0)
+        return buf.window(n)
+
+    def matrix(self, figis, interval=CandleInterval.CANDLE_INTERVAL_1_MIN, n=BUFFER_SIZE):
+        # Матрица (инструменты × n свечей), короткая история дополняется NaN слева
+        out = np.full((len(figis), n), np.nan)
+        for row, figi in enumerate(figis):
+            closes = self.closes(figi, interval, n)
+            if len(closes):
+                out[row, n - len(closes):] = closes
+        return out
+
+    def last_price(self, figi):
+        return self.last_prices.get(figi)
+
+    def tracks(self, figi, interval):
+        return (figi, interval) in self.buffers
+
+    def rsi(self, figi, interval=CandleInterval.CANDLE_INTERVAL_1_MIN, period=RSI_PERIOD):
+        key = (figi, interval)
+        buf = self.buffers.get(key)
+        if buf is None or buf.count < 2:
+            return None
+        ind = self.indicators.get(key)
+        if ind is None or ind.period != period:
+            # Разгоняем один раз по закрытым свечам из буфера, дальше — инкрементально
+            ind = RSI(period).seed(buf.window()[:-1].tolist())
+            self.indicators[key] = ind
+        return ind.peek(float(buf.closes[(buf.pos - 1) % buf.size]))
+
+    def _push(self, figi, interval, ts, close):
+        key = (figi, interval)
+        buf = self.buffers.get(key)
+        if buf is None:
+            return
+        if buf.push(ts, close):
+            # Предыдущая свеча закрылась — обновляем индикатор за O(1)
+            ind = self.indicators.get(key)
+            if ind is not None and buf.count >= 2:
+                ind.update(float(buf.closes[(buf.pos - 2) % buf.size]))
+
+    def _on_minute(self, figi, ts, open_, high, low, close, volume=0, notify=True):
+        # Одна минутка обновляет минутный буфер и все таймфреймы, собранные из неё.
+        # notify=False — история (архив, догрузка опросом): подписчикам цен её не показываем
+        if ts < self._last_minute.get(figi, 0):
+            return
+        self._last_minute[figi] = ts
+        self._push(figi, SOURCE_INTERVAL, ts, close)
+        for interval, bar, _ in self.aggregator.update(figi, ts, open_, high, low, close, volume):
+            self._push(figi, interval, bar.ts, bar.close)
+        self._set_price(figi, close, notify)
+
+    def _set_price(self, figi, price, notify=True):
+        self.last_prices[figi] = price
+        if notify:
+            for listener in self.price_listeners:
+                listener(figi, price)
+
+    def _on_candle(self, figi, c, notify=True):
+        self._on_minute(
+            figi, int(c.time.timestamp()), quotation_to_float(c.open), quotation_to_float(c.high),
+            quotation_to_float(c.low), quotation_to_float(c.close), c.volume, notify,
+        )
+
+    def _history_minutes(self):
+        # Сколько минуток нужно, чтобы заполнить буферы всех таймфреймов (с потолком)
+        need = max(INTERVAL_MINUTES[i] for i in self.intervals) * self.buffer_size
+        return min(need, STORE_HISTORY_MINUTES)
+
+    async def start(self, warm=True):
+        # warm — тёплый старт после перезапуска: буферы из локального архива без сети,
+        # затем один запрос на FIGI за разрыв; докачка архива идёт уже в фоне
+        if self.store:
+            await self.load_from_store(sync=not warm)
+            await self.poll()
+        else:
+            await self.poll(history=True)
+        self._task = asyncio.create_task(self._run())
+        if self.store and warm:
+            self._sync_task = asyncio.create_task(self.sync_store())
+
+    async def stop(self):
+        self._stop.set()
+        for task in (self._task, self._sync_task):
+            if task:
+                task.cancel()
+
+    def _history_from(self):
+        return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=self._history_minutes())
+
+    async def sync_store(self):
+        # Докачиваем архив до текущего момента — чтобы следующий запуск тоже был тёплым
+        from_ = self._history_from()
+        await asyncio.gather(*(self._sync_figi(figi, from_) for figi in self.figis))
+
+    async def _sync_figi(self, figi, from_):
+        # FIGI качаются параллельно, но не больше, чем позволяет лимит пула
+        async with self.pool.limit:
+            try:
+                await self.store.sync(figi, SOURCE_INTERVAL, from_)
+            except Exception as e:
+                logging.warning(f"Не удалось обновить архив свечей {figi}: {e}")
+
+    async def load_from_store(self, sync=True):
+        # Архив хранит только минутки; старшие таймфреймы собираются из них так же, как в стриме.
+        # sync=False — в сеть идём только за FIGI, которых в архиве нет или чей хвост старше,
+        # чем poll() догрузит одним запросом
+        from_ = self._history_from()
+        stale = datetime.datetime.now(datetime.timezone.utc) - HISTORY_LIMITS[SOURCE_INTERVAL]
+        await asyncio.gather(*(self._load_figi(figi, from_, stale, sync) for figi in self.figis))
+
+    async def _load_figi(self, figi, from_, stale, sync):
+        data = None if sync else self.store.read(figi, SOURCE_INTERVAL, start=from_)
+        if data is None or not len(data["time"]) or data["time"][-1] < stale.timestamp():
+            await self._sync_figi(figi, from_)
+            data = self.store.read(figi, SOURCE_INTERVAL, start=from_)
+        for row in zip(*(data[name].tolist() for name in ("time", "open", "high", "low", "close", "volume"))):
+            self._on_minute(figi, *row, notify=False)
+
+    async def poll(self, history=False, figis=None):
+        # Инструменты опрашиваются параллельно в одной сессии: запуск ждёт самый медленный
+        # ответ, а не сумму всех
+        now = datetime.datetime.now(datetime.timezone.utc)
+        async with self.pool.session() as client:
+            await asyncio.gather(*(self._poll_figi(client, figi, now, history) for figi in figis or self.figis))
+
+    async def _poll_figi(self, client, figi, now, history):
+        if history:
+            # Без архива старшие таймфреймы разгоняем готовыми свечами — один раз на запуск
+            for interval in self.intervals:
+                if interval == SOURCE_INTERVAL:
+                    continue
+                from_ = max(now - datetime.timedelta(minutes=INTERVAL_MINUTES[interval] * self.buffer_size),
+                            now - HISTORY_LIMITS[interval])
+                try:
+                    resp = await client.market_data.get_candles(
+                        figi=figi, from_=from_, to=now, interval=interval
+                    )
+                except Exception as e:
+                    logging.warning(f"Не удалось загрузить свечи {figi}: {e}")
+                    continue
+                for c in resp.candles:
+                    self._push(figi, interval, bucket(int(c.time.timestamp()), interval),
+                               quotation_to_float(c.close))
+
+        # Дальше — только минутки: из них собираются все таймфреймы
+        last = self._last_minute.get(figi)
+        if history or last is None:
+            from_ = now - datetime.timedelta(minutes=self.buffer_size)
+        else:
+            from_ = datetime.datetime.fromtimestamp(last, datetime.timezone.utc)
+        from_ = max(from_, now - HISTORY_LIMITS[SOURCE_INTERVAL])
+        try:
+            resp = await client.market_data.get_candles(
+                figi=figi, from_=from_, to=now, interval=SOURCE_INTERVAL
+            )
+        except Exception as e:
+            logging.warning(f"Не удалось загрузить свечи {figi}: {e}")
+            return
+        for c in resp.candles:
+            self._on_candle(figi, c, notify=False)
+        if resp.candles:
+            # Из догруженных минуток подписчикам (бумажному брокеру) — только текущая цена,
+            # иначе лимитные заявки исполнялись бы по уже прошедшим ценам
+            self._set_price(figi, self.last_prices[figi])
+
+        if self.orderbooks is not None and not self.orderbooks.streamed(figi):
+            # Пока стакан не идёт стримом — хотя бы снимок на момент опроса
+            try:
+                book = await client.market_data.get_order_book(figi=figi, depth=self.orderbooks.depth)
+            except Exception as e:
+                logging.warning(f"Не удалось загрузить стакан {figi}: {e}")
+                return
+            self.orderbooks.on_orderbook(figi, book.bids, book.asks, book.orderbook_ts.timestamp())
+
+    async def _requests(self):
+        yield MarketDataRequest(
+            subscribe_candles_request=SubscribeCandlesRequest(
+                subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+                instruments=[
+                    CandleInstrument(figi=figi, interval=SUBSCRIPTION_INTERVALS[SOURCE_INTERVAL])
+                    for figi in self.figis
+                ],
+            )
+        )
+        yield MarketDataRequest(
+            subscribe_last_price_request=SubscribeLastPriceRequest(
+                subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+                instruments=[LastPriceInstrument(figi=figi) for figi in self.figis],
+            )
+        )
+        if self.orderbooks is not None:
+            yield MarketDataRequest(
+                subscribe_order_book_request=SubscribeOrderBookRequest(
+                    subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+                    instruments=self.orderbooks.instruments(),
+                )
+            )
+        await self._stop.wait()
+
+    def _rejected(self, kind, subscriptions):
+        # Отказ в подписке на свечи, последние цены или стакан (например, лимит подписок):
+        # этот FIGI догружаем опросом параллельно со стримом
+        for sub in subscriptions:
+            if sub.subscription_status != SubscriptionStatus.SUBSCRIPTION_STATUS_SUCCESS:
+                logging.warning(f"Подписка на {kind} {sub.figi} отклонена: {sub.subscription_status.name}, "
+                                f"опрашиваем раз в {POLL_INTERVAL} с")
+                self.polled.add(sub.figi)
+
+    async def _poll_rejected(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            if self.polled:
+                try:
+                    await self.poll(figis=sorted(self.polled))
+                except Exception as e:
+                    logging.warning(f"Опрос свечей не удался: {e}")
+
+    async def _stream(self):
+        self.polled = set()
+        poller = asyncio.create_task(self._poll_rejected())
+        try:
+            await self._read_stream()
+        finally:
+            poller.cancel()
+
+    async def _read_stream(self):
+        async with self.pool.session() as client:
+            stream = client.market_data_stream.market_data_stream(self._requests()).__aiter__()
+            while True:
+                resp = await asyncio.wait_for(stream.__anext__(), timeout=STREAM_STALL_TIMEOUT)
+                self.stream_alive = True
+                if resp.candle:
+                    if CANDLE_INTERVALS.get(resp.candle.interval) == SOURCE_INTERVAL:
+                        self._on_candle(resp.candle.figi, resp.candle)
+                elif resp.last_price:
+                    self._set_price(resp.last_price.figi, quotation_to_float(resp.last_price.price))
+                elif resp.orderbook and self.orderbooks is not None:
+                    ob = resp.orderbook
+                    self.orderbooks.on_orderbook(ob.figi, ob.bids, ob.asks, ob.time.timestamp(), streamed=True)
+                elif resp.subscribe_candles_response:
+                    self._rejected("свечи", resp.subscribe_candles_response.candles_subscriptions)
+                elif resp.subscribe_last_price_response:
+                    self._rejected("цены", resp.subscribe_last_price_response.last_price_subscriptions)
+                elif resp.subscribe_order_book_response and self.orderbooks is not None:
+                    # Стакан отклонённого FIGI — снимками из того же опроса
+                    subscriptions = resp.subscribe_order_book_response.order_book_subscriptions
+                    self._rejected("стакан", subscriptions)
+                    for sub in subscriptions:
+                        if sub.subscription_status != SubscriptionStatus.SUBSCRIPTION_STATUS_SUCCESS:
+                            self.orderbooks.unsubscribed(sub.figi)
+
+    async def _run(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                await self._stream()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Стрим рыночных данных оборвался: {e}")
+            if self.stream_alive:
+                delay = 1
+            self.stream_alive = False
+            if self.orderbooks is not None:
+                self.orderbooks.unsubscribed()
+
+            # Пока стрим недоступен — догружаем свечи опросом
+            try:
+                await self.poll()
+            except Exception as e:
+                logging.warning(f"Опрос свечей не удался: {e}")
+            await asyncio.sleep(min(delay, POLL_INTERVAL))
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
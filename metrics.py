@@ -0,0 +1,271 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+
+# METRICS=0 отключает сбор: timed() и observe() становятся пустыми вызовами
+ENABLED = os.getenv("METRICS", "1") != "0"
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format(name, key, suffix=""):
+    if not key:
+        return f"{name}{suffix}"
+    inner = ",".join(f'{k}="{v}"' for k, v in key)
+    return f"{name}{suffix}{{{inner}}}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        if ENABLED:
+            key = _labels(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield _format(self.name, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name, doc):
+        super().__init__(name, doc)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        if ENABLED:
+            self.values[_labels(labels)] = value
+
+    def set_function(self, fn, **labels):
+        # Значение считается только в момент чтения метрик — на горячем пути ноль работы
+        self.functions[_labels(labels)] = fn
+
+    def samples(self):
+        yield from super().samples()
+        for key, fn in self.functions.items():
+            try:
+                yield _format(self.name, key), fn()
+            except Exception:
+                continue
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = buckets
+        self.series = {}  # {метки: [счётчики по корзинам..., сумма, количество, максимум]}
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = _labels(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * len(self.buckets) + [0.0, 0, 0.0]
+        n = len(self.buckets)
+        # Храним количество в каждой корзине, накопительные суммы считаем при выдаче
+        i = bisect.bisect_left(self.buckets, value)
+        if i < n:
+            series[i] += 1
+        series[n] += value
+        series[n + 1] += 1
+        series[n + 2] = max(series[n + 2], value)
+
+    def stats(self, **labels):
+        series = self.series.get(_labels(labels))
+        if series is None:
+            return None
+        n = len(self.buckets)
+        count = series[n + 1]
+        return {"count": count, "avg": series[n] / count if count else 0.0, "max": series[n + 2],
+                "p95": self.quantile(series, 0.95)}
+
+    def quantile(self, series, q):
+        # Верхняя граница корзины, в которую попадает квантиль
+        n = len(self.buckets)
+        target = q * series[n + 1]
+        seen = 0
+        for bound, count in zip(self.buckets, series):
+            seen += count
+            if seen >= target:
+                return bound
+        return series[n + 2]
+
+    def samples(self):
+        n = len(self.buckets)
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield _format(self.name, key + (("le", bound),), "_bucket"), cumulative
+            yield _format(self.name, key + (("le", "+Inf"),), "_bucket"), series[n + 1]
+            yield _format(self.name, key, "_sum"), series[n]
+            yield _format(self.name, key, "_count"), series[n + 1]
+
+
+_registry = {}
+
+
+def _get(cls, name, doc, **kwargs):
+    metric = _registry.get(name)
+    if metric is None:
+        metric = _registry[name] = cls(name, doc, **kwargs)
+    return metric
+
+
+def counter(name, doc=""):
+    return _get(Counter, name, doc)
+
+
+def gauge(name, doc=""):
+    return _get(Gauge, name, doc)
+
+
+def histogram(name, doc="", buckets=LATENCY_BUCKETS):
+    return _get(Histogram, name, doc, buckets=buckets)
+
+
+# Общие метрики бота
+RPC_LATENCY = histogram("bot_rpc_seconds", "Задержка вызовов Tinkoff API")
+RPC_ERRORS = counter("bot_rpc_errors_total", "Ошибки вызовов Tinkoff API")
+TICK_DURATION = histogram("bot_tick_seconds", "Длительность тика стратегии")
+TICK_ERRORS = counter("bot_tick_errors_total", "Ошибки в тиках стратегий")
+SIGNAL_TO_ORDER = histogram("bot_signal_to_order_seconds", "От сигнала до отправки заявки")
+ORDERS = counter("bot_orders_total", "Отправленные заявки")
+FILL_LATENCY = histogram("bot_fill_seconds", "От отправки заявки до исполнения")
+TELEGRAM_SENT = counter("bot_telegram_sent_total", "Отправленные сообщения Telegram")
+TELEGRAM_ERRORS = counter("bot_telegram_errors_total", "Ошибки отправки в Telegram")
+QUEUE_DEPTH = gauge("bot_queue_depth", "Глубина очередей")
+STARTUP = gauge("bot_startup_seconds", "Длительность этапов запуска")
+
+
+class StartupTimer:
+    # Этапы запуска: сколько занял каждый и сколько прошло от старта процесса до него.
+    # started — perf_counter() в самом начале main.ru, чтобы учесть и импорты
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last, now - self.started))
+        STARTUP.set(now - self._last, stage=stage)
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        lines = [f"{stage}: {took * 1000:.0f} мс (с начала {since * 1000:.0f} мс)" for stage, took, since in self.stages]
+        return "\n".join(lines + [f"Готов к сигналам через {self.total:.2f} с"])
+
+
+def timed(histogram_, errors=None, **labels):
+    # Декоратор для корутин: время вызова в гистограмму, исключения — в счётчик ошибок
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram_.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    # Текстовый формат Prometheus
+    lines = []
+    for metric in _registry.values():
+        lines.append(f"# HELP {metric.name} {metric.doc}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, value in metric.samples():
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    # Короткая сводка для /stats в Telegram
+    if not ENABLED:
+        return "Метрики отключены (METRICS=0)"
+    lines = []
+    for metric in _registry.values():
+        if isinstance(metric, Histogram):
+            for key in metric.series:
+                s = metric.stats(**dict(key))
+                label = ",".join(str(v) for _, v in key)
+                lines.append(
+                    f"{metric.name}[{label}]: n={s['count']} сред. {s['avg'] * 1000:.1f} мс, "
+                    f"p95≤{s['p95'] * 1000:.0f} мс, макс. {s['max'] * 1000:.1f} мс"
+                )
+        else:
+            for name, value in metric.samples():
+                lines.append(f"{name}: {value}")
+    return "\n".join(lines) if lines else "Метрик пока нет"
+
+
+async def _handle(reader, writer):
+    try:
+        request = await reader.readline()
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+        if path.startswith("/metrics"):
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logging.warning(f"Ошибка в обработчике /metrics: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(host=METRICS_HOST, port=METRICS_PORT):
+    if not ENABLED:
+        return None
+    try:
+        server = await asyncio.start_server(_handle, host, port)
+    except OSError as e:
+        # Порт занят (второй экземпляр бота) — метрики продолжают считаться, только без /metrics
+        logging.warning(f"Не удалось открыть {host}:{port} для метрик: {e}. Работаем без /metrics")
+        return None
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import itertools
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tinkoff.invest import CandleInterval
+
+from backtest import COMMISSION, load_candles, rsi_positions
+from indicators import rsi_series
+from scheduler import INTERVAL_SECONDS
+
+# Сетка по умолчанию: период RSI, порог покупки, порог продажи
+PERIODS = range(6, 31, 2)
+BUY_LEVELS = range(15, 51, 5)
+SELL_LEVELS = range(50, 91, 5)
+
+# Сколько комбинаций порогов считать одной матрицей (память: комбинации × свечи)
+CHUNK = 64
+
+# Торговых секунд в году — для годового коэффициента Шарпа (252 дня по ~9 часов)
+TRADING_SECONDS_PER_YEAR = 252 * 9 * 60 * 60
+
+# Массив цен в разделяемой памяти воркера: открывается один раз в инициализаторе
+_prices = None
+_shm = None
+
+
+def bars_per_year(interval):
+    if interval == CandleInterval.CANDLE_INTERVAL_DAY:
+        return 252
+    seconds = INTERVAL_SECONDS.get(interval)
+    return TRADING_SECONDS_PER_YEAR / seconds if seconds else 252
+
+
+def _init_worker(name, size):
+    global _prices, _shm
+    _shm = shared_memory.SharedMemory(name=name)
+    _prices = np.ndarray((size,), dtype=np.float64, buffer=_shm.buf)
+
+
+def evaluate(closes, rsi, buys, sells, commission=COMMISSION, periods_per_year=252):
+    # Все пары порогов для одного ряда разом: строки — комбинации, столбцы — свечи.
+    # Правила те же, что в backtest_rsi: сделка по закрытию свечи с сигналом.
+    returns = np.zeros_like(closes)
+    returns[1:] = closes[1:] / closes[:-1] - 1
+    pos = rsi_positions(rsi[None, :], np.asarray(buys)[:, None], np.asarray(sells)[:, None])
+    held = np.zeros_like(pos)
+    held[:, 1:] = pos[:, :-1]
+    turnover = np.abs(np.diff(held, axis=1, prepend=0))
+    pnl = held * returns - turnover * commission
+    equity = np.cumprod(1 + pnl, axis=1)
+    std = pnl.std(axis=1)
+    sharpe = np.divide(pnl.mean(axis=1), std, out=np.zeros_like(std), where=std > 0) * np.sqrt(periods_per_year)
+    drawdown = (1 - equity / np.maximum.accumulate(equity, axis=1)).max(axis=1)
+    return {
+        "return": equity[:, -1] - 1,
+        "sharpe": sharpe,
+        "max_drawdown": drawdown,
+        "trades": turnover.sum(axis=1) // 2,
+    }
+
+
+def _run_task(interval, period, series, pairs, commission):
+    # series — [(имя, смещение, длина)] в общем массиве цен; pairs — [(buy, sell)].
+    # RSI считается один раз на ряд и период, пороги перебираются векторно.
+    buys = np.array([b for b, _ in pairs], dtype=np.float64)
+    sells = np.array([s for _, s in pairs], dtype=np.float64)
+    per_year = bars_per_year(interval)
+    results = []
+    for name, offset, length in series:
+        closes = _prices[offset:offset + length]
+        if length < period + 2:
+            continue
+        rsi = rsi_series(closes, period)[0]
+        for lo in range(0, len(pairs), CHUNK):
+            stats = evaluate(closes, rsi, buys[lo:lo + CHUNK], sells[lo:lo + CHUNK], commission, per_year)
+            for j in range(len(stats["return"])):
+                results.append((
+                    name, interval.name.replace("CANDLE_INTERVAL_", ""), period,
+                    float(buys[lo + j]), float(sells[lo + j]),
+                    float(stats["return"][j]), float(stats["sharpe"][j]),
+                    float(stats["max_drawdown"][j]), int(stats["trades"][j]),
+                ))
+    return results
+
+
+RESULT_FIELDS = ("name", "interval", "period", "buy", "sell", "return", "sharpe", "max_drawdown", "trades")
+
+
+def combinations(intervals, periods, buys, sells, samples=None, seed=0):
+    # {(interval, period): [(buy, sell), ...]}; samples — случайный поиск вместо полной сетки
+    grid = [(i, p, b, s) for i, p, b, s in itertools.product(intervals, periods, buys, sells) if b < s]
+    if samples and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    tasks = {}
+    for interval, period, buy, sell in grid:
+        tasks.setdefault((interval, period), []).append((buy, sell))
+    return tasks
+
+
+def optimize(series_by_interval, tasks, workers=None, commission=COMMISSION):
+    # series_by_interval — {interval: {имя: массив цен закрытия}}. Все ряды складываются
+    # в один блок разделяемой памяти; воркерам уходят только смещения и пороги.
+    layout, arrays, offset = {}, [], 0
+    for interval, series in series_by_interval.items():
+        layout[interval] = []
+        for name, closes in series.items():
+            layout[interval].append((name, offset, len(closes)))
+            arrays.append(np.asarray(closes, dtype=np.float64))
+            offset += len(closes)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1) * 8)
+    prices = np.ndarray((offset,), dtype=np.float64, buffer=shm.buf)
+    try:
+        if arrays:
+            np.concatenate(arrays, out=prices)
+        results = []
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shm.name, offset)) as pool:
+            futures = [
+                pool.submit(_run_task, interval, period, layout[interval], pairs, commission)
+                for (interval, period), pairs in tasks.items() if layout.get(interval)
+            ]
+            for done, future in enumerate(as_completed(futures), 1):
+                results.extend(future.result())
+                logging.info(f"Готово задач: {done}/{len(futures)}")
+        return results
+    finally:
+        # Пока жив view на буфер, close() упадёт с BufferError
+        del prices
+        shm.close()
+        shm.unlink()
+
+
+def rank(results, by="sharpe"):
+    # Сводка по комбинации на весь список инструментов: средний Шарп/доходность и худшая просадка
+    groups = {}
+    for row in results:
+        groups.setdefault(row[1:5], []).append(row)
+    ranked = []
+    for (interval, period, buy, sell), rows in groups.items():
+        ranked.append({
+            "interval": interval, "period": period, "buy": buy, "sell": sell,
+            "instruments": len(rows),
+            "sharpe": float(np.mean([r[6] for r in rows])),
+            "return": float(np.mean([r[5] for r in rows])),
+            "max_drawdown": float(max(r[7] for r in rows)),
+            "trades": int(sum(r[8] for r in rows)),
+        })
+    ranked.sort(key=lambda r: r[by], reverse=by != "max_drawdown")
+    return ranked
+
+
+def _parse_range(value):
+    # "6:30:2" → range(6, 31, 2) (конец включительно) или "14,21" → [14, 21]
+    if ":" in value:
+        start, stop, *step = (int(v) for v in value.split(":"))
+        return range(start, stop + 1, step[0] if step else 1)
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор параметров RSI-стратегии по истории свечей")
+    parser.add_argument("sources", nargs="+", help="FIGI в локальном архиве свечей или .npz/.csv")
+    parser.add_argument("--intervals", nargs="+", default=["1_MIN", "5_MIN"],
+                        help="интервалы архива, например 1_MIN 5_MIN HOUR")
+    parser.add_argument("--periods", type=_parse_range, default=PERIODS, help="например 6:30:2")
+    parser.add_argument("--buy", type=_parse_range, default=BUY_LEVELS, help="например 15:50:5")
+    parser.add_argument("--sell", type=_parse_range, default=SELL_LEVELS, help="например 50:90:5")
+    parser.add_argument("--random", type=int, help="случайные N комбинаций вместо всей сетки")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--commission", type=float, default=COMMISSION)
+    parser.add_argument("--rank-by", choices=("sharpe", "return", "max_drawdown"), default="sharpe")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", help="все результаты по инструментам в .csv")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    intervals = [CandleInterval["CANDLE_INTERVAL_" + name] for name in args.intervals]
+    series_by_interval = {}
+    for source in args.sources:
+        if source.endswith((".npz", ".csv")):
+            # У файла свой интервал; в сетке он идёт под первым из --intervals
+            series_by_interval.setdefault(intervals[0], {})[source] = load_candles(source)["close"]
+            continue
+        for interval in intervals:
+            try:
+                closes = load_candles(source, interval)["close"]
+            except ValueError as e:
+                logging.warning(f"{e}, пропускаю")
+                continue
+            series_by_interval.setdefault(interval, {})[source] = closes
+
+    tasks = combinations(intervals, args.periods, args.buy, args.sell, args.random, args.seed)
+    total = sum(len(pairs) for pairs in tasks.values())
+    logging.info(f"Комбинаций: {total}, рядов: {sum(len(s) for s in series_by_interval.values())}")
+
+    started = time.perf_counter()
+    results = optimize(series_by_interval, tasks, args.workers, args.commission)
+    logging.info(f"Прогонов: {len(results)} за {time.perf_counter() - started:.1f} с")
+
+    for r in rank(results, args.rank_by)[:args.top]:
+        print(f"{r['interval']:>6} RSI({r['period']}) buy<{r['buy']:g} sell>{r['sell']:g}: "
+              f"Шарп {r['sharpe']:.2f}, доходность {r['return']:.2%}, "
+              f"просадка {r['max_drawdown']:.2%}, сделок {r['trades']}")
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_FIELDS)
+            writer.writerows(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import time
+
+import numpy as np
+from tinkoff.invest import OrderBookInstrument, OrderDirection
+
+from utils import quotation_to_float
+
+# Глубина стакана в подписке (API принимает 1, 10, 20, 30, 40, 50)
+ORDERBOOK_DEPTH = 20
+
+# Сколько последних снимков верха стакана (середина, спред, дисбаланс) держать на FIGI
+HISTORY_SIZE = 256
+
+# Дисбаланс считаем по первым уровням — дальние заявки чаще переставляются
+IMBALANCE_LEVELS = 5
+
+# Стакан из живой подписки актуален, даже если давно не менялся. Снимок из опроса (или из
+# оборвавшегося стрима) старше этого не используем — решения по нему хуже, чем без него
+MAX_BOOK_AGE = 10.0
+
+# Дальше этой доли от лучшей цены по стакану не идём, когда считаем, сколько лотов купить
+MAX_BOOK_SLIPPAGE = 0.002
+
+BUY = OrderDirection.ORDER_DIRECTION_BUY
+
+
+class OrderBook:
+    # Снимок стакана одного FIGI на заранее выделенных NumPy-массивах: обновление пишет
+    # в те же массивы, чтения — несколько скаляров или один searchsorted.
+    # Цены — за штуку, объёмы — в лотах, как в ответе API.
+    __slots__ = ("depth", "prices", "lots", "cum_lots", "cum_value", "count", "time", "received", "streamed",
+                 "h_time", "h_mid", "h_spread", "h_imbalance", "h_pos", "h_count")
+
+    def __init__(self, depth=ORDERBOOK_DEPTH, history=HISTORY_SIZE):
+        self.depth = depth
+        # Строка 0 — биды (цена по убыванию), строка 1 — аски (по возрастанию)
+        self.prices = np.zeros((2, depth), dtype=np.float64)
+        self.lots = np.zeros((2, depth), dtype=np.float64)
+        # Нарастающие объём и стоимость по уровням — для VWAP и «сколько влезет» за O(log depth)
+        self.cum_lots = np.zeros((2, depth), dtype=np.float64)
+        self.cum_value = np.zeros((2, depth), dtype=np.float64)
+        self.count = [0, 0]
+        self.time = 0.0         # время снимка на бирже, epoch
+        self.received = 0.0     # когда получен, time.monotonic()
+        self.streamed = False   # последнее обновление пришло по подписке, а не из опроса
+        self.h_time = np.zeros(history, dtype=np.float64)
+        self.h_mid = np.zeros(history, dtype=np.float64)
+        self.h_spread = np.zeros(history, dtype=np.float64)
+        self.h_imbalance = np.zeros(history, dtype=np.float64)
+        self.h_pos = 0
+        self.h_count = 0
+
+    def _fill(self, side, orders):
+        prices, lots = self.prices[side], self.lots[side]
+        n = min(len(orders), self.depth)
+        for i in range(n):
+            prices[i] = quotation_to_float(orders[i].price)
+            lots[i] = orders[i].quantity
+        if n:
+            value = self.cum_value[side, :n]
+            np.cumsum(lots[:n], out=self.cum_lots[side, :n])
+            np.multiply(prices[:n], lots[:n], out=value)
+            np.cumsum(value, out=value)
+        self.count[side] = n
+
+    def update(self, bids, asks, ts=None, streamed=False):
+        # bids/asks — уровни из ответа API (price: Quotation, quantity: лоты)
+        self._fill(0, bids)
+        self._fill(1, asks)
+        self.time = time.time() if ts is None else ts
+        self.received = time.monotonic()
+        self.streamed = streamed
+        if self.count[0] and self.count[1]:
+            i = self.h_pos
+            self.h_time[i] = self.time
+            self.h_mid[i] = self.mid()
+            self.h_spread[i] = self.spread()
+            self.h_imbalance[i] = self.imbalance()
+            self.h_pos = (i + 1) % len(self.h_time)
+            self.h_count = min(self.h_count + 1, len(self.h_time))
+
+    def age(self):
+        return time.monotonic() - self.received if self.received else float("inf")
+
+    def best_bid(self):
+        return float(self.prices[0, 0]) if self.count[0] else None
+
+    def best_ask(self):
+        return float(self.prices[1, 0]) if self.count[1] else None
+
+    def mid(self):
+        if not (self.count[0] and self.count[1]):
+            return None
+        return (float(self.prices[0, 0]) + float(self.prices[1, 0])) / 2
+
+    def spread(self):
+        if not (self.count[0] and self.count[1]):
+            return None
+        return float(self.prices[1, 0] - self.prices[0, 0])
+
+    def relative_spread(self):
+        # Спред в долях от середины
+        mid = self.mid()
+        return self.spread() / mid if mid else None
+
+    def imbalance(self, levels=IMBALANCE_LEVELS):
+        # (биды − аски) / (биды + аски) по первым levels уровням: +1 — давят покупатели, −1 — продавцы
+        bid = self.cum_lots[0, min(levels, self.count[0]) - 1] if self.count[0] else 0.0
+        ask = self.cum_lots[1, min(levels, self.count[1]) - 1] if self.count[1] else 0.0
+        total = bid + ask
+        return float((bid - ask) / total) if total else 0.0
+
+    def _side(self, direction):
+        # Покупка забирает аски, продажа — биды
+        return 1 if direction == BUY else 0
+
+    def vwap_to_fill(self, direction, lots):
+        # Средняя цена за штуку, если рыночная заявка на lots лотов пройдёт по стакану;
+        # None — видимой глубины не хватает
+        side = self._side(direction)
+        n = self.count[side]
+        if not n or lots <= 0:
+            return None
+        cum_lots = self.cum_lots[side, :n]
+        i = int(np.searchsorted(cum_lots, lots, "left"))
+        if i >= n:
+            return None
+        before_lots = cum_lots[i - 1] if i else 0.0
+        before_value = self.cum_value[side, i - 1] if i else 0.0
+        return float((before_value + (lots - before_lots) * self.prices[side, i]) / lots)
+
+    def max_lots(self, direction, budget, lot=1, max_slippage=None):
+        # Сколько лотов можно купить (продать) на budget ₽, проходя по стакану;
+        # max_slippage — не дальше этой доли от лучшей цены
+        side = self._side(direction)
+        n = self.count[side]
+        if not n:
+            return 0
+        prices = self.prices[side, :n]
+        if max_slippage is not None:
+            if side:
+                n = int(np.searchsorted(prices, prices[0] * (1 + max_slippage), "right"))
+            else:
+                n = int(np.searchsorted(-prices, -prices[0] * (1 - max_slippage), "right"))
+        cost = self.cum_value[side, :n] * lot
+        # Уровни, которые выкупаются целиком, и остаток денег на часть следующего
+        i = int(np.searchsorted(cost, budget, "right"))
+        full = self.cum_lots[side, i - 1] if i else 0.0
+        if i < n:
+            rest = budget - (cost[i - 1] if i else 0.0)
+            full += min(rest // (prices[i] * lot), self.lots[side, i])
+        return int(full)
+
+    def history(self, n=None):
+        # Последние n снимков верха стакана по времени: {колонка: массив}
+        n = self.h_count if n is None else min(n, self.h_count)
+        idx = (self.h_pos - n + np.arange(n)) % len(self.h_time)
+        return {
+            "time": self.h_time[idx], "mid": self.h_mid[idx],
+            "spread": self.h_spread[idx], "imbalance": self.h_imbalance[idx],
+        }
+
+
+class OrderBooks:
+    # Стаканы отслеживаемых FIGI. Подписку и обновления ведёт MarketDataEngine в своём стриме,
+    # отсюда только читают: спред, дисбаланс и средняя цена исполнения
+    def __init__(self, figis, depth=ORDERBOOK_DEPTH, max_age=MAX_BOOK_AGE):
+        self.depth = depth
+        self.max_age = max_age
+        self.books = {figi: OrderBook(depth) for figi in figis}
+
+    def instruments(self):
+        return [OrderBookInstrument(figi=figi, depth=self.depth) for figi in self.books]
+
+    def on_orderbook(self, figi, bids, asks, ts=None, streamed=False):
+        book = self.books.get(figi)
+        if book is not None:
+            book.update(bids, asks, ts, streamed)
+
+    def unsubscribed(self, figi=None):
+        # Подписка на стакан figi (или все, если стрим оборвался) больше не действует:
+        # эти стаканы дальше живут по max_age, как снимки из опроса
+        for key in (self.books if figi is None else (figi,)):
+            if key in self.books:
+                self.books[key].streamed = False
+
+    def streamed(self, figi):
+        # Стакан figi сейчас обновляется по подписке
+        book = self.books.get(figi)
+        return book is not None and book.streamed
+
+    def get(self, figi):
+        # Свежий стакан или None
+        book = self.books.get(figi)
+        if book is None or not book.received:
+            return None
+        if not book.streamed and book.age() > self.max_age:
+            return None
+        return book
+
+    def spread(self, figi):
+        book = self.get(figi)
+        return book.relative_spread() if book else None
+
+    def imbalance(self, figi, levels=IMBALANCE_LEVELS):
+        book = self.get(figi)
+        return book.imbalance(levels) if book else None
+
+    def vwap_to_fill(self, figi, direction, lots):
+        book = self.get(figi)
+        return book.vwap_to_fill(direction, lots) if book else None
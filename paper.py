@@ -0,0 +1,319 @@
+import datetime
+import itertools
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+from tinkoff.invest import OrderDirection
+
+from client_pool import get_pool
+from config import TINKOFF_API_TOKEN
+from instruments import get_registry
+from ledger import MOSCOW
+from market_calendar import get_market_calendar
+from orderbook import MAX_BOOK_SLIPPAGE
+from risk import NotEnoughMoney, RiskRejected
+from tinkoff_api import TinkoffAPI
+
+# Модель исполнения по умолчанию: проскальзывание рыночной заявки и комиссия брокера (доли)
+PAPER_SLIPPAGE = 0.0005
+PAPER_COMMISSION = 0.0005
+PAPER_MIN_COMMISSION = 0.0
+
+# Стартовый баланс бумажного счёта, ₽
+PAPER_CASH = float(os.getenv("PAPER_CASH", "100000"))
+
+BUY = OrderDirection.ORDER_DIRECTION_BUY
+
+
+class PaperOrder:
+    # Та же форма, что у execution.OrderTicket: стратегии и Telegram не различают их
+    __slots__ = ("order_id", "account", "figi", "direction", "quantity", "lot", "limit_price",
+                 "reference_price", "status", "filled_units", "avg_price", "submitted_at", "filled_at")
+
+    def __init__(self, order_id, account, figi, direction, quantity, lot, limit_price, reference_price):
+        self.order_id = order_id
+        self.account = account
+        self.figi = figi
+        self.direction = direction
+        self.quantity = quantity        # в лотах
+        self.lot = lot
+        self.limit_price = limit_price
+        self.reference_price = reference_price
+        self.status = "submitted"
+        self.filled_units = 0
+        self.avg_price = None
+        self.submitted_at = time.perf_counter()
+        self.filled_at = None
+
+    @property
+    def latency(self):
+        return None if self.filled_at is None else self.filled_at - self.submitted_at
+
+    @property
+    def slippage(self):
+        if not self.reference_price or self.avg_price is None:
+            return None
+        diff = (self.avg_price - self.reference_price) / self.reference_price
+        return diff if self.direction == BUY else -diff
+
+
+class PaperAccount:
+    # Виртуальный счёт: деньги, позиции по средней цене, реализованная прибыль по дням.
+    # Несколько словарей и чисел — тысячи таких счетов в одном процессе ничего не стоят
+    __slots__ = ("account_id", "cash", "positions", "daily", "orders")
+
+    def __init__(self, account_id, cash=PAPER_CASH):
+        self.account_id = account_id
+        self.cash = cash
+        self.positions = {}     # {figi: [штук, себестоимость]}
+        self.daily = {}         # {дата МСК: [сделок, реализованная прибыль]}
+        self.orders = {}        # {order_id: PaperOrder}
+
+    def quantity(self, figi):
+        return self.positions.get(figi, (0, 0.0))[0]
+
+    def average_price(self, figi):
+        units, cost = self.positions.get(figi, (0, 0.0))
+        return cost / units if units else None
+
+    def apply_fill(self, figi, direction, units, price, commission):
+        stats = self.daily.setdefault(datetime.datetime.now(MOSCOW).date(), [0, 0.0])
+        stats[0] += 1
+        stats[1] -= commission
+        book = self.positions.setdefault(figi, [0, 0.0])
+        if direction == BUY:
+            self.cash -= units * price + commission
+            book[0] += units
+            book[1] += units * price
+        else:
+            avg = book[1] / book[0]
+            self.cash += units * price - commission
+            stats[1] += (price - avg) * units
+            book[0] -= units
+            book[1] -= avg * units
+            if not book[0]:
+                del self.positions[figi]
+
+
+class PaperBroker:
+    # Исполняет заявки бумажных счетов по живым ценам MarketDataEngine. Рыночные — сразу:
+    # по стакану, если он есть, иначе по последней цене с проскальзыванием; лимитные — когда
+    # цена их пересечёт. Лимитки хранятся по FIGI,
+    # так что обновление цены проверяет только заявки этого инструмента, а не все счета.
+    def __init__(self, market_data, slippage=PAPER_SLIPPAGE, commission=PAPER_COMMISSION,
+                 min_commission=PAPER_MIN_COMMISSION, state=None):
+        self.market_data = market_data
+        # StateStore(..., paper=True): если задан, деньги и позиции счетов переживают перезапуск
+        self.state = state
+        # slippage — доля или функция (figi, direction, units, price) → доля
+        self.slippage = slippage
+        self.commission = commission
+        self.min_commission = min_commission
+        self.accounts = {}
+        self._resting = {}      # {figi: [PaperOrder, ...]}
+        self._ids = itertools.count(1)
+        market_data.price_listeners.append(self.on_price)
+
+    def open_account(self, account_id, cash=PAPER_CASH):
+        if account_id not in self.accounts:
+            account = PaperAccount(account_id, cash)
+            saved = self.state.paper_account(account_id) if self.state is not None else None
+            if saved is not None:
+                account.cash, account.positions = saved
+            self.accounts[account_id] = account
+        return PaperTinkoffAPI(self, self.accounts[account_id])
+
+    def _save(self, account):
+        if self.state is not None:
+            self.state.save_paper_account(account.account_id, account.cash, account.positions)
+
+    def _slippage(self, figi, direction, units, price):
+        if callable(self.slippage):
+            return self.slippage(figi, direction, units, price)
+        return self.slippage
+
+    def _fee(self, value):
+        return max(value * self.commission, self.min_commission)
+
+    def _market_fill(self, figi, direction, quantity, lot, price):
+        # Цена рыночного исполнения за штуку: по стакану, если он есть и его хватает,
+        # иначе последняя цена с проскальзыванием
+        book = self.market_data.orderbooks.get(figi) if self.market_data.orderbooks is not None else None
+        vwap = book.vwap_to_fill(direction, quantity) if book is not None else None
+        if vwap is not None:
+            return vwap
+        slippage = self._slippage(figi, direction, quantity * lot, price)
+        return price * (1 + slippage if direction == BUY else 1 - slippage)
+
+    def _buy_cost(self, figi, quantity, lot, price, limit_price=None):
+        # Сколько спишется за покупку: по той же формуле проверяет submit и считает max_lots
+        units = quantity * lot
+        value = units * (limit_price if limit_price is not None else self._market_fill(figi, BUY, quantity, lot, price))
+        return value + self._fee(value)
+
+    def max_lots(self, account, figi, price, budget=None):
+        # Сколько лотов купится рыночной заявкой на budget ₽ так, чтобы submit её принял
+        lot = get_registry().lot(figi)
+        budget = account.cash if budget is None else min(budget, account.cash)
+        per_lot = price * lot * (1 + self._slippage(figi, BUY, lot, price)) * (1 + self.commission)
+        quantity = int(max(budget - self.min_commission, 0) // per_lot)
+        # Стакан и функция проскальзывания нелинейны — досчитываем точной формулой
+        while quantity > 0 and self._buy_cost(figi, quantity, lot, price) > budget:
+            quantity -= 1
+        return quantity
+
+    def submit(self, account, figi, direction, quantity, limit_price=None, reference_price=None, order_id=None):
+        if quantity <= 0 or int(quantity) != quantity:
+            raise RiskRejected(f"Количество должно быть целым числом лотов, получено {quantity}")
+        price = self.market_data.last_price(figi)
+        if price is None:
+            raise RiskRejected(f"Нет цены по {figi} — бумажная заявка не может быть исполнена")
+        lot = get_registry().lot(figi)
+        units = quantity * lot
+        if direction == BUY:
+            need = self._buy_cost(figi, quantity, lot, price, limit_price)
+            if need > account.cash:
+                raise NotEnoughMoney(f"Нужно {need:.2f} ₽, на бумажном счёте {account.cash:.2f} ₽")
+        elif units > account.quantity(figi):
+            raise RiskRejected(f"Продаём {units} шт. {figi}, а на бумажном счёте {account.quantity(figi)}")
+
+        order = PaperOrder(order_id or f"paper-{next(self._ids)}", account, figi, direction, quantity, lot,
+                           limit_price, reference_price or price)
+        account.orders[order.order_id] = order
+        if not self._try_fill(order, price):
+            self._resting.setdefault(figi, []).append(order)
+        return order
+
+    def _try_fill(self, order, price):
+        units = order.quantity * order.lot
+        buy = order.direction == BUY
+        fill = self._market_fill(order.figi, order.direction, order.quantity, order.lot, price)
+        if order.limit_price is not None:
+            # Лимитка исполняется, только если рынок дошёл до её цены, и не хуже неё
+            if (buy and price > order.limit_price) or (not buy and price < order.limit_price):
+                return False
+            fill = min(fill, order.limit_price) if buy else max(fill, order.limit_price)
+        fee = self._fee(units * fill)
+        if (not buy and units > order.account.quantity(order.figi)) or (buy and units * fill + fee > order.account.cash):
+            # Пока лимитка висела, деньги или бумаги ушли на другие заявки
+            order.status = "rejected"
+            return True
+        order.account.apply_fill(order.figi, order.direction, units, fill, fee)
+        self._save(order.account)
+        order.filled_units = units
+        order.avg_price = fill
+        order.status = "filled"
+        order.filled_at = time.perf_counter()
+        logging.info(f"[PAPER] {order.account.account_id}: {'покупка' if buy else 'продажа'} "
+                     f"{units} шт. {order.figi} по {fill:.4f}")
+        return True
+
+    def on_price(self, figi, price):
+        resting = self._resting.get(figi)
+        if not resting:
+            return
+        self._resting[figi] = [o for o in resting if o.status == "submitted" and not self._try_fill(o, price)]
+
+    def cancel(self, order):
+        if order.status == "submitted":
+            order.status = "cancelled"
+            resting = self._resting.get(order.figi, [])
+            if order in resting:
+                resting.remove(order)
+        return order
+
+
+def _quotation(value):
+    units = int(value)
+    return SimpleNamespace(units=units, nano=int(round((value - units) * 1e9)))
+
+
+class PaperTinkoffAPI(TinkoffAPI):
+    # TinkoffAPI, у которого заявки и портфель — на бумажном счёте, а цены, RSI и расписание —
+    # настоящие. Дополнительно повторяет функции order_manager (buy_figi, sell_figi, ...)
+    def __init__(self, broker, account):
+        # Без TinkoffAPI.__init__: настоящие журнал, исполнение и база состояния бумажному
+        # счёту не нужны и не должны открываться
+        self.token = TINKOFF_API_TOKEN
+        self.pool = get_pool(self.token)
+        self.calendar = get_market_calendar()
+        self.state = broker.state
+        self.ledger = self.execution = self.risk = None
+        self.broker = broker
+        self.account = account
+        self.market_data = broker.market_data
+
+    async def get_portfolio(self):
+        return [
+            SimpleNamespace(figi=figi, quantity=_quotation(units),
+                            average_position_price=_quotation(cost / units))
+            for figi, (units, cost) in self.account.positions.items()
+        ]
+
+    async def get_position_by_figi(self, figi):
+        for position in await self.get_portfolio():
+            if position.figi == figi:
+                return position
+        return None
+
+    async def get_quantity(self, figi):
+        return self.account.quantity(figi)
+
+    async def get_balance(self):
+        return self.account.cash
+
+    async def get_lot_price_and_max_quantity(self, figi, balance):
+        price = await self.get_last_price(figi)
+        if not price:
+            return None, 0
+        lot = await self.get_lot(figi)
+        budget = min(balance, self.account.cash)
+        quantity = self.broker.max_lots(self.account, figi, price, budget)
+        book = self.get_orderbook(figi)
+        if book is not None:
+            quantity = min(quantity, book.max_lots(BUY, budget / (1 + self.broker.commission), lot, MAX_BOOK_SLIPPAGE))
+        return price, quantity
+
+    async def _order(self, figi, direction, quantity, limit_price):
+        return self.broker.submit(self.account, figi, direction, quantity, limit_price,
+                                  await self.get_last_price(figi))
+
+    async def buy(self, figi, quantity=1, limit_price=None):
+        # Как у TinkoffAPI: цена исполнения или None (лимитка ещё висит), отказы пробрасываются
+        order = await self._order(figi, BUY, quantity, limit_price)
+        return order.avg_price if order.status == "filled" else None
+
+    async def sell(self, figi, quantity=1, limit_price=None):
+        order = await self._order(figi, OrderDirection.ORDER_DIRECTION_SELL, quantity, limit_price)
+        return order.avg_price if order.status == "filled" else None
+
+    async def get_daily_profit(self):
+        return self.account.daily.get(datetime.datetime.now(MOSCOW).date(), [0, 0.0])[1]
+
+    async def get_today_transaction_count(self):
+        return self.account.daily.get(datetime.datetime.now(MOSCOW).date(), [0, 0.0])[0]
+
+    # ----- Интерфейс order_manager -----
+
+    async def list_accounts(self):
+        return "\n".join(f"{a.account_id}: PAPER, {a.cash:.2f} ₽" for a in self.broker.accounts.values())
+
+    async def list_portfolio(self):
+        registry = await get_registry().load()
+        result = []
+        for figi, (units, _) in self.account.positions.items():
+            ins = registry.get(figi)
+            result.append(f"{ins.name if ins else '—'} ({ins.ticker if ins else '—'}, {figi}): {units} шт.")
+        return "\n".join(result) if result else "Портфель пуст"
+
+    async def buy_figi(self, figi, qty, price):
+        return self.broker.submit(self.account, figi, BUY, qty, reference_price=price)
+
+    async def sell_figi(self, figi, qty, price):
+        return self.broker.submit(self.account, figi, OrderDirection.ORDER_DIRECTION_SELL, qty,
+                                  reference_price=price)
+
+    async def get_average_buy_price(self, figi):
+        return self.account.average_price(figi)
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import time
+
+from client_pool import get_pool
+from metrics import RPC_LATENCY, RPC_ERRORS
+from utils import quotation_to_float
+
+# Сколько секунд снимок портфеля считается свежим. После наших сделок
+# кэш сбрасывается сразу, так что TTL защищает только от чужих изменений.
+PORTFOLIO_TTL = 30
+
+RUB_FIGI = "RUB000UTSTOM"
+
+
+class PortfolioCache:
+    # Снимок портфеля {figi: PortfolioPosition}, общий для всех мест, где нужен портфель
+    def __init__(self, account_id, pool=None, ttl=PORTFOLIO_TTL):
+        self.account_id = account_id
+        self.pool = pool or get_pool()
+        self.ttl = ttl
+        self.positions = {}
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self):
+        return time.monotonic() - self._fetched_at < self.ttl
+
+    def invalidate(self):
+        self._fetched_at = 0.0
+
+    async def get(self):
+        # Одновременные запросы ждут один и тот же RPC, а не делают свои
+        async with self._lock:
+            if not self.is_fresh():
+                # В RPC_LATENCY — только настоящий запрос, попадания в кэш не считаем
+                started = time.perf_counter()
+                try:
+                    async with self.pool.session() as client:
+                        portfolio = await client.operations.get_portfolio(account_id=self.account_id)
+                except Exception:
+                    RPC_ERRORS.inc(method="get_portfolio")
+                    raise
+                RPC_LATENCY.observe(time.perf_counter() - started, method="get_portfolio")
+                self.positions = {p.figi: p for p in portfolio.positions}
+                self._fetched_at = time.monotonic()
+            return self.positions
+
+    async def position(self, figi):
+        return (await self.get()).get(figi)
+
+    async def quantity(self, figi):
+        pos = await self.position(figi)
+        return quotation_to_float(pos.quantity) if pos else 0.0
+
+    async def average_price(self, figi):
+        pos = await self.position(figi)
+        return quotation_to_float(pos.average_position_price) if pos else None
+
+    async def rub_balance(self):
+        return await self.quantity(RUB_FIGI)
+
+
+_caches = {}
+
+
+def get_portfolio_cache(account_id=None):
+    account_id = account_id or os.getenv("TINKOFF_ACCOUNT_ID")
+    if account_id not in _caches:
+        _caches[account_id] = PortfolioCache(account_id)
+    return _caches[account_id]
@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+from tinkoff.invest import OrderDirection
+
+from client_pool import get_pool
+from instruments import get_registry
+from ledger import get_ledger
+from utils import quotation_to_float
+
+# Лимиты
+MAX_POSITION_VALUE = 200_000      # ₽ на один инструмент
+DAILY_LOSS_LIMIT = 10_000         # ₽; после такого убытка за день новые покупки запрещены
+MAX_ORDERS_PER_MINUTE = 10
+
+
+class RiskRejected(Exception):
+    pass
+
+
+class NotEnoughMoney(RiskRejected):
+    pass
+
+
+class AccountState:
+    # Деньги и бумаги на счёте в памяти: один раз загружаем get_positions,
+    # дальше обновляемся из стрима позиций, без запросов на каждую заявку
+    def __init__(self, account_id, pool=None):
+        self.account_id = account_id
+        self.pool = pool or get_pool()
+        self.cash = {}          # {валюта: доступно}
+        self.securities = {}    # {figi: штук}
+        self.loaded = False
+        self._task = None
+
+    async def load(self):
+        async with self.pool.session() as client:
+            resp = await client.operations.get_positions(account_id=self.account_id)
+        self.cash = {m.currency: quotation_to_float(m) for m in resp.money}
+        self.securities = {s.figi: s.balance for s in resp.securities}
+        self.loaded = True
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.load()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_stream())
+
+    async def _run_stream(self):
+        delay = 1
+        while True:
+            try:
+                await self.load()
+                async with self.pool.session() as client:
+                    async for resp in client.operations_stream.positions_stream(accounts=[self.account_id]):
+                        delay = 1
+                        if resp.position:
+                            self._apply(resp.position)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Стрим позиций оборвался: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def _apply(self, position):
+        for m in position.money:
+            value = m.available_value
+            self.cash[value.currency] = quotation_to_float(value)
+        for s in position.securities:
+            self.securities[s.figi] = s.balance
+
+    def rub(self):
+        return self.cash.get("rub", 0.0)
+
+
+class RiskManager:
+    # Предторговые проверки только по данным в памяти — микросекунды на заявку
+    def __init__(self, account, ledger=None, registry=None, max_position_value=MAX_POSITION_VALUE,
+                 daily_loss_limit=DAILY_LOSS_LIMIT, max_orders_per_minute=MAX_ORDERS_PER_MINUTE):
+        self.account = account
+        self.ledger = ledger or get_ledger(account.account_id)
+        self.registry = registry or get_registry()
+        self.max_position_value = max_position_value
+        self.daily_loss_limit = daily_loss_limit
+        self.max_orders_per_minute = max_orders_per_minute
+        self._orders = collections.deque()
+
+    def max_lots(self, figi, price):
+        # Сколько лотов можно купить: по деньгам и по лимиту на позицию
+        lot_price = price * self.registry.lot(figi)
+        if lot_price <= 0:
+            return 0
+        held_value = self.account.securities.get(figi, 0) * price
+        budget = min(self.account.rub(), self.max_position_value - held_value)
+        return max(int(budget // lot_price), 0)
+
+    def check(self, figi, direction, lots, price):
+        if lots <= 0 or int(lots) != lots:
+            raise RiskRejected(f"Количество должно быть целым числом лотов, получено {lots}")
+        lot = self.registry.lot(figi)
+        units = lots * lot
+
+        now = time.monotonic()
+        while self._orders and now - self._orders[0] > 60:
+            self._orders.popleft()
+        if len(self._orders) >= self.max_orders_per_minute:
+            raise RiskRejected(f"Превышен лимит {self.max_orders_per_minute} заявок в минуту")
+
+        if direction == OrderDirection.ORDER_DIRECTION_BUY:
+            if self.ledger.daily_profit() <= -self.daily_loss_limit:
+                raise RiskRejected(f"Дневной убыток достиг лимита {self.daily_loss_limit} ₽, покупки запрещены")
+            if price:
+                cost = units * price
+                if cost > self.account.rub():
+                    raise NotEnoughMoney(f"Нужно {cost:.2f} ₽, доступно {self.account.rub():.2f} ₽")
+                held = self.account.securities.get(figi, 0)
+                if (held + units) * price > self.max_position_value:
+                    raise RiskRejected(
+                        f"Позиция {figi} превысит лимит {self.max_position_value} ₽"
+                    )
+        else:
+            held = self.account.securities.get(figi, 0)
+            if units > held:
+                raise RiskRejected(f"Продаём {units} шт. {figi}, а на счёте {held}")
+
+        self._orders.append(now)
+
+
+_managers = {}
+
+
+def get_risk_manager(account_id=None):
+    account_id = account_id or os.getenv("TINKOFF_ACCOUNT_ID")
+    if account_id not in _managers:
+        _managers[account_id] = RiskManager(AccountState(account_id))
+    return _managers[account_id]
@@ -1,21 +1,37 @@
 import asyncio
-import os
 import logging
-from tinkoff.invest import AsyncClient, CandleInterval
+import time
+import numpy as np
+from tinkoff.invest import CandleInterval
+from client_pool import get_pool
+from market_data import MarketDataEngine
+from candle_store import get_candle_store
+from state_store import get_state_store
+from indicators import rsi_batch, wilder_rsi
 from utils import TICKERS, FIGI_MAP
-from order_manager import list_portfolio
+from portfolio_cache import get_portfolio_cache
+from instruments import get_registry
+from market_calendar import get_market_calendar
 from telegram_interface import request_buy_confirmation, request_sell_confirmation
 from utils import quotation_to_float
+from metrics import TICK_DURATION, TICK_ERRORS
 
 # Сколько свечей использовать для RSI (обычно 14)
 RSI_PERIOD = 14
 
+# Сколько последних свечей брать в матрицу для пакетного RSI
+LOOKBACK = RSI_PERIOD * 20
+
 # Пороговые значения
 RSI_BUY = 20
 RSI_SELL = 80
 
-# Храним цены покупки для расчёта прибыли
-BUY_PRICES = {}
+# Параллельный скан: сколько тикеров догружать одновременно и таймаут на один запрос (с)
+SCAN_CONCURRENCY = 10
+SCAN_TIMEOUT = 10
+
+# Задержка последнего скана по тикерам, секунды
+SCAN_LATENCY = {}
 
 async def fetch_candles(figi, client, interval=RSI_PERIOD + 30):
     from datetime import datetime, timedelta, timezone
@@ -29,78 +45,120 @@ async def fetch_candles(figi, client, interval=RSI_PERIOD + 30):
     return [quotation_to_float(candle.close) for candle in candles.candles]  # close prices
 
 def calculate_rsi(prices, period=RSI_PERIOD):
-    if len(prices) < period + 1:
+    rsi = wilder_rsi(prices, period)
+    if rsi is None:
         return 50  # нейтральное значение, если данных мало
-
-    gains = []
-    losses = []
-    for i in range(1, period + 1):
-        diff = prices[-i] - prices[-i - 1]
-        if diff >= 0:
-            gains.append(diff)
-            losses.append(0)
-        else:
-            gains.append(0)
-            losses.append(-diff)
-    avg_gain = sum(gains) / period
-    avg_loss = sum(losses) / period
-
-    if avg_loss == 0:
-        return 100  # перекупленность
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
     return rsi
 
-async def get_owned_figis():
-    # Берём список купленных бумаг из портфеля
-    raw = await list_portfolio()
-    # Ищем FIGI из текста (или можно доработать парсер)
-    figis = []
-    for figi in FIGI_MAP.values():
-        if figi in raw:
-            figis.append(figi)
-    return figis
+async def fetch_ticker(ticker, figi, client, semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(fetch_candles(figi, client), SCAN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"[SCAN] {ticker}: нет ответа за {SCAN_TIMEOUT} с")
+        except Exception as e:
+            logging.warning(f"[SCAN] {ticker}: ошибка загрузки свечей: {e}")
+        finally:
+            SCAN_LATENCY[ticker] = time.perf_counter() - started
+        return []
+
+async def get_owned_figis(figis):
+    # Берём список купленных бумаг из общего снимка портфеля
+    positions = await get_portfolio_cache().get()
+    return [figi for figi in figis if figi in positions]
+
+async def scan_once(engine, tickers, figis, state):
+    # Один проход скана: RSI по всем инструментам и сигналы. Вынесен из run_signals,
+    # чтобы его можно было гонять в бенчмарке без бесконечного цикла
+    scan_started = time.perf_counter()
+
+    # Все инструменты за один проход: матрица цен из буферов → вектор RSI
+    prices = engine.matrix(figis, n=LOOKBACK)
+    rsis = rsi_batch(prices, RSI_PERIOD)
+    last_prices = prices[:, -1].copy()
+
+    # В матрице NaN, если в буфере меньше LOOKBACK свечей. Для RSI хватает period + 1 —
+    # такие строки считаем инкрементальным RSI движка, без запросов
+    for row in np.flatnonzero(np.isnan(rsis)):
+        closes = engine.closes(figis[row])
+        if len(closes) >= RSI_PERIOD + 1:
+            rsi = engine.rsi(figis[row], period=RSI_PERIOD)
+            if rsi is not None:
+                rsis[row] = rsi
+                last_prices[row] = closes[-1]
+
+    # RPC — только если в буфере действительно меньше period + 1 свечей:
+    # параллельно, не больше SCAN_CONCURRENCY запросов сразу, вместе с портфелем
+    missing = np.flatnonzero(np.isnan(rsis))
+    semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+    async with get_pool().session() as client:
+        held_figis, *fetched = await asyncio.gather(
+            get_owned_figis(figis),
+            *(fetch_ticker(tickers[row], figis[row], client, semaphore) for row in missing),
+        )
+    for row, closes in zip(missing, fetched):
+        if closes:
+            rsis[row] = calculate_rsi(closes)
+            last_prices[row] = closes[-1]
+
+    if len(missing):
+        slowest = max(missing, key=lambda row: SCAN_LATENCY.get(tickers[row], 0))
+        logging.info(
+            f"[SCAN] догружено {len(missing)} тикеров за {time.perf_counter() - scan_started:.2f} с, "
+            f"самый медленный {tickers[slowest]}: {SCAN_LATENCY[tickers[slowest]]:.2f} с"
+        )
+
+    for ticker, figi, rsi, last_price in zip(tickers, figis, rsis, last_prices):
+        if np.isnan(last_price):
+            continue
+        logging.info(f"[RSI] {ticker} ({figi}) → {rsi:.2f}")
+        already_bought = figi in held_figis
+
+        # --- Сигнал на покупку ---
+        if rsi < RSI_BUY and not already_bought:
+            qty = 1  # Кол-во акций, можно доработать
+            state.record_signal(figi, "buy", rsi, last_price)
+            # Цену покупки запишет _confirm_buy после исполнения — подтверждение идёт в фоне
+            await request_buy_confirmation(figi, qty, last_price)
+
+        # --- Сигнал на продажу ---
+        if rsi > RSI_SELL and already_bought:
+            qty = 1  # Кол-во акций на продажу, доработайте по портфелю
+            buy_price = state.avg_price(figi) or last_price
+            state.record_signal(figi, "sell", rsi, last_price)
+            await request_sell_confirmation(figi, qty, buy_price, last_price)
 
-async def run_signals():
-    from tinkoff.invest.async_services import InstrumentsService, MarketDataService
-    from tinkoff.invest import AsyncClient
 
+async def run_signals():
     logging.info("Старт RSI-стратегии")
 
-    TOKEN = os.getenv("TINKOFF_API_TOKEN")
+    registry = await get_registry().load()
+    asyncio.create_task(registry.run_refresh())
+    figi_map = registry.figi_map(TICKERS, fallback=FIGI_MAP)
+    tickers = list(figi_map)
+    figis = [figi_map[ticker] for ticker in tickers]
+    engine = MarketDataEngine(figis, store=get_candle_store())
+    # Цены покупки и история сигналов переживают перезапуск
+    state = get_state_store()
+    state.start()
+    await engine.start()
+    calendar = await get_market_calendar().ensure_loaded()
 
     while True:
         try:
-            async with AsyncClient(TOKEN) as client:
-                for ticker in TICKERS:
-                    figi = FIGI_MAP[ticker]
-                    prices = await fetch_candles(figi, client)
-                    if not prices:
-                        continue
-
-                    rsi = calculate_rsi(prices)
-                    logging.info(f"[RSI] {ticker} ({figi}) → {rsi:.2f}")
-
-                    # Получаем, есть ли бумага в портфеле
-                    held_figis = await get_owned_figis()
-                    already_bought = figi in held_figis
-
-                    # --- Сигнал на покупку ---
-                    if rsi < RSI_BUY and not already_bought:
-                        last_price = prices[-1]
-                        qty = 1  # Кол-во акций, можно доработать
-                        await request_buy_confirmation(figi, qty, last_price)
-                        BUY_PRICES[figi] = last_price  # фиксируем цену покупки
-
-                    # --- Сигнал на продажу ---
-                    if rsi > RSI_SELL and already_bought:
-                        qty = 1  # Кол-во акций на продажу, доработайте по портфелю
-                        buy_price = BUY_PRICES.get(figi, prices[-1])
-                        curr_price = prices[-1]
-                        await request_sell_confirmation(figi, qty, buy_price, curr_price)
-
+            opens = calendar.next_open()
+            if opens is not None and opens > time.time():
+                # Вне сессии не сканируем — спим до открытия
+                logging.info(f"[SCAN] рынок закрыт, ждём до {time.strftime('%d.%m %H:%M', time.localtime(opens))}")
+                await asyncio.sleep(opens - time.time())
+                await calendar.ensure_loaded()
+                continue
+            scan_started = time.perf_counter()
+            await scan_once(engine, tickers, figis, state)
+            TICK_DURATION.observe(time.perf_counter() - scan_started, strategy="rsi_scan")
             await asyncio.sleep(60)  # раз в минуту
         except Exception as e:
             logging.error(f"Ошибка в стратегии: {e}")
+            TICK_ERRORS.inc(strategy="rsi_scan")
             await asyncio.sleep(30)
-
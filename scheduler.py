@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+
+from tinkoff.invest import CandleInterval
+
+from metrics import TICK_DURATION, TICK_ERRORS
+
+INTERVAL_SECONDS = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: 60,
+    CandleInterval.CANDLE_INTERVAL_5_MIN: 5 * 60,
+    CandleInterval.CANDLE_INTERVAL_15_MIN: 15 * 60,
+    CandleInterval.CANDLE_INTERVAL_HOUR: 60 * 60,
+    CandleInterval.CANDLE_INTERVAL_DAY: 24 * 60 * 60,
+}
+
+# Сколько ждать после закрытия свечи, чтобы она успела прийти из стрима
+CLOSE_DELAY = 2.0
+
+
+class StrategyStats:
+    __slots__ = ("runs", "skipped", "errors", "last_lag", "last_duration", "max_duration", "total_duration")
+
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_lag = 0.0        # запуск позже закрытия свечи на столько секунд
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def __str__(self):
+        avg = self.total_duration / self.runs if self.runs else 0.0
+        return (f"тиков {self.runs}, пропущено {self.skipped}, ошибок {self.errors}, "
+                f"задержка {self.last_lag:.2f} с, длительность {self.last_duration:.2f} с "
+                f"(сред. {avg:.2f}, макс. {self.max_duration:.2f})")
+
+
+class StrategyScheduler:
+    # Запускает strategy.run() каждого экземпляра сразу после закрытия его свечи.
+    # Время следующего запуска каждый раз считается от часов, а не от конца прошлого
+    # тика, поэтому сдвиг не накапливается. Если прошлый тик ещё идёт — новый пропускаем.
+    def __init__(self, strategies, close_delay=CLOSE_DELAY, calendar=None):
+        self.strategies = list(strategies)
+        self.close_delay = close_delay
+        # MarketCalendar: если задан, вне торговых сессий не тикаем, а спим до открытия
+        self.calendar = calendar
+        self.stats = {self._name(s): StrategyStats() for s in self.strategies}
+        self._running = {}
+
+    @staticmethod
+    def _name(strategy):
+        return f"{strategy.figi}/{strategy.interval.name.replace('CANDLE_INTERVAL_', '')}"
+
+    def next_close(self, interval, now=None):
+        period = INTERVAL_SECONDS[interval]
+        now = time.time() if now is None else now
+        return (now // period + 1) * period
+
+    async def _tick(self, strategy, scheduled):
+        stats = self.stats[self._name(strategy)]
+        stats.last_lag = time.time() - scheduled
+        started = time.perf_counter()
+        try:
+            await strategy.run()
+        except Exception as e:
+            stats.errors += 1
+            TICK_ERRORS.inc(strategy=self._name(strategy))
+            logging.exception("Ошибка в стратегии %s: %s", self._name(strategy), e)
+        finally:
+            duration = time.perf_counter() - started
+            stats.runs += 1
+            stats.last_duration = duration
+            stats.total_duration += duration
+            stats.max_duration = max(stats.max_duration, duration)
+            TICK_DURATION.observe(duration, strategy=self._name(strategy))
+
+    def _launch(self, strategy, scheduled):
+        name = self._name(strategy)
+        task = self._running.get(name)
+        if task is not None and not task.done():
+            self.stats[name].skipped += 1
+            logging.warning(f"⏭ {name}: прошлый тик ещё не закончился, пропускаем")
+            return
+        self._running[name] = asyncio.create_task(self._tick(strategy, scheduled))
+
+    async def _loop(self, strategy):
+        close = 0.0
+        while True:
+            close = self.next_close(strategy.interval, max(time.time(), close))
+            if self.calendar is not None:
+                opens = self.calendar.next_open(self.calendar.exchange_for(strategy.figi), close)
+                if opens is not None and opens > close:
+                    # Первая свеча после открытия сессии
+                    close = self.next_close(strategy.interval, opens)
+                    logging.info(f"💤 {self._name(strategy)}: рынок закрыт, следующий тик "
+                                 f"{time.strftime('%d.%m %H:%M', time.localtime(close))}")
+            await asyncio.sleep(max(close + self.close_delay - time.time(), 0))
+            self._launch(strategy, close)
+
+    async def run(self, run_immediately=True):
+        if run_immediately:
+            now = time.time()
+            for strategy in self.strategies:
+                self._launch(strategy, now)
+        await asyncio.gather(*(self._loop(s) for s in self.strategies))
+
+    def report(self):
+        return "\n".join(f"{name}: {stats}" for name, stats in self.stats.items())
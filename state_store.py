@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+# Файл базы состояния бота
+STATE_DB = "trading_state.db"
+
+# Как часто сбрасывать накопленные записи (сигналы) на диск, секунды
+FLUSH_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    figi TEXT PRIMARY KEY,
+    holding INTEGER NOT NULL DEFAULT 0,
+    quantity REAL NOT NULL DEFAULT 0,
+    avg_price REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    figi TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_status ON orders(status);
+CREATE TABLE IF NOT EXISTS signals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    figi TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value REAL,
+    price REAL
+);
+"""
+
+# Счета бумажной торговли — только в базе бумажного режима (StateStore(..., paper=True))
+PAPER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS paper_accounts (
+    account_id TEXT PRIMARY KEY,
+    cash REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paper_positions (
+    account_id TEXT NOT NULL,
+    figi TEXT NOT NULL,
+    units INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (account_id, figi)
+);
+"""
+
+# Статусы заявок, которые ещё могут исполниться
+PENDING_STATUSES = ("new", "submitted", "partial")
+
+
+class StateStore:
+    # Состояние торговли по всем FIGI в одной SQLite-базе в режиме WAL.
+    # Позиции дублируются в памяти, так что чтение не ходит в базу. Позиции и заявки
+    # коммитятся сразу, сигналы копятся и уходят на диск пачкой раз в FLUSH_INTERVAL.
+    def __init__(self, path=STATE_DB, paper=False):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL synchronous=NORMAL даёт fsync только на чекпоинтах, а не на каждый коммит
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if paper:
+            self.conn.executescript(PAPER_SCHEMA)
+        self._dirty = False
+        self._flush_task = None
+        self.positions = {
+            row[0]: {"holding": bool(row[1]), "quantity": row[2], "avg_price": row[3]}
+            for row in self.conn.execute("SELECT figi, holding, quantity, avg_price FROM positions")
+        }
+
+    # ---------- позиции ----------
+
+    def position(self, figi):
+        return self.positions.get(figi, {"holding": False, "quantity": 0.0, "avg_price": 0.0})
+
+    def is_holding(self, figi):
+        return self.position(figi)["holding"]
+
+    def avg_price(self, figi):
+        return self.position(figi)["avg_price"]
+
+    def update_position(self, figi, **fields):
+        pos = dict(self.position(figi))
+        pos.update(fields)
+        self.positions[figi] = pos
+        self.conn.execute(
+            "INSERT INTO positions (figi, holding, quantity, avg_price, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(figi) DO UPDATE SET holding=excluded.holding, quantity=excluded.quantity, "
+            "avg_price=excluded.avg_price, updated_at=excluded.updated_at",
+            (figi, int(pos["holding"]), pos["quantity"], pos["avg_price"], time.time()),
+        )
+        self.flush()
+
+    # ---------- заявки ----------
+
+    def add_order(self, order_id, figi, direction, quantity, price=None, status="new"):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR IGNORE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (order_id, figi, direction, quantity, price, status, now, now),
+        )
+        self.flush()
+
+    def update_order(self, order_id, status, price=None):
+        self.conn.execute(
+            "UPDATE orders SET status = ?, price = COALESCE(?, price), updated_at = ? WHERE order_id = ?",
+            (status, price, time.time(), order_id),
+        )
+        self.flush()
+
+    def pending_orders(self):
+        placeholders = ",".join("?" * len(PENDING_STATUSES))
+        rows = self.conn.execute(
+            f"SELECT order_id, figi, direction, quantity, price, status FROM orders "
+            f"WHERE status IN ({placeholders})",
+            PENDING_STATUSES,
+        )
+        keys = ("order_id", "figi", "direction", "quantity", "price", "status")
+        return [dict(zip(keys, row)) for row in rows]
+
+    # ---------- бумажные счета ----------
+
+    def paper_account(self, account_id):
+        # (деньги, {figi: [штук, себестоимость]}) или None, если счёт ещё не сохранялся
+        row = self.conn.execute("SELECT cash FROM paper_accounts WHERE account_id = ?", (account_id,)).fetchone()
+        if row is None:
+            return None
+        positions = {
+            figi: [units, cost]
+            for figi, units, cost in self.conn.execute(
+                "SELECT figi, units, cost FROM paper_positions WHERE account_id = ?", (account_id,)
+            )
+        }
+        return row[0], positions
+
+    def save_paper_account(self, account_id, cash, positions):
+        # Деньги и позиции — одной транзакцией, чтобы после сбоя они не разошлись
+        if not self._dirty:
+            self.conn.execute("BEGIN")
+            self._dirty = True
+        self.conn.execute(
+            "INSERT INTO paper_accounts (account_id, cash, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(account_id) DO UPDATE SET cash=excluded.cash, updated_at=excluded.updated_at",
+            (account_id, cash, time.time()),
+        )
+        self.conn.execute("DELETE FROM paper_positions WHERE account_id = ?", (account_id,))
+        self.conn.executemany(
+            "INSERT INTO paper_positions (account_id, figi, units, cost) VALUES (?, ?, ?, ?)",
+            [(account_id, figi, units, cost) for figi, (units, cost) in positions.items()],
+        )
+        self.flush()
+
+    # ---------- сигналы ----------
+
+    def record_signal(self, figi, kind, value=None, price=None):
+        if not self._dirty:
+            self.conn.execute("BEGIN")
+            self._dirty = True
+        self.conn.execute(
+            "INSERT INTO signals (ts, figi, kind, value, price) VALUES (?, ?, ?, ?, ?)",
+            (time.time(), figi, kind, value, price),
+        )
+
+    def signals(self, figi=None, limit=100):
+        query = "SELECT ts, figi, kind, value, price FROM signals"
+        params = ()
+        if figi:
+            query += " WHERE figi = ?"
+            params = (figi,)
+        query += " ORDER BY id DESC LIMIT ?"
+        return self.conn.execute(query, params + (limit,)).fetchall()
+
+    # ---------- запись на диск ----------
+
+    def flush(self):
+        if self._dirty:
+            self.conn.execute("COMMIT")
+            self._dirty = False
+
+    async def run_flush(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self.run_flush())
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def import_legacy(self, figi, position_file="position.txt", price_file="buy_price.txt"):
+        # Однократный перенос состояния из старых текстовых файлов
+        if figi in self.positions:
+            return
+        fields = {}
+        try:
+            with open(position_file) as f:
+                fields["holding"] = f.read().strip() == "1"
+        except FileNotFoundError:
+            pass
+        try:
+            with open(price_file) as f:
+                fields["avg_price"] = float(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            pass
+        if fields:
+            self.update_position(figi, **fields)
+            logging.info(f"Состояние {figi} перенесено из {position_file}/{price_file}")
+
+
+_store = None
+
+
+def get_state_store():
+    global _store
+    if _store is None:
+        _store = StateStore()
+    return _store
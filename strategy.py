@@ -1,112 +1,218 @@
+import asyncio
 import logging
+import time
+from tinkoff.invest import CandleInterval, OrderDirection
 from tinkoff_api import TinkoffAPI
 from config import FIGI
+from state_store import get_state_store
+from metrics import SIGNAL_TO_ORDER, TICK_ERRORS
+from risk import NotEnoughMoney, RiskRejected
+
+# Параметры по умолчанию
+RSI_PERIOD = 14
+RSI_BUY = 45
+RSI_SELL = 60
+
+# Фильтры по стакану: не входим при спреде шире MAX_SPREAD (доля от середины) и против
+# сильного перекоса — когда дисбаланс против сделки больше IMBALANCE_VETO
+MAX_SPREAD = 0.003
+IMBALANCE_VETO = 0.6
 
 class TradingStrategy:
-    def __init__(self, bot):
-        self.api = TinkoffAPI()
+    def __init__(self, bot, api=None, state=None, figi=FIGI, rsi_buy=RSI_BUY, rsi_sell=RSI_SELL,
+                 interval=CandleInterval.CANDLE_INTERVAL_5_MIN, period=RSI_PERIOD,
+                 max_spread=MAX_SPREAD, imbalance_veto=IMBALANCE_VETO):
+        self.api = api or TinkoffAPI()
         self.bot = bot
+        self.state = state or get_state_store()
+        self.figi = figi
+        self.rsi_buy = rsi_buy
+        self.rsi_sell = rsi_sell
+        self.interval = interval
+        self.period = period
+        self.max_spread = max_spread
+        self.imbalance_veto = imbalance_veto
         self.position = self.load_position()
         self.last_buy_price = self.load_last_buy_price()
+        self._pending = None  # фоновая задача подтверждения сделки
+        self._signal_at = 0.0  # когда сработал сигнал — для задержки сигнал→заявка
 
     def save_position(self, state: bool):
-        with open("position.txt", "w") as f:
-            f.write("1" if state else "0")
+        self.state.update_position(self.figi, holding=state)
 
     def load_position(self) -> bool:
-        try:
-            with open("position.txt", "r") as f:
-                return f.read().strip() == "1"
-        except FileNotFoundError:
-            return False
+        return self.state.is_holding(self.figi)
 
     def save_last_buy_price(self, price: float):
-        with open("buy_price.txt", "w") as f:
-            f.write(str(price))
+        self.state.update_position(self.figi, avg_price=price)
 
     def load_last_buy_price(self) -> float:
-        try:
-            with open("buy_price.txt", "r") as f:
-                return float(f.read().strip())
-        except FileNotFoundError:
-            return 0.0
+        return self.state.avg_price(self.figi)
+
+    async def wait_pending(self):
+        if self._pending is not None:
+            await self._pending
 
     async def run(self):
-        logging.info(f"[DEBUG] self.position = {self.position}")
+        logging.info(f"[DEBUG] {self.figi}: self.position = {self.position}")
+
+        # Пока рынок закрыт — ни портфеля, ни свечей не запрашиваем
+        if not self.api.is_market_open(self.figi):
+            logging.info(f"📉 {self.figi}: рынок закрыт. Торговля приостановлена.")
+            return
 
-        quantity = self.api.get_quantity(FIGI)
+        quantity = await self.api.get_quantity(self.figi)
         if quantity > 0 and not self.position:
             self.position = True
             self.save_position(True)
-            logging.info(f"📌 Обнаружены акции {FIGI} в портфеле. Устанавливаю позицию = True")
+            logging.info(f"📌 Обнаружены акции {self.figi} в портфеле. Устанавливаю позицию = True")
 
         try:
-            if not self.api.is_market_open():
-                logging.info("📉 Рынок закрыт. Торговля приостановлена.")
-                return
+            rsi = await self.api.get_rsi(self.figi, self.interval, self.period)
+            logging.info(f"[RSI] Значение RSI для {self.figi}: {rsi}")
+            self.state.record_signal(self.figi, "rsi", rsi)
+            self.bot.send_status(self.figi, f"[RSI] {self.figi}: {rsi}")
 
-            rsi = self.api.get_rsi(FIGI)
-            logging.info(f"[RSI] Значение RSI для {FIGI}: {rsi}")
-            await self.bot.send(f"[RSI] Текущее значение RSI: {rsi}")
+            # Пока по прошлому сигналу ждём ответа, новых запросов не шлём
+            if self._pending is not None and not self._pending.done():
+                logging.info(f"⏳ {self.figi}: ждём подтверждения по прошлому сигналу")
+                return
 
-            # ======= УСЛОВИЕ НА ПОКУПКУ =======
-            if rsi < 45 and not self.position:
+            # Подтверждение идёт в фоне: тик не ждёт человека, остальные стратегии работают
+            if rsi < self.rsi_buy and not self.position:
+                if self._liquidity_veto(OrderDirection.ORDER_DIRECTION_BUY):
+                    return
                 logging.info("🔔 Условие на покупку выполнено.")
-                if await self.bot.ask_permission("RSI < 45. Купить?"):
-                    balance = self.api.get_balance()
-                    await self.bot.send(f"💰 Баланс на счёте: {balance:.2f} ₽")
-                    try:
-                        price, max_qty = self.api.get_lot_price_and_max_quantity(FIGI, balance)
-                        if max_qty == 0:
-                            await self.bot.send("❌ Недостаточно средств даже на один лот.")
-                            return
-                        options = [str(i) for i in range(1, max_qty + 1)]
-                        qty_str = await self.bot.ask_quantity("Сколько акций купить?", options)
-                        if not qty_str:
-                            await self.bot.send("❌ Покупка отменена.")
-                            return
-                        qty = int(qty_str)
-                        price = self.api.buy(FIGI, qty)
-                        if price:
-                            self.save_last_buy_price(price)
-                        self.save_position(True)
-                        self.position = True
-                        logging.info("Сделка выполнена: ПОКУПКА")
-                        await self.bot.send(f"✅ Куплено {qty} акций по цене {price:.2f} ₽")
-                    except Exception as e:
-                        logging.exception("Ошибка при покупке:")
-                        await self.bot.send(f"❌ Ошибка при покупке: {e}")
-
-            # ======= УСЛОВИЕ НА ПРОДАЖУ =======
-            if rsi > 60 and self.position:
+                self._signal_at = time.perf_counter()
+                self._pending = asyncio.create_task(self._buy(rsi))
+            elif rsi > self.rsi_sell and self.position:
+                if self._liquidity_veto(OrderDirection.ORDER_DIRECTION_SELL):
+                    return
                 logging.info("🔔 Условие на продажу выполнено.")
-                try:
-                    quantity = self.api.get_quantity(FIGI)
-                    if quantity == 0:
-                        await self.bot.send("⚠️ Нет акций для продажи.")
-                        self.save_position(False)
-                        return
-
-                    current_price = self.api.get_last_price(FIGI)
-                    profit_per_share = current_price - self.last_buy_price
-                    total_profit = profit_per_share * quantity
-
-                    msg = (
-                        f"RSI > 60. Продать?\n"
-                        f"Купили: {self.last_buy_price:.2f} ₽\n"
-                        f"Продадим: {current_price:.2f} ₽\n"
-                        f"📈 Прибыль: {total_profit:.2f} ₽"
-                    )
-
-                    if await self.bot.ask_permission(msg):
-                        self.api.sell(FIGI, quantity)
-                        self.save_position(False)
-                        self.position = False
-                        logging.info("Сделка выполнена: ПРОДАЖА")
-                        await self.bot.send(
-                            f"✅ Продано {quantity} акций по цене {current_price:.2f} ₽\n"
-                            f"📈 Прибыль: {total_profit:.2f} ₽"
-                        )
+                self._signal_at = time.perf_counter()
+                self._pending = asyncio.create_task(self._sell(rsi))
+        except Exception as e:
+            logging.exception("Ошибка в стратегии:")
+            TICK_ERRORS.inc(strategy=self.figi)
+            await self.bot.send(f"❌ Ошибка в стратегии: {e}")
+
+    def _liquidity_veto(self, direction):
+        # Сигнал есть, но стакан против: широкий спред или сильный перекос в обратную сторону.
+        # Нет свежего стакана — решаем по RSI, как раньше
+        book = self.api.get_orderbook(self.figi)
+        if book is None:
+            return False
+        spread = book.relative_spread()
+        if spread is not None and spread > self.max_spread:
+            logging.info(f"⏸ {self.figi}: спред {spread:.2%} шире {self.max_spread:.2%}, сигнал пропущен")
+            return True
+        imbalance = book.imbalance()
+        against = -imbalance if direction == OrderDirection.ORDER_DIRECTION_BUY else imbalance
+        if against > self.imbalance_veto:
+            logging.info(f"⏸ {self.figi}: дисбаланс стакана {imbalance:+.2f} против сделки, сигнал пропущен")
+            return True
+        return False
+
+    def _expected_fill(self, direction, lots):
+        # Средняя цена рыночной заявки по текущему стакану; None — стакана нет или он мелкий
+        book = self.api.get_orderbook(self.figi)
+        return book.vwap_to_fill(direction, lots) if book is not None else None
+
+    async def _recheck_price(self, quoted):
+        return await self.bot.recheck_price(self.figi, quoted, self.api.get_last_price)
+
+    # ======= ПОКУПКА =======
+    async def _buy(self, rsi):
+        try:
+            if not await self.bot.ask_permission(f"{self.figi}: RSI < {self.rsi_buy}. Купить?"):
+                return
+            balance = await self.api.get_balance()
+            await self.bot.send(f"💰 Баланс на счёте: {balance:.2f} ₽")
+            price, max_qty = await self.api.get_lot_price_and_max_quantity(self.figi, balance)
+            if max_qty == 0:
+                await self.bot.send("❌ Недостаточно средств даже на один лот.")
+                return
+            options = [str(i) for i in range(1, max_qty + 1)]
+            qty_str = await self.bot.ask_quantity("Сколько лотов купить?", options)
+            if not qty_str:
+                await self.bot.send("❌ Покупка отменена.")
+                return
+            qty = int(qty_str)
+            if await self._recheck_price(price) is None:
+                await self.bot.send("❌ Покупка отменена.")
+                return
+            SIGNAL_TO_ORDER.observe(time.perf_counter() - self._signal_at, side="buy")
+            price = await self.api.buy(self.figi, qty)
+            if not price:
+                # Позицию не трогаем: если заявка исполнится позже, её подхватит сверка с портфелем в run()
+                await self.bot.send(f"⚠️ {self.figi}: заявка на покупку не исполнена.")
+                return
+            self.save_last_buy_price(price)
+            self.last_buy_price = price
+            self.save_position(True)
+            self.position = True
+            logging.info("Сделка выполнена: ПОКУПКА")
+            await self.bot.send(f"✅ Куплено {qty} лот. по цене {price:.2f} ₽")
+        except NotEnoughMoney:
+            await self.bot.send("❌ Недостаточно средств.")
+        except RiskRejected as e:
+            await self.bot.send(f"⛔ Покупка отклонена риск-контролем: {e}")
+        except Exception as e:
+            logging.exception("Ошибка при покупке:")
+            await self.bot.send(f"❌ Ошибка при покупке: {e}")
+
+    # ======= ПРОДАЖА =======
+    async def _sell(self, rsi):
+        try:
+            quantity = await self.api.get_quantity(self.figi)
+            if quantity == 0:
+                await self.bot.send("⚠️ Нет акций для продажи.")
+                self.save_position(False)
+                self.position = False
+                return
+
+            current_price = await self.api.get_last_price(self.figi)
+            lot = await self.api.get_lot(self.figi)
+            lots = quantity // lot
+            if lots == 0:
+                await self.bot.send(f"⚠️ {self.figi}: {quantity} шт. меньше лота ({lot}), продать нельзя.")
+                return
+            # Продаются только целые лоты — прибыль считаем по ним, а не по всем штукам
+            units = lots * lot
+            # Если стакан есть — прибыль считаем по цене, по которой продажа реально пройдёт
+            fill_price = self._expected_fill(OrderDirection.ORDER_DIRECTION_SELL, lots) or current_price
+            profit_per_share = fill_price - self.last_buy_price
+            total_profit = profit_per_share * units
+
+            msg = (
+                f"{self.figi}: RSI > {self.rsi_sell}. Продать?\n"
+                f"Купили: {self.last_buy_price:.2f} ₽\n"
+                f"Продадим: {fill_price:.2f} ₽\n"
+                f"📈 Прибыль: {total_profit:.2f} ₽"
+            )
+
+            if not await self.bot.ask_permission(msg):
+                return
+            current_price = await self._recheck_price(current_price)
+            if current_price is None:
+                await self.bot.send("❌ Продажа отменена.")
+                return
+            SIGNAL_TO_ORDER.observe(time.perf_counter() - self._signal_at, side="sell")
+            # В портфеле штуки, а заявка — в лотах
+            price = await self.api.sell(self.figi, lots)
+            if not price:
+                await self.bot.send(f"⚠️ {self.figi}: заявка на продажу не исполнена.")
+                return
+            total_profit = (price - self.last_buy_price) * units
+            self.save_position(False)
+            self.position = False
+            logging.info("Сделка выполнена: ПРОДАЖА")
+            await self.bot.send(
+                f"✅ Продано {units} акций по цене {price:.2f} ₽\n"
+                f"📈 Прибыль: {total_profit:.2f} ₽"
+            )
+        except RiskRejected as e:
+            await self.bot.send(f"⛔ Продажа отклонена риск-контролем: {e}")
         except Exception as e:
             logging.exception("Ошибка при продаже:")
             await self.bot.send(f"❌ Ошибка при продаже: {e}")
@@ -1,21 +1,88 @@
 import logging
 import asyncio
 from aiogram import Bot, Dispatcher, types
-from aiogram.utils import executor
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.exceptions import RetryAfter
+import itertools
+import time
+import uuid
 from config import TELEGRAM_BOT_TOKEN, CHAT_ID
+import order_manager
+from order_manager import NotEnoughMoney, RiskRejected
+from state_store import get_state_store
+from utils import MAX_PRICE_DRIFT
+import metrics
+
+# Последний созданный TelegramInterface — для функций подтверждения из rsi_strategy
+_default_interface = None
+
+# Сигналы, по которым уже ждём ответа: {(figi, направление)}
+_inflight = set()
+
+# Приоритеты исходящих сообщений: меньше — раньше
+PRIORITY_ORDER = 0     # подтверждения сделок
+PRIORITY_NORMAL = 1    # обычные сообщения
+PRIORITY_DIGEST = 2    # сводка статусов (RSI и т.п.)
+
+# Лимит Telegram — около 1 сообщения в секунду в один чат; небольшой запас на всплески
+SEND_RATE = 1.0
+SEND_BURST = 3
+
+# Сколько собирать статусы в одну сводку, секунды
+DIGEST_DELAY = 5.0
+
+
+class TokenBucket:
+    def __init__(self, rate=SEND_RATE, capacity=SEND_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
 class TelegramInterface:
-    def __init__(self, api):
+    def __init__(self, api, orders=order_manager, state=None):
         self.bot = Bot(token=TELEGRAM_BOT_TOKEN)
         self.dp = Dispatcher(self.bot)
         self.api = api
-        self._permission_futures = {}  # {chat_id: asyncio.Future}
-        self._quantity_futures = {}    # {chat_id: asyncio.Future}
+        # Куда уходят заявки по подтверждениям: order_manager или бумажный счёт (paper.PaperTinkoffAPI)
+        self.orders = orders
+        # Куда записывать цену покупки после подтверждённого исполнения
+        self.state = state or get_state_store()
+        # Ожидающие ответа запросы: {request_id: asyncio.Future}. ID зашит в callback_data,
+        # поэтому несколько подтверждений могут висеть одновременно и не мешать друг другу
+        self._pending = {}
+        # Исходящая очередь: (приоритет, порядковый номер, текст, клавиатура, future доставки)
+        self._outbox = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._bucket = TokenBucket()
+        self._sender = None
+        self._digest = {}  # {ключ: последний статус}
+        self._digest_task = None
+        metrics.QUEUE_DEPTH.set_function(self._outbox.qsize, queue="telegram_outbox")
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self._pending), queue="approvals")
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self._digest), queue="digest")
+        global _default_interface
+        _default_interface = self
 
         @self.dp.message_handler(commands=["start"])
         async def start(message: types.Message):
-            await message.answer("Бот запущен! Доступные команды:\n/balance")
+            await message.answer("Бот запущен! Доступные команды:\n/balance\n/stats")
+
+        @self.dp.message_handler(commands=["stats"])
+        async def cmd_stats(message: types.Message):
+            if str(message.chat.id) != str(CHAT_ID):
+                return
+            await message.answer(metrics.summary()[:4000])  # лимит длины сообщения Telegram
 
         @self.dp.message_handler(commands=["menu"])
         async def show_menu(message: types.Message):
@@ -34,26 +101,25 @@ class TelegramInterface:
             if str(message.chat.id) != str(CHAT_ID):
                 return
             try:
-                balance = self.api.get_balance()
+                balance = await self.api.get_balance()
                 await message.answer(f"💰 Баланс на счёте: {balance:.2f} ₽")
             except Exception as e:
                 await message.answer(f"❌ Ошибка при получении баланса: {e}")
 
-        @self.dp.callback_query_handler(lambda c: c.data in ["yes", "no"])
-        async def handle_permission_callback(callback_query: types.CallbackQuery):
+        @self.dp.callback_query_handler(lambda c: c.data.startswith(("ok:", "qty:")))
+        async def handle_approval_callback(callback_query: types.CallbackQuery):
             if str(callback_query.message.chat.id) != str(CHAT_ID):
                 return
-            await self.bot.answer_callback_query(callback_query.id)
-
-            future = self._permission_futures.get(callback_query.message.chat.id)
-            if future and not future.done():
-                future.set_result(callback_query.data == "yes")
-
-        @self.dp.callback_query_handler(lambda c: c.data.startswith("qty_"))
-        async def handle_quantity_callback(callback_query: types.CallbackQuery):
-            if str(callback_query.message.chat.id) != str(CHAT_ID):
+            # callback_data: ok:<request_id>:yes|no или qty:<request_id>:<кол-во>
+            kind, request_id, value = callback_query.data.split(":", 2)
+            future = self._pending.get(request_id)
+            if future is None or future.done():
+                await self.bot.answer_callback_query(callback_query.id, "Запрос устарел")
                 return
             await self.bot.answer_callback_query(callback_query.id)
+            future.set_result(value == "yes" if kind == "ok" else value)
+            # Убираем кнопки, чтобы по тому же запросу нельзя было ответить ещё раз
+            await callback_query.message.edit_reply_markup(reply_markup=None)
 
         @self.dp.callback_query_handler(lambda c: c.data.startswith("menu_"))
         async def handle_menu(callback_query: types.CallbackQuery):
@@ -63,39 +129,34 @@ class TelegramInterface:
             await self.bot.answer_callback_query(callback_query.id)
 
             if data == "menu_balance":
-                balance = self.api.get_balance()
+                balance = await self.api.get_balance()
                 await self.send(f"💰 Баланс: {balance:.2f} ₽")
             elif data == "menu_profit":
-                profit = self.api.get_daily_profit()
+                profit = await self.api.get_daily_profit()
                 await self.send(f"📊 Прибыль за сегодня: {profit:.2f} ₽")
             elif data == "menu_txn":
-                count = self.api.get_transaction_count()
+                count = await self.api.get_today_transaction_count()
                 await self.send(f"📈 Кол-во транзакций сегодня: {count}")
 
-            qty = callback_query.data.split("_")[1]
-            future = self._quantity_futures.get(callback_query.message.chat.id)
-            if future and not future.done():
-                future.set_result(qty)
-
         @self.dp.message_handler(commands=["menu_balance"])
         async def cmd_balance(message: types.Message):
             if str(message.chat.id) != str(CHAT_ID):
                 return
-            balance = self.api.get_balance()
+            balance = await self.api.get_balance()
             await message.answer(f"💰 Баланс: {balance:.2f} ₽")
 
         @self.dp.message_handler(commands=["menu_profit"])
         async def cmd_profit(message: types.Message):
             if str(message.chat.id) != str(CHAT_ID):
                 return
-            profit = self.api.get_daily_profit()
+            profit = await self.api.get_daily_profit()
             await message.answer(f"📊 Прибыль за сегодня: {profit:.2f} ₽")
 
         @self.dp.message_handler(commands=["menu_txn"])
         async def cmd_txn(message: types.Message):
             if str(message.chat.id) != str(CHAT_ID):
                 return
-            count = self.api.get_today_transaction_count()
+            count = await self.api.get_today_transaction_count()
             await message.answer(f"📈 Транзакций за сегодня: {count}")
    
 
@@ -105,45 +166,182 @@ class TelegramInterface:
                 return
             await message.answer("❗ Неизвестная команда. Введите /start для списка доступных команд.")
 
-    async def send(self, message: str):
-        await self.bot.send_message(chat_id=CHAT_ID, text=message)
+    def _ensure_sender(self):
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_loop())
 
-    async def ask_permission(self, message: str) -> bool:
-        keyboard = InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            InlineKeyboardButton("✅ Да", callback_data="yes"),
-            InlineKeyboardButton("❌ Нет", callback_data="no")
-        )
-        await self.bot.send_message(chat_id=CHAT_ID, text=message, reply_markup=keyboard)
+    async def _send_loop(self):
+        while True:
+            _, _, text, markup, delivered = await self._outbox.get()
+            await self._bucket.acquire()
+            while True:
+                try:
+                    await self.bot.send_message(chat_id=CHAT_ID, text=text, reply_markup=markup)
+                    metrics.TELEGRAM_SENT.inc()
+                    if not delivered.done():
+                        delivered.set_result(True)
+                    break
+                except RetryAfter as e:
+                    metrics.TELEGRAM_ERRORS.inc(reason="retry_after")
+                    logging.warning(f"Telegram просит подождать {e.timeout} с")
+                    await asyncio.sleep(e.timeout)
+                except Exception as e:
+                    logging.error(f"Не удалось отправить сообщение в Telegram: {e}")
+                    metrics.TELEGRAM_ERRORS.inc()
+                    if not delivered.done():
+                        delivered.set_exception(e)
+                    break
 
-        future = asyncio.get_event_loop().create_future()
-        self._permission_futures[CHAT_ID] = future
+    def enqueue(self, message: str, priority=PRIORITY_NORMAL, reply_markup=None):
+        # Ставит сообщение в очередь и сразу возвращает future доставки
+        self._ensure_sender()
+        delivered = asyncio.get_running_loop().create_future()
+        self._outbox.put_nowait((priority, next(self._seq), message, reply_markup, delivered))
+        return delivered
 
-        try:
-            return await asyncio.wait_for(future, timeout=30)
-        except asyncio.TimeoutError:
-            await self.send("⏱ Время ожидания ответа истекло.")
-            return False
-        finally:
-            del self._permission_futures[CHAT_ID]
+    async def send(self, message: str, priority=PRIORITY_NORMAL):
+        # Не ждём Telegram: сообщение уходит из очереди с учётом лимитов
+        self.enqueue(message, priority)
 
-    async def ask_quantity(self, message: str, options: list[str]) -> str | None:
-        keyboard = InlineKeyboardMarkup(row_width=5)
-        buttons = [InlineKeyboardButton(text=o, callback_data=f"qty_{o}") for o in options]
-        keyboard.add(*buttons)
+    def send_status(self, key, message: str):
+        # Рутинные статусы (RSI по инструментам) склеиваются в одну сводку;
+        # по одному ключу в сводку попадает только последнее значение
+        self._digest[key] = message
+        if self._digest_task is None or self._digest_task.done():
+            self._digest_task = asyncio.create_task(self._flush_digest_later())
 
-        await self.bot.send_message(chat_id=CHAT_ID, text=message, reply_markup=keyboard)
+    async def _flush_digest_later(self):
+        await asyncio.sleep(DIGEST_DELAY)
+        self.flush_digest()
 
-        future = asyncio.get_event_loop().create_future()
-        self._quantity_futures[CHAT_ID] = future
+    def flush_digest(self):
+        if self._digest:
+            lines, self._digest = list(self._digest.values()), {}
+            self.enqueue("\n".join(lines), PRIORITY_DIGEST)
 
+    async def _ask(self, message, keyboard_for, timeout, timeout_text):
+        # Случайный ID, чтобы кнопки из сообщений до перезапуска не ответили на новый запрос
+        request_id = uuid.uuid4().hex[:12]
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
         try:
-            return await asyncio.wait_for(future, timeout=45)
+            # Вопросы идут вне очереди, а таймаут отсчитываем с момента доставки
+            await self.enqueue(message, PRIORITY_ORDER, keyboard_for(request_id))
+            return await asyncio.wait_for(future, timeout=timeout)
         except asyncio.TimeoutError:
-            await self.send("⏱ Время ожидания выбора количества истекло.")
+            await self.send(timeout_text)
             return None
         finally:
-            del self._quantity_futures[CHAT_ID]
+            del self._pending[request_id]
+
+    async def recheck_price(self, figi, quoted, get_price):
+        # Пока ждали ответа, цена могла уйти — переспрашиваем, если сдвиг больше MAX_PRICE_DRIFT.
+        # get_price(figi) — откуда брать текущую цену: TinkoffAPI, order_manager, бумажный счёт
+        current = await get_price(figi)
+        if not current or not quoted:
+            return current
+        drift = abs(current - quoted) / quoted
+        if drift <= MAX_PRICE_DRIFT:
+            return current
+        if await self.ask_permission(
+            f"{figi}: цена изменилась {quoted:.2f} → {current:.2f} ₽ ({drift:.2%}). Всё ещё исполнять?"
+        ):
+            return current
+        return None
+
+    async def ask_permission(self, message: str, timeout: float = 30) -> bool:
+        def keyboard(request_id):
+            keyboard = InlineKeyboardMarkup(row_width=2)
+            keyboard.add(
+                InlineKeyboardButton("✅ Да", callback_data=f"ok:{request_id}:yes"),
+                InlineKeyboardButton("❌ Нет", callback_data=f"ok:{request_id}:no")
+            )
+            return keyboard
+
+        answer = await self._ask(message, keyboard, timeout, "⏱ Время ожидания ответа истекло.")
+        return bool(answer)
+
+    async def ask_quantity(self, message: str, options: list[str], timeout: float = 45) -> str | None:
+        def keyboard(request_id):
+            keyboard = InlineKeyboardMarkup(row_width=5)
+            keyboard.add(*[
+                InlineKeyboardButton(text=o, callback_data=f"qty:{request_id}:{o}") for o in options
+            ])
+            return keyboard
+
+        return await self._ask(message, keyboard, timeout, "⏱ Время ожидания выбора количества истекло.")
 
     def run(self):
+        # executor тянет за собой aiohttp.web — импортируем только для отдельного запуска бота
+        from aiogram.utils import executor
         executor.start_polling(self.dp, skip_updates=True)
+
+
+async def _confirm_buy(bot, figi, qty, price):
+    try:
+        if not await bot.ask_permission(f"📉 {figi}: сигнал на покупку {qty} шт. по ~{price:.2f} ₽. Купить?"):
+            return
+        price = await bot.recheck_price(figi, price, bot.orders.get_last_price)
+        if price is None:
+            await bot.send("❌ Покупка отменена.")
+            return
+        ticket = await bot.orders.buy_figi(figi, qty, price)
+        if ticket.status != "filled":
+            await bot.send(f"⚠️ Заявка на покупку {figi} не исполнена ({ticket.status}).")
+            return
+        # Цена позиции — только по факту исполнения, а не по цене сигнала
+        bot.state.update_position(figi, avg_price=ticket.avg_price)
+        await bot.send(f"✅ Куплено {qty} шт. {figi} по {ticket.avg_price:.2f} ₽")
+    except NotEnoughMoney:
+        await bot.send("❌ Недостаточно средств.")
+    except RiskRejected as e:
+        await bot.send(f"⛔ Покупка отклонена риск-контролем: {e}")
+    except Exception as e:
+        logging.exception("Ошибка при покупке:")
+        await bot.send(f"❌ Ошибка при покупке: {e}")
+    finally:
+        _inflight.discard((figi, "buy"))
+
+
+async def _confirm_sell(bot, figi, qty, buy_price, price):
+    try:
+        profit = (price - buy_price) * qty
+        if not await bot.ask_permission(
+            f"📈 {figi}: сигнал на продажу {qty} шт.\n"
+            f"Купили: {buy_price:.2f} ₽\nПродадим: ~{price:.2f} ₽\nПрибыль: {profit:.2f} ₽"
+        ):
+            return
+        price = await bot.recheck_price(figi, price, bot.orders.get_last_price)
+        if price is None:
+            await bot.send("❌ Продажа отменена.")
+            return
+        ticket = await bot.orders.sell_figi(figi, qty, price)
+        if ticket.status != "filled":
+            await bot.send(f"⚠️ Заявка на продажу {figi} не исполнена ({ticket.status}).")
+            return
+        await bot.send(f"✅ Продано {qty} шт. {figi} по {ticket.avg_price:.2f} ₽")
+    except RiskRejected as e:
+        await bot.send(f"⛔ Продажа отклонена риск-контролем: {e}")
+    except Exception as e:
+        logging.exception("Ошибка при продаже:")
+        await bot.send(f"❌ Ошибка при продаже: {e}")
+    finally:
+        _inflight.discard((figi, "sell"))
+
+
+def _start_confirmation(key, coro):
+    # Не ждём ответа: подтверждение крутится в фоне, скан идёт дальше
+    if key in _inflight or _default_interface is None:
+        coro.close()
+        return False
+    _inflight.add(key)
+    asyncio.create_task(coro)
+    return True
+
+
+async def request_buy_confirmation(figi, qty, price):
+    return _start_confirmation((figi, "buy"), _confirm_buy(_default_interface, figi, qty, price))
+
+
+async def request_sell_confirmation(figi, qty, buy_price, price):
+    return _start_confirmation((figi, "sell"), _confirm_sell(_default_interface, figi, qty, buy_price, price))
@@ -0,0 +1,97 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("tinkoff.invest")
+
+import numpy as np
+from tinkoff.invest import CandleInterval
+
+from aggregator import CandleAggregator, aggregate, bucket
+
+M15 = CandleInterval.CANDLE_INTERVAL_15_MIN
+H1 = CandleInterval.CANDLE_INTERVAL_HOUR
+D1 = CandleInterval.CANDLE_INTERVAL_DAY
+
+
+def ts(hour, minute, day=2):
+    return int(datetime.datetime(2024, 7, day, hour, minute, tzinfo=datetime.timezone.utc).timestamp())
+
+
+class FakeCalendar:
+    # Основная сессия до 16:02 UTC, вечерняя — с 16:05: перерыв внутри одного 15м и 1ч бара
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def exchange_for(self, figi=None):
+        return "MOEX"
+
+    def session(self, exchange, t):
+        for start, end in self.sessions:
+            if t <= end:
+                return start, end
+        return None
+
+
+@pytest.fixture
+def aggregator():
+    calendar = FakeCalendar([(ts(7, 0), ts(16, 2)), (ts(16, 5), ts(20, 50))])
+    return CandleAggregator([M15, H1], calendar)
+
+
+@pytest.mark.parametrize("interval", [M15, H1])
+def test_evening_session_opens_new_bar_mid_bucket(aggregator, interval):
+    aggregator.update("F", ts(16, 1), 10, 11, 9, 10.5, 100)
+    updated = dict((i, (bar, closed)) for i, bar, closed in aggregator.update("F", ts(16, 5), 20, 21, 19, 20.5, 7))
+    bar, closed = updated[interval]
+    # Вечерний бар начинается с открытия сессии, а хвост основной не подмешивается
+    assert bar.ts == ts(16, 5)
+    assert (bar.open, bar.high, bar.low, bar.close, bar.volume) == (20, 21, 19, 20.5, 7)
+    assert closed is not None and closed.ts == bucket(ts(16, 1), interval) and closed.close == 10.5
+
+
+def test_evening_minutes_merge_into_session_bar(aggregator):
+    aggregator.update("F", ts(16, 5), 20, 21, 19, 20.5, 7)
+    aggregator.update("F", ts(16, 6), 20.5, 22, 20, 21, 3)
+    ((_, bar, closed),) = [u for u in aggregator.update("F", ts(16, 14), 21, 21, 18, 19, 4) if u[0] == M15]
+    assert closed is None
+    assert bar.ts == ts(16, 5)
+    assert (bar.high, bar.low, bar.close, bar.volume) == (22, 18, 19, 14)
+
+
+def test_daily_bar_rolls_over_at_moscow_midnight():
+    aggregator = CandleAggregator([D1])
+    aggregator.update("F", ts(20, 0), 1, 1, 1, 1, 1)
+    (_, same_day, closed), = aggregator.update("F", ts(20, 59), 2, 2, 2, 2, 1)
+    assert closed is None and same_day.close == 2
+    # 21:00 UTC — полночь по Москве: новый торговый день
+    (_, next_day, closed), = aggregator.update("F", ts(21, 0), 3, 3, 3, 3, 1)
+    assert closed is same_day
+    assert next_day.ts == ts(21, 0) and next_day.ts != same_day.ts
+    assert bucket(ts(20, 59), D1) == ts(21, 0, day=1)
+
+
+def test_older_minutes_are_ignored():
+    aggregator = CandleAggregator([M15])
+    aggregator.update("F", ts(10, 20), 1, 1, 1, 1, 1)
+    assert aggregator.update("F", ts(10, 5), 5, 5, 5, 5, 1) == []
+    assert aggregator.current("F", M15).close == 1
+
+
+def test_aggregate_builds_bars_from_minute_archive():
+    # Так backtest/optimizer получают 15м ряд из архива минуток
+    minutes = {
+        "time": np.array([ts(10, m) for m in range(0, 20)], dtype=np.int64),
+        "open": np.arange(20, dtype=np.float64) + 100,
+        "high": np.arange(20, dtype=np.float64) + 101,
+        "low": np.arange(20, dtype=np.float64) + 99,
+        "close": np.arange(20, dtype=np.float64) + 100.5,
+        "volume": np.ones(20, dtype=np.int64),
+    }
+    bars = aggregate(minutes, M15)
+    assert bars["time"] == [ts(10, 0), ts(10, 15)]
+    assert bars["open"] == [100, 115]
+    assert bars["high"] == [115, 120]
+    assert bars["close"] == [114.5, 119.5]
+    assert bars["volume"] == [15, 5]
@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytz")
+pytest.importorskip("grpc")
+pytest.importorskip("tinkoff.invest")
+
+from ledger import MOSCOW, SCHEMA, OperationsLedger
+from state_store import StateStore
+
+ACCOUNT = "acc"
+SBER = "BBG004730N88"
+GAZP = "BBG0047YPYT6"
+DAY = datetime.date(2024, 7, 2)
+
+
+def ts(hour, minute=0, day=DAY):
+    return MOSCOW.localize(datetime.datetime(day.year, day.month, day.day, hour, minute)).timestamp()
+
+
+def make_ledger(*operations):
+    # operations: (id, ts, figi, тип без префикса, платёж, штук) — как их хранит журнал
+    state = StateStore(":memory:")
+    state.conn.executescript(SCHEMA)
+    state.conn.executemany(
+        "INSERT INTO operations VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(op_id, ACCOUNT, t, figi, "OPERATION_TYPE_" + kind, payment, qty)
+         for op_id, t, figi, kind, payment, qty in operations],
+    )
+    return OperationsLedger(ACCOUNT, pool=object(), state=state)
+
+
+def test_realized_profit_on_partial_sells():
+    ledger = make_ledger(
+        ("1", ts(10), SBER, "BUY", -1000.0, 10),
+        ("2", ts(11), SBER, "BUY", -1200.0, 10),     # средняя 110
+        ("3", ts(12), SBER, "SELL", 600.0, 5),      # +50
+        ("4", ts(13), SBER, "SELL", 1080.0, 9),     # +90
+    )
+    assert ledger.daily_profit(DAY, SBER) == pytest.approx(140)
+    assert ledger.books[SBER][0] == 6
+    assert ledger.books[SBER][1] == pytest.approx(660)
+    assert ledger.transaction_count(DAY, SBER) == 4
+
+
+def test_fees_go_straight_into_the_day():
+    ledger = make_ledger(
+        ("1", ts(10), SBER, "BUY", -1000.0, 10),
+        ("2", ts(10, 1), SBER, "BROKER_FEE", -0.5, 0),
+        ("3", ts(12), SBER, "SELL", 1100.0, 10),
+        ("4", ts(12, 1), SBER, "BROKER_FEE", -0.55, 0),
+    )
+    assert ledger.daily_profit(DAY, SBER) == pytest.approx(100 - 1.05)
+    assert ledger.transaction_count(DAY) == 4
+
+
+def test_profit_is_split_by_figi_and_day():
+    next_day = DAY + datetime.timedelta(days=1)
+    ledger = make_ledger(
+        ("1", ts(10), SBER, "BUY", -1000.0, 10),
+        ("2", ts(10), GAZP, "BUY", -1500.0, 10),
+        ("3", ts(12), SBER, "SELL", 1050.0, 10),
+        ("4", ts(12), GAZP, "SELL", 700.0, 5),
+        # 01:00 МСК — уже следующий день, хотя по UTC ещё этот
+        ("5", ts(1, day=next_day), GAZP, "BROKER_FEE", -1.0, 0),
+        ("6", ts(10, day=next_day), GAZP, "SELL", 800.0, 5),
+    )
+    assert ledger.daily_profit(DAY, SBER) == pytest.approx(50)
+    assert ledger.daily_profit(DAY, GAZP) == pytest.approx(-50)
+    assert ledger.daily_profit(DAY) == pytest.approx(0)
+    assert ledger.daily_profit(next_day, GAZP) == pytest.approx(50 - 1)
+    assert ledger.transaction_count(DAY, GAZP) == 2
+    assert ledger.transaction_count(next_day) == 2
+
+
+def test_sell_without_known_cost_counts_whole_payment():
+    ledger = make_ledger(("1", ts(12), SBER, "SELL", 500.0, 5))
+    assert ledger.daily_profit(DAY, SBER) == pytest.approx(500)
+    assert ledger.books[SBER] == [0, 0.0]
+
+
+def quotation(value):
+    return SimpleNamespace(units=int(value), nano=int(round((value - int(value)) * 1e9)))
+
+
+def operation(op_id, t, figi, kind, payment, qty):
+    return SimpleNamespace(
+        id=op_id, date=datetime.datetime.fromtimestamp(t, datetime.timezone.utc), figi=figi,
+        operation_type=SimpleNamespace(name="OPERATION_TYPE_" + kind), payment=quotation(payment), quantity=qty,
+    )
+
+
+class FakePool:
+    def __init__(self, operations):
+        self.operations = operations
+
+    @asynccontextmanager
+    async def session(self):
+        async def get_operations(**kwargs):
+            return SimpleNamespace(operations=self.operations)
+        yield SimpleNamespace(operations=SimpleNamespace(get_operations=get_operations))
+
+
+def test_sync_skips_already_seen_operations():
+    pool = FakePool([operation("1", ts(10), SBER, "BUY", -1000.0, 10)])
+    ledger = OperationsLedger(ACCOUNT, pool=pool, state=StateStore(":memory:"))
+    assert asyncio.run(ledger.sync()) == 1
+    # Запрос от курсора внахлёст возвращает и старую операцию
+    pool.operations = pool.operations + [operation("2", ts(11), SBER, "SELL", 1100.0, 10)]
+    assert asyncio.run(ledger.sync()) == 1
+    assert ledger.daily_profit(DAY, SBER) == pytest.approx(100)
+    # После перезапуска журнал восстанавливается из базы
+    restored = OperationsLedger(ACCOUNT, pool=pool, state=SimpleNamespace(conn=ledger.conn))
+    assert restored.daily_profit(DAY, SBER) == pytest.approx(100)
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("tinkoff.invest")
+
+from tinkoff.invest import OrderDirection
+
+from orderbook import OrderBook, OrderBooks
+
+BUY = OrderDirection.ORDER_DIRECTION_BUY
+SELL = OrderDirection.ORDER_DIRECTION_SELL
+
+
+def levels(*pairs):
+    return [SimpleNamespace(price=SimpleNamespace(units=int(p), nano=int(round((p - int(p)) * 1e9))), quantity=q)
+            for p, q in pairs]
+
+
+@pytest.fixture
+def book():
+    book = OrderBook(depth=5)
+    book.update(levels((99, 4), (98, 1)), levels((100, 2), (101, 3), (102, 5)))
+    return book
+
+
+def test_top_of_book(book):
+    assert book.spread() == 1
+    assert book.mid() == 99.5
+    assert book.imbalance() == pytest.approx((5 - 10) / 15)
+
+
+def test_vwap_partial_level(book):
+    assert book.vwap_to_fill(BUY, 1) == 100
+    assert book.vwap_to_fill(BUY, 3) == pytest.approx((2 * 100 + 101) / 3)
+    assert book.vwap_to_fill(BUY, 10) == pytest.approx((200 + 303 + 510) / 10)
+    assert book.vwap_to_fill(SELL, 5) == pytest.approx((4 * 99 + 98) / 5)
+
+
+def test_vwap_not_enough_depth(book):
+    assert book.vwap_to_fill(BUY, 11) is None
+    assert book.vwap_to_fill(SELL, 6) is None
+    assert OrderBook(depth=5).vwap_to_fill(BUY, 1) is None
+
+
+def test_max_lots_partial_level(book):
+    # 2 лота по 100 целиком и ещё один из уровня 101
+    assert book.max_lots(BUY, 350) == 3
+    assert book.max_lots(BUY, 300.99) == 2
+    # Лотность: 10 штук по 100 стоят 1000
+    assert book.max_lots(BUY, 1000, lot=10) == 1
+    assert book.max_lots(BUY, 999, lot=10) == 0
+
+
+def test_max_lots_depth_and_slippage(book):
+    # Денег больше, чем в стакане, — не больше видимой глубины
+    assert book.max_lots(BUY, 1e9) == 10
+    assert book.max_lots(BUY, 1e9, max_slippage=0.005) == 2
+    assert OrderBook(depth=5).max_lots(BUY, 1e9) == 0
+
+
+def test_polled_snapshot_expires():
+    books = OrderBooks(["F"], depth=5, max_age=10)
+    books.on_orderbook("F", levels((99, 1)), levels((100, 1)))
+    assert books.get("F") is not None
+    books.books["F"].received -= 11
+    assert books.get("F") is None
+
+    books.on_orderbook("F", levels((99, 1)), levels((100, 1)), streamed=True)
+    books.books["F"].received -= 11
+    assert books.get("F") is not None
+    books.unsubscribed("F")
+    assert books.get("F") is None
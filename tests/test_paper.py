@@ -0,0 +1,151 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytz")
+pytest.importorskip("grpc")
+pytest.importorskip("tinkoff.invest")
+pytest.importorskip("config")
+
+from tinkoff.invest import OrderDirection
+
+from instruments import Instrument, get_registry
+from paper import PaperBroker
+from risk import NotEnoughMoney, RiskRejected
+from state_store import StateStore
+
+BUY = OrderDirection.ORDER_DIRECTION_BUY
+SELL = OrderDirection.ORDER_DIRECTION_SELL
+SBER = "BBG004730N88"
+
+
+class FakeMarketData:
+    def __init__(self, prices, orderbooks=None):
+        self.prices = prices
+        self.orderbooks = orderbooks
+        self.price_listeners = []
+
+    def last_price(self, figi):
+        return self.prices.get(figi)
+
+    def tick(self, figi, price):
+        self.prices[figi] = price
+        for listener in self.price_listeners:
+            listener(figi, price)
+
+
+@pytest.fixture(autouse=True)
+def lot_of_ten(monkeypatch):
+    monkeypatch.setitem(get_registry().by_figi, SBER,
+                        Instrument(SBER, "SBER", "TQBR", 10, "Сбербанк", "rub", "share"))
+
+
+@pytest.fixture
+def market():
+    return FakeMarketData({SBER: 100.0})
+
+
+@pytest.fixture
+def broker(market):
+    return PaperBroker(market, slippage=0.001, commission=0.001)
+
+
+def test_market_buy_and_sell_bookkeeping(broker, market):
+    account = broker.open_account("a", 10_000).account
+    order = broker.submit(account, SBER, BUY, 2)
+    assert order.status == "filled"
+    assert order.filled_units == 20
+    assert order.avg_price == pytest.approx(100.1)
+    assert account.cash == pytest.approx(10_000 - 2002 - 2.002)
+    assert account.positions[SBER] == [20, pytest.approx(2002)]
+
+    market.prices[SBER] = 110.0
+    order = broker.submit(account, SBER, SELL, 1)
+    assert order.avg_price == pytest.approx(109.89)
+    assert account.cash == pytest.approx(10_000 - 2004.002 + 1098.9 - 1.0989)
+    assert account.positions[SBER] == [10, pytest.approx(1001)]
+    (trades, pnl), = account.daily.values()
+    assert trades == 2
+    assert pnl == pytest.approx((109.89 - 100.1) * 10 - 2.002 - 1.0989)
+
+    broker.submit(account, SBER, SELL, 1)
+    assert SBER not in account.positions
+
+
+def test_market_fill_walks_the_book():
+    book = SimpleNamespace(vwap_to_fill=lambda direction, lots: 100.5 if direction == BUY else 99.5)
+    market = FakeMarketData({SBER: 100.0}, orderbooks=SimpleNamespace(get=lambda figi: book))
+    broker = PaperBroker(market, slippage=0.01, commission=0.0)
+    account = broker.open_account("a", 10_000).account
+    assert broker.submit(account, SBER, BUY, 1).avg_price == 100.5
+    assert broker.submit(account, SBER, SELL, 1).avg_price == 99.5
+
+
+def test_limit_order_rests_until_price_crosses(broker, market):
+    account = broker.open_account("a", 10_000).account
+    order = broker.submit(account, SBER, BUY, 1, limit_price=95.0)
+    assert order.status == "submitted"
+    assert account.cash == 10_000
+
+    market.tick(SBER, 96.0)
+    assert order.status == "submitted"
+    market.tick(SBER, 94.0)
+    assert order.status == "filled"
+    # Не хуже лимита, даже с проскальзыванием
+    assert order.avg_price == pytest.approx(94.094)
+    assert account.quantity(SBER) == 10
+
+    market.tick(SBER, 90.0)
+    assert account.quantity(SBER) == 10
+
+
+def test_cancel_removes_resting_order(broker, market):
+    account = broker.open_account("a", 10_000).account
+    order = broker.submit(account, SBER, BUY, 1, limit_price=95.0)
+    broker.cancel(order)
+    assert order.status == "cancelled"
+    market.tick(SBER, 90.0)
+    assert order.status == "cancelled"
+    assert account.cash == 10_000
+    assert SBER not in account.positions
+    # Исполненную заявку отменить нельзя
+    filled = broker.submit(account, SBER, BUY, 1)
+    assert broker.cancel(filled).status == "filled"
+
+
+def test_resting_order_rejected_when_cash_is_gone(broker, market):
+    account = broker.open_account("a", 1_500).account
+    order = broker.submit(account, SBER, BUY, 1, limit_price=95.0)
+    broker.submit(account, SBER, BUY, 1)
+    market.tick(SBER, 90.0)
+    assert order.status == "rejected"
+    assert account.quantity(SBER) == 10
+
+
+def test_rejections(broker):
+    account = broker.open_account("a", 1_000).account
+    with pytest.raises(NotEnoughMoney):
+        broker.submit(account, SBER, BUY, 1)
+    with pytest.raises(RiskRejected):
+        broker.submit(account, SBER, SELL, 1)
+    with pytest.raises(RiskRejected):
+        broker.submit(account, "UNKNOWN", BUY, 1)
+
+
+def test_max_lots_is_accepted_by_submit(broker):
+    account = broker.open_account("a", 5_000).account
+    lots = broker.max_lots(account, SBER, 100.0)
+    assert lots == 4
+    with pytest.raises(NotEnoughMoney):
+        broker.submit(account, SBER, BUY, lots + 1)
+    broker.submit(account, SBER, BUY, lots)
+
+
+def test_account_survives_restart(market):
+    state = StateStore(":memory:", paper=True)
+    broker = PaperBroker(market, slippage=0.0, commission=0.0, state=state)
+    broker.submit(broker.open_account("a", 10_000).account, SBER, BUY, 3)
+
+    restored = PaperBroker(FakeMarketData({SBER: 100.0}), state=state).open_account("a", 10_000).account
+    assert restored.cash == pytest.approx(7_000)
+    assert restored.positions == {SBER: [30, pytest.approx(3_000)]}
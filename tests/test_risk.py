@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytz")
+pytest.importorskip("grpc")
+pytest.importorskip("tinkoff.invest")
+
+from tinkoff.invest import OrderDirection
+
+from risk import AccountState, NotEnoughMoney, RiskManager, RiskRejected
+
+BUY = OrderDirection.ORDER_DIRECTION_BUY
+SELL = OrderDirection.ORDER_DIRECTION_SELL
+SBER = "BBG004730N88"
+
+
+class FakeRegistry:
+    def lot(self, figi):
+        return 10
+
+
+class FakeLedger:
+    def __init__(self, profit=0.0):
+        self.profit = profit
+
+    def daily_profit(self, day=None, figi=None):
+        return self.profit
+
+
+def make_risk(cash=100_000.0, securities=None, profit=0.0, **limits):
+    account = AccountState("acc", pool=object())
+    account.cash = {"rub": cash}
+    account.securities = dict(securities or {})
+    account.loaded = True
+    limits.setdefault("max_position_value", 50_000)
+    limits.setdefault("daily_loss_limit", 5_000)
+    return RiskManager(account, ledger=FakeLedger(profit), registry=FakeRegistry(), **limits)
+
+
+def test_buy_within_limits_passes():
+    make_risk().check(SBER, BUY, 4, 1000.0)     # 40 шт. на 40 000 ₽
+
+
+def test_max_position_rejects():
+    risk = make_risk(securities={SBER: 20})
+    # 20 шт. уже есть: ещё 4 лота по 1000 дают 60 000 ₽ при лимите 50 000
+    with pytest.raises(RiskRejected, match="лимит"):
+        risk.check(SBER, BUY, 4, 1000.0)
+    risk.check(SBER, BUY, 3, 1000.0)
+    assert risk.max_lots(SBER, 1000.0) == 3
+
+
+def test_not_enough_money_rejects():
+    risk = make_risk(cash=30_000.0)
+    with pytest.raises(NotEnoughMoney):
+        risk.check(SBER, BUY, 4, 1000.0)
+    assert risk.max_lots(SBER, 1000.0) == 3
+
+
+def test_daily_loss_blocks_buys_but_not_sells():
+    risk = make_risk(securities={SBER: 10}, profit=-5_000.0)
+    with pytest.raises(RiskRejected, match="Дневной убыток"):
+        risk.check(SBER, BUY, 1, 1000.0)
+    risk.check(SBER, SELL, 1, 1000.0)
+
+
+def test_sell_more_than_held_rejects():
+    risk = make_risk(securities={SBER: 10})
+    with pytest.raises(RiskRejected):
+        risk.check(SBER, SELL, 2, 1000.0)
+
+
+@pytest.mark.parametrize("lots", [0, -1, 1.5])
+def test_lots_must_be_positive_integer(lots):
+    with pytest.raises(RiskRejected):
+        make_risk().check(SBER, BUY, lots, 1000.0)
+
+
+def test_orders_per_minute_limit():
+    risk = make_risk(max_orders_per_minute=2)
+    risk.check(SBER, BUY, 1, 100.0)
+    risk.check(SBER, BUY, 1, 100.0)
+    with pytest.raises(RiskRejected, match="заявок в минуту"):
+        risk.check(SBER, BUY, 1, 100.0)
+
+
+def test_positions_stream_updates_exposure():
+    risk = make_risk(cash=100_000.0)
+    rub = SimpleNamespace(currency="rub", units=10_000, nano=0)
+    risk.account._apply(SimpleNamespace(
+        money=[SimpleNamespace(available_value=rub)],
+        securities=[SimpleNamespace(figi=SBER, balance=45)],
+    ))
+    assert risk.account.rub() == 10_000
+    # Деньги и позиция из стрима: при цене 1000 денег хватает на лот (10 000 ₽),
+    # но 45 шт. на счёте оставляют до лимита позиции только 5 000 ₽
+    assert risk.max_lots(SBER, 1000.0) == 0
+    assert risk.max_lots(SBER, 100.0) == 10
+    with pytest.raises(RiskRejected, match="лимит"):
+        risk.check(SBER, BUY, 1, 1000.0)
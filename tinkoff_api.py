@@ -0,0 +1,171 @@
+import datetime
+import logging
+from tinkoff.invest import CandleInterval, OrderDirection, OrderType
+from client_pool import get_pool
+from indicators import wilder_rsi
+from portfolio_cache import get_portfolio_cache
+from state_store import get_state_store
+from ledger import get_ledger
+from execution import get_execution_engine
+from instruments import get_registry
+from market_calendar import get_market_calendar
+from orderbook import MAX_BOOK_SLIPPAGE
+from metrics import timed, RPC_LATENCY, RPC_ERRORS
+from config import TINKOFF_API_TOKEN, TINKOFF_ACCOUNT_ID
+
+class TinkoffAPI:
+    def __init__(self):
+        self.token = TINKOFF_API_TOKEN
+        self.pool = get_pool(self.token)
+        self.portfolio = get_portfolio_cache(TINKOFF_ACCOUNT_ID)
+        self.state = get_state_store()
+        self.ledger = get_ledger(TINKOFF_ACCOUNT_ID)
+        self.execution = get_execution_engine(TINKOFF_ACCOUNT_ID)
+        self.risk = self.execution.risk
+        self.calendar = get_market_calendar()
+        # MarketDataEngine со стримом свечей; если задан — читаем данные из памяти
+        self.market_data = None
+
+    def is_market_open(self, figi=None):
+        # По расписанию площадки инструмента из кэша календаря, без запросов
+        return self.calendar.is_open(self.calendar.exchange_for(figi))
+
+    
+    async def get_portfolio(self):
+        return list((await self.portfolio.get()).values())
+
+    async def get_position_by_figi(self, figi):
+        return await self.portfolio.position(figi)
+
+    async def get_last_price(self, figi):
+        if self.market_data and self.market_data.last_price(figi) is not None:
+            return self.market_data.last_price(figi)
+        return await self._fetch_last_price(figi)
+
+    # В RPC_LATENCY — только настоящие запросы, чтения из памяти движка туда не попадают
+    @timed(RPC_LATENCY, RPC_ERRORS, method="get_last_price")
+    async def _fetch_last_price(self, figi):
+        async with self.pool.session() as client:
+            resp = await client.market_data.get_last_prices(figi=[figi])
+            if resp.last_prices:
+                return float(resp.last_prices[0].price.units) + float(resp.last_prices[0].price.nano) / 1e9
+            return None
+
+    def get_orderbook(self, figi):
+        # Свежий стакан из стрима (orderbook.OrderBook) или None — без запросов
+        if self.market_data is None or self.market_data.orderbooks is None:
+            return None
+        return self.market_data.orderbooks.get(figi)
+
+    async def get_lot(self, figi):
+        return get_registry().lot(figi)
+
+    async def get_lot_price_and_max_quantity(self, figi, balance):
+        # Цена за штуку и сколько ЛОТОВ можно купить: с учётом лотности, денег и лимитов риска
+        price = await self.get_last_price(figi)
+        if not price:
+            return None, 0
+        lot = await self.get_lot(figi)
+        await self.risk.account.ensure_loaded()
+        quantity = min(int(balance // (price * lot)), self.risk.max_lots(figi, price))
+        book = self.get_orderbook(figi)
+        if book is not None:
+            # Не больше, чем реально продают в стакане в пределах MAX_BOOK_SLIPPAGE от лучшей цены
+            quantity = min(quantity, book.max_lots(OrderDirection.ORDER_DIRECTION_BUY, balance, lot, MAX_BOOK_SLIPPAGE))
+        return price, quantity
+
+
+    async def get_rsi(self, figi, interval=CandleInterval.CANDLE_INTERVAL_5_MIN, window=14):
+        if self.market_data and self.market_data.tracks(figi, interval):
+            rsi = self.market_data.rsi(figi, interval, window)
+            if rsi is not None:
+                return round(rsi, 2)
+
+        candles = await self._fetch_candles(figi, interval, window + 50)
+        rsi = wilder_rsi([c.close.units + c.close.nano / 1e9 for c in candles], window)
+        if rsi is None:
+            return 50  # fallback
+        return round(rsi, 2)
+
+    @timed(RPC_LATENCY, RPC_ERRORS, method="get_balance")
+    async def get_balance(self) -> float:
+        async with self.pool.session() as client:
+            accounts = await client.users.get_accounts()
+            account_id = accounts.accounts[0].id
+
+            limits = await client.operations.get_withdraw_limits(account_id=account_id)
+            money = limits.money
+            for item in money:
+                if item.currency == "rub":
+                    return float(item.units) + float(item.nano) / 1e9
+
+            return 0.0
+    
+    @timed(RPC_LATENCY, RPC_ERRORS, method="get_candles")
+    async def _fetch_candles(self, figi, interval, count):
+        now = datetime.datetime.utcnow()
+        from_time = now - datetime.timedelta(minutes=interval.value * count)
+
+        async with self.pool.session() as client:
+            return (await client.market_data.get_candles(
+                figi=figi,
+                from_=from_time,
+                to=now,
+                interval=interval
+            )).candles
+
+    # Заявки не таймим здесь: post_order и ошибки пишет ExecutionEngine, время до исполнения — FILL_LATENCY
+    async def buy(self, figi, quantity=1, limit_price=None):
+        # Средняя цена исполнения или None, если заявка не исполнилась за FILL_TIMEOUT.
+        # RiskRejected/NotEnoughMoney и ошибки API пробрасываются — решает вызывающий
+        reference = await self.get_last_price(figi)
+        ticket = await self.execution.submit(
+            figi,
+            OrderDirection.ORDER_DIRECTION_BUY,
+            quantity,
+            order_type=OrderType.ORDER_TYPE_LIMIT if limit_price else OrderType.ORDER_TYPE_MARKET,
+            limit_price=limit_price,
+            reference_price=reference,
+        )
+        # Ждём исполнения по стриму сделок, а не один запрос статуса сразу после заявки
+        ticket = await self.execution.wait_filled(ticket)
+        price = ticket.avg_price
+        if ticket.status == "filled" and price:
+            # Сохраняем цену покупки
+            self.state.update_position(figi, avg_price=price)
+            logging.info(f"✅ {figi}: куплено по цене {price}")
+            return price
+        logging.warning(f"⚠️ Заявка {ticket.order_id} {figi} не исполнена ({ticket.status}).")
+        return None
+
+    async def sell(self, figi, quantity=1, limit_price=None):
+        # Как buy: средняя цена исполнения или None, исключения пробрасываются
+        reference = await self.get_last_price(figi)
+        ticket = await self.execution.submit(
+            figi,
+            OrderDirection.ORDER_DIRECTION_SELL,
+            quantity,
+            order_type=OrderType.ORDER_TYPE_LIMIT if limit_price else OrderType.ORDER_TYPE_MARKET,
+            limit_price=limit_price,
+            reference_price=reference,
+        )
+        ticket = await self.execution.wait_filled(ticket)
+        if ticket.status == "filled":
+            logging.info(f"✅ {figi}: продано по цене {ticket.avg_price}")
+            return ticket.avg_price
+        logging.warning(f"⚠️ Заявка {ticket.order_id} {figi} не исполнена ({ticket.status}).")
+        return None
+
+    async def get_quantity(self, figi):
+        position = await self.get_position_by_figi(figi)
+        if position:
+            return int(position.quantity.units + position.quantity.nano / 1e9)
+        return 0
+    async def get_daily_profit(self):
+        # Считается из локального журнала операций, который догружается в фоне
+        await self.ledger.ensure_synced()
+        return round(self.ledger.daily_profit(), 2)
+
+    async def get_today_transaction_count(self):
+        await self.ledger.ensure_synced()
+        return self.ledger.transaction_count()